@@ -0,0 +1,51 @@
+from typing import Hashable
+
+from scheduler import DownloadScheduler
+
+
+class Rejection:
+    """Отказ в приёме загрузки: причина и через сколько секунд имеет смысл повторить."""
+
+    __slots__ = ("reason", "retry_in")
+
+    def __init__(self, reason: str, retry_in: float):
+        self.reason = reason
+        self.retry_in = retry_in
+
+
+class AdmissionControl:
+    """Решает, брать ли новую загрузку, до того как пользователь получит "⏳".
+
+    Отказ, если общая очередь заполнена, у пользователя уже per_user задач
+    в очереди или прогноз ожидания (по недавней пропускной способности)
+    больше max_wait. Пороги можно менять на лету (команда /admission).
+    """
+
+    def __init__(self, scheduler: DownloadScheduler, max_wait: float, per_user: int):
+        self.scheduler = scheduler
+        self.max_wait = max_wait
+        self.per_user = per_user
+        self.rejected: dict[str, int] = {}
+
+    def room(self, user: Hashable, is_admin: bool = False) -> int:
+        """Сколько ещё задач пользователь может держать в очереди (для пакета ссылок)."""
+        if is_admin:
+            return self.scheduler.max_queue
+        return max(1, self.per_user - self.scheduler.queued(user))
+
+    def predicted_wait(self) -> float:
+        return self.scheduler.expected_wait(self.scheduler.pending + 1)
+
+    def check(self, user: Hashable, is_admin: bool = False) -> Rejection | None:
+        scheduler = self.scheduler
+        wait = self.predicted_wait()
+        rejection = None
+        if scheduler.is_full():
+            rejection = Rejection("queue_full", max(wait, 60))
+        elif not is_admin and scheduler.queued(user) >= self.per_user:
+            rejection = Rejection("user_limit", scheduler.avg_service)
+        elif not is_admin and wait > self.max_wait:
+            rejection = Rejection("overloaded", wait - self.max_wait)
+        if rejection is not None:
+            self.rejected[rejection.reason] = self.rejected.get(rejection.reason, 0) + 1
+        return rejection
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Микробенчмарк rate limiter: стоимость одного сообщения и память на пользователя.
+Для сравнения меряется прежний вариант (defaultdict с deque меток времени).
+"""
+import argparse
+import time
+import tracemalloc
+from collections import defaultdict, deque
+
+from rate_limiter import ALLOWED, FLOOD, LIMITED, RateLimiter
+
+LIMIT = 5
+FLOOD_THRESHOLD = 15
+
+
+def old_hit(user_requests, user_id, now):
+    """Прежняя логика из handle_message."""
+    reqs = user_requests[user_id]
+    while reqs and reqs[0] <= now - 60:
+        reqs.popleft()
+    if len(reqs) >= LIMIT:
+        return LIMITED
+    reqs.append(now)
+    return ALLOWED
+
+
+def bench_speed(users, messages):
+    ids = [(i * 7919) % users for i in range(messages)]
+
+    limiter = RateLimiter(LIMIT, FLOOD_THRESHOLD)
+    now = time.monotonic()
+    start = time.perf_counter()
+    for user_id in ids:
+        limiter.hit(user_id, now)
+    new_ns = (time.perf_counter() - start) / messages * 1e9
+
+    user_requests = defaultdict(deque)
+    now_int = int(time.time())
+    start = time.perf_counter()
+    for user_id in ids:
+        old_hit(user_requests, user_id, now_int)
+    old_ns = (time.perf_counter() - start) / messages * 1e9
+
+    print(f"\n=== Стоимость сообщения ({messages} сообщений, {users} пользователей) ===")
+    print(f"RateLimiter:        {new_ns:8.0f} нс")
+    print(f"defaultdict+deque:  {old_ns:8.0f} нс")
+
+
+def bench_memory(users):
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    limiter = RateLimiter(LIMIT, FLOOD_THRESHOLD)
+    now = time.monotonic()
+    for user_id in range(users):
+        limiter.hit(user_id + 10**9, now)
+    new_bytes = (tracemalloc.get_traced_memory()[0] - base) / users
+    del limiter
+
+    base = tracemalloc.get_traced_memory()[0]
+    user_requests = defaultdict(deque)
+    now_int = int(time.time())
+    for user_id in range(users):
+        old_hit(user_requests, user_id + 10**9, now_int)
+    old_bytes = (tracemalloc.get_traced_memory()[0] - base) / users
+    del user_requests
+    tracemalloc.stop()
+
+    print(f"\n=== Память на пользователя ({users} пользователей) ===")
+    print(f"RateLimiter:        {new_bytes:8.0f} байт")
+    print(f"defaultdict+deque:  {old_bytes:8.0f} байт")
+
+
+def check_eviction_and_flood(users):
+    limiter = RateLimiter(LIMIT, FLOOD_THRESHOLD)
+    now = 1000.0
+    for user_id in range(users):
+        limiter.hit(user_id, now)
+    # Через два окна тишины проход по записям удаляет всех
+    limiter.hit("late", now + 150)
+    print(f"\n=== Вытеснение ===\nПосле {users} пользователей и 150 с тишины в памяти: {len(limiter)}")
+
+    verdicts = [limiter.hit("flooder", now + 200 + i * 0.1) for i in range(FLOOD_THRESHOLD)]
+    print("=== Флуд ===")
+    print(f"Принято {verdicts.count(ALLOWED)}, отклонено {verdicts.count(LIMITED)}, итог: {verdicts[-1]}")
+    assert verdicts[-1] == FLOOD
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    args = parser.parse_args()
+    bench_speed(args.users, args.messages)
+    bench_memory(args.users)
+    check_eviction_and_flood(args.users)
+
+
+if __name__ == "__main__":
+    main()
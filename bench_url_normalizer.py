@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк url_normalizer: сколько ссылок в секунду классифицирует classify
+и сколько стоит повторное разворачивание короткой ссылки из кэша.
+"""
+import argparse
+import time
+
+from test_url_normalizer import CASES, FakeSession
+from url_normalizer import ShortLinkResolver, classify
+
+
+def bench_classify(rounds):
+    urls = [url for url, _ in CASES]
+    total = len(urls) * rounds
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for url in urls:
+            classify(url)
+    elapsed = time.perf_counter() - start
+    print(f"\n=== classify ({total} ссылок) ===")
+    print(f"{total / elapsed:,.0f} ссылок/с, {elapsed / total * 1e6:.2f} мкс на ссылку")
+
+
+def bench_cached_resolve(rounds):
+    short = [f"https://vm.tiktok.com/ZM{i:05d}/" for i in range(100)]
+    redirects = {url: f"https://www.tiktok.com/@user/video/{7300000000000000000 + i}" for i, url in enumerate(short)}
+    resolver = ShortLinkResolver(session=FakeSession(redirects))
+    for url in short:
+        resolver.normalize(url)
+    total = len(short) * rounds
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for url in short:
+            resolver.normalize(url)
+    elapsed = time.perf_counter() - start
+    print(f"\n=== Короткие ссылки из кэша ({total} обращений) ===")
+    print(f"{total / elapsed:,.0f} ссылок/с, {elapsed / total * 1e6:.2f} мкс на ссылку")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rounds", type=int, default=5000)
+    args = parser.parse_args()
+    bench_classify(args.rounds)
+    bench_cached_resolve(args.rounds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк пула YoutubeDL: холодный путь (новый YoutubeDL на каждую операцию,
+как было раньше) против тёплого (экземпляр из ydl_pool, экстракторы и
+HTTP-соединения уже готовы).
+
+По умолчанию делает extract_info(download=False) для ссылок — нужна сеть.
+С --offline меряется только подготовка экземпляра под операцию.
+"""
+import argparse
+import statistics
+import time
+
+import yt_dlp
+
+from video_downloader import VideoDownloader, ydl_pool
+
+DEFAULT_URLS = [
+    "https://www.youtube.com/shorts/aqz-KE-bpKQ",
+    "https://www.tiktok.com/@scout2015/video/6718335390845095173",
+]
+
+
+def cold(url, offline):
+    with yt_dlp.YoutubeDL(VideoDownloader._base_opts()) as ydl:
+        ydl.build_format_selector("best")
+        if not offline:
+            ydl.extract_info(url, download=False)
+
+
+def warm(url, offline):
+    platform = "tiktok" if VideoDownloader.is_tiktok(url) else "youtube"
+    with ydl_pool.lease(platform) as ctx:
+        ctx.prepare("downloads/%(id)s.%(ext)s", "best")
+        if not offline:
+            ctx.ydl.extract_info(url, download=False)
+
+
+def measure(fn, urls, rounds, offline):
+    timings = []
+    for _ in range(rounds):
+        for url in urls:
+            started = time.perf_counter()
+            fn(url, offline)
+            timings.append(time.perf_counter() - started)
+    return timings
+
+
+def report(name, timings):
+    print(f"{name:6} медиана {statistics.median(timings) * 1000:8.1f} мс, "
+          f"среднее {statistics.fmean(timings) * 1000:8.1f} мс, первый {timings[0] * 1000:8.1f} мс")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("urls", nargs="*", default=DEFAULT_URLS)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--offline", action="store_true", help="без сети: только подготовка экземпляра")
+    args = parser.parse_args()
+
+    mode = "подготовка экземпляра" if args.offline else "extract_info"
+    print(f"=== {mode}: {len(args.urls)} ссылок × {args.rounds} ===")
+    report("cold", measure(cold, args.urls, args.rounds, args.offline))
+    report("warm", measure(warm, args.urls, args.rounds, args.offline))
+    print(f"Пул: создано {ydl_pool.created}, переиспользовано {ydl_pool.reused}")
+    ydl_pool.close()
+
+
+if __name__ == "__main__":
+    main()
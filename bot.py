@@ -2,14 +2,19 @@ import os
 import logging
 import asyncio
 import time
+import heapq
+import hashlib
+import hmac
 import json
-import threading
+import re
+import signal
+from contextlib import ExitStack
+from dataclasses import dataclass, field
 from pathlib import Path
+import httpx
 from dotenv import load_dotenv
-from collections import defaultdict, deque
-from http.server import BaseHTTPRequestHandler, HTTPServer
 
-from telegram import Update, InputFile
+from telegram import Update, InputFile, InputMediaVideo, MessageEntity, ReplyParameters
 from telegram.ext import (
     ApplicationBuilder,
     CommandHandler,
@@ -18,7 +23,35 @@ from telegram.ext import (
     filters,
 )
 
-from video_downloader import VideoDownloader
+from video_downloader import (
+    UPLOAD_LIMIT_BYTES,
+    VideoDownloader,
+    VideoTooLarge,
+    strategy_stats,
+)
+from url_normalizer import ShortLinkResolver, classify, video_key as make_video_key
+from file_id_cache import FileIdCache
+from scheduler import DownloadScheduler
+from admission import AdmissionControl, Rejection
+from job_journal import JobJournal
+from rate_limiter import FLOOD as RATE_FLOOD, LIMITED as RATE_LIMITED, RateLimiter
+from inflight import InFlightDownloads
+from storage import UserStore, BanManager
+from download_executor import DownloadExecutor
+from download_cache import DownloadCache
+from status_updater import StatusUpdater
+from broadcast import Broadcast, SendThrottle
+from web_server import WebServer
+from stream_upload import StreamUploadError, upload_stream
+from media_batch import MEDIA_GROUP_MAX, MediaBatch
+from metrics import (
+    bytes_downloaded_total,
+    bytes_uploaded_total,
+    job_failures_total,
+    platform_of,
+    registry as metrics_registry,
+    stage_seconds,
+)
 
 # Load environment variables (expects TELEGRAM_BOT_TOKEN in .env)
 load_dotenv()
@@ -33,23 +66,6 @@ logger = logging.getLogger(__name__)
 # Hide token from logs
 logging.getLogger("httpx").setLevel(logging.WARNING)
 
-# Health server for Render
-def _start_health_server():
-    port = int(os.environ.get("PORT", "10000"))
-
-    class Handler(BaseHTTPRequestHandler):
-        def do_GET(self):
-            self.send_response(200)
-            self.end_headers()
-            self.wfile.write(b"ok")
-
-        def log_message(self, *args):
-            return  # чтобы не спамить логами
-
-    HTTPServer(("0.0.0.0", port), Handler).serve_forever()
-
-threading.Thread(target=_start_health_server, daemon=True).start()
-
 # Initialize video downloader
 downloader = VideoDownloader()
 
@@ -69,11 +85,61 @@ def _parse_admin_ids(value: str | None) -> set[int]:
     return result
 
 
+def _parse_platform_caps(value: str | None) -> dict[str, int]:
+    """"tiktok=4,youtube=6" -> {"tiktok": 4, "youtube": 6}"""
+    result: dict[str, int] = {}
+    for part in (value or "").split(","):
+        name, _, limit = part.partition("=")
+        try:
+            result[name.strip().lower()] = int(limit)
+        except ValueError:
+            continue
+    return result
+
+
 ADMIN_IDS = _parse_admin_ids(os.getenv("ADMIN_IDS"))
 MAX_CONCURRENT = int(os.getenv("MAX_CONCURRENT", "10"))
+QUEUE_MAXSIZE = int(os.getenv("QUEUE_MAXSIZE", "100"))
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", str(MAX_CONCURRENT)))
+DOWNLOAD_TIMEOUT = int(os.getenv("DOWNLOAD_TIMEOUT", "240"))
+WORKER_MAX_JOBS = int(os.getenv("WORKER_MAX_JOBS", "25"))
+# Одновременных загрузок на платформу, например "tiktok=6,youtube=6" (по умолчанию без лимита)
+PLATFORM_MAX_CONCURRENT = _parse_platform_caps(os.getenv("PLATFORM_MAX_CONCURRENT"))
+# Сколько задач админа берётся за один круг очереди (у обычных пользователей — одна)
+ADMIN_QUEUE_WEIGHT = int(os.getenv("ADMIN_QUEUE_WEIGHT", "3"))
+# Не принимать загрузку, если прогноз ожидания в очереди больше (секунд); меняется через /admission
+ADMISSION_MAX_WAIT = int(os.getenv("ADMISSION_MAX_WAIT", "600"))
+USER_MAX_QUEUED = int(os.getenv("USER_MAX_QUEUED", "3"))
+# После перезапуска продолжаем только свежие задачи, упавшие меньше этого числа раз
+JOB_RESUME_MAX_AGE = int(os.getenv("JOB_RESUME_MAX_AGE", "900"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "2"))
 MAX_PER_MINUTE = int(os.getenv("MAX_PER_MINUTE", "5"))
 SPAM_THRESHOLD = int(os.getenv("SPAM_THRESHOLD", "15"))
 SPAM_BAN_MINUTES = int(os.getenv("SPAM_BAN_MINUTES", "10"))
+FILE_ID_CACHE_TTL_HOURS = int(os.getenv("FILE_ID_CACHE_TTL_HOURS", "720"))
+FILE_ID_CACHE_MAX = int(os.getenv("FILE_ID_CACHE_MAX", "5000"))
+FILE_ID_CACHE_FLUSH_SECONDS = int(os.getenv("FILE_ID_CACHE_FLUSH_SECONDS", "30"))
+DOWNLOADS_MAX_MB = int(os.getenv("DOWNLOADS_MAX_MB", "500"))
+USERS_FLUSH_SECONDS = int(os.getenv("USERS_FLUSH_SECONDS", "30"))
+USERS_FLUSH_DIRTY = int(os.getenv("USERS_FLUSH_DIRTY", "50"))
+STATUS_EDIT_INTERVAL = float(os.getenv("STATUS_EDIT_INTERVAL", "3"))
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+# Видео, которому не нужна обработка, идёт из источника сразу в Telegram через буфер в памяти
+STREAM_UPLOAD = os.getenv("STREAM_UPLOAD", "1") != "0"
+STREAM_BUFFER_MB = float(os.getenv("STREAM_BUFFER_MB", "4"))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "8"))
+BROADCAST_REPORT_SECONDS = int(os.getenv("BROADCAST_REPORT_SECONDS", "10"))
+PORT = int(os.getenv("PORT", "10000"))
+# Публичный адрес бота (https://...): если задан, апдейты приходят вебхуком, иначе long polling
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+# 0 — не регистрировать вебхук в Telegram (локальная проверка fake_webhook_sender.py)
+WEBHOOK_REGISTER = os.getenv("WEBHOOK_REGISTER", "1") != "0"
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "32"))
+
+VIDEO_CAPTION = "Вот ваше видео! 🎬\n@tikshorst_dowlonder_bot"
 
 
 def _is_admin(user_id: int | None) -> bool:
@@ -89,92 +155,69 @@ STATS = {
 
 USERS_FILE = Path("users.json")
 BANS_FILE = Path("bans.json")
+FILE_ID_CACHE_FILE = Path("file_ids.json")
+BROADCAST_FILE = Path("broadcast.json")
+JOBS_FILE = Path("jobs.sqlite3")
 
+file_id_cache = FileIdCache(
+    FILE_ID_CACHE_FILE, FILE_ID_CACHE_TTL_HOURS * 3600, FILE_ID_CACHE_MAX, FILE_ID_CACHE_FLUSH_SECONDS
+)
+download_cache = DownloadCache(Path("downloads"), DOWNLOADS_MAX_MB * 1024 * 1024)
+# Правки сообщений "⏳/🔍/⬇️/📤" не чаще раза в STATUS_EDIT_INTERVAL на сообщение
+status_updater = StatusUpdater(STATUS_EDIT_INTERVAL)
+# Health-check для Render и вебхук Telegram на одном порту
+web_server = WebServer("0.0.0.0", PORT)
+# Клиент потоковой отправки (скачивание источника и sendVideo), создаётся в _post_init
+stream_client: httpx.AsyncClient | None = None
 
-def _load_users() -> dict:
-    if USERS_FILE.exists():
-        try:
-            with open(USERS_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except Exception:
-            pass
-    return {}
 
+# Короткие ссылки TikTok разворачиваются один раз, дальше — из LRU
+short_links = ShortLinkResolver()
 
-def _save_users(users: dict) -> None:
-    try:
-        with open(USERS_FILE, "w", encoding="utf-8") as f:
-            json.dump(users, f, ensure_ascii=False, indent=2)
-    except Exception:
-        pass
 
+async def _video_key(url: str) -> str | None:
+    """Канонический ключ видео для кэша: "youtube:<id>" или "tiktok:<id>"."""
+    ref = classify(url)
+    if ref is not None and ref[1] is None:
+        ref = await asyncio.to_thread(short_links.normalize, url)
+    return make_video_key(*ref) if ref and ref[1] else None
 
-def _update_user(user_id: int, first_name: str | None = None) -> None:
-    users = _load_users()
-    uid = str(user_id)
-    now = int(time.time())
-    if uid not in users:
-        users[uid] = {
-            "first_name": first_name or "",
-            "request_count": 0,
-            "last_seen": now,
-        }
-    users[uid]["request_count"] += 1
-    users[uid]["last_seen"] = now
-    if first_name:
-        users[uid]["first_name"] = first_name
-    _save_users(users)
-
-
-def _load_bans() -> dict:
-    if BANS_FILE.exists():
-        try:
-            with open(BANS_FILE, "r", encoding="utf-8") as f:
-                return json.load(f)
-        except Exception:
-            pass
-    return {}
 
+def _key_from_file(video_path: str) -> str | None:
+    # Короткая ссылка, которую не удалось развернуть: ID есть только в имени файла tiktok_<id>.<tag>.<ext>
+    stem = Path(video_path).name.split(".", 1)[0]
+    if stem.startswith("tiktok_") and stem[len("tiktok_"):].isdigit():
+        return make_video_key("tiktok", stem[len("tiktok_"):])
+    return None
 
-def _save_bans(bans: dict) -> None:
-    try:
-        with open(BANS_FILE, "w", encoding="utf-8") as f:
-            json.dump(bans, f, ensure_ascii=False, indent=2)
-    except Exception:
-        pass
 
+user_store = UserStore(USERS_FILE, USERS_FLUSH_SECONDS, USERS_FLUSH_DIRTY)
 
-def _is_banned(user_id: int) -> bool:
-    bans = _load_bans()
-    uid = str(user_id)
-    if uid not in bans:
-        return False
-    until = bans[uid].get("until", 0)
-    return time.time() < until
 
+ban_manager = BanManager(BANS_FILE)
+job_journal = JobJournal(JOBS_FILE)
 
-def _ban_user(user_id: int, reason: str) -> None:
-    bans = _load_bans()
-    uid = str(user_id)
-    until = int(time.time()) + SPAM_BAN_MINUTES * 60
-    bans[uid] = {"until": until, "reason": reason}
-    _save_bans(bans)
 
+# Rate limiting: лимит сообщений в минуту и порог флуда (считаются и отклонённые попытки)
+rate_limiter = RateLimiter(MAX_PER_MINUTE, SPAM_THRESHOLD)
 
-def _unban_user(user_id: int) -> None:
-    bans = _load_bans()
-    uid = str(user_id)
-    if uid in bans:
-        del bans[uid]
-        _save_bans(bans)
 
+@dataclass
+class DownloadJob:
+    """Загрузка: только компактные поля (их же хранит журнал задач), без Update/context."""
 
-# Rate limiting: user_id -> deque of timestamps
-user_requests: defaultdict[int, deque[int]] = defaultdict(lambda: deque())
-# Queue for downloads
-download_queue: asyncio.Queue = asyncio.Queue()
-# Semaphore for concurrent downloads
-download_sem = asyncio.Semaphore(MAX_CONCURRENT)
+    bot: object
+    chat_id: int
+    user_id: int
+    message_id: int
+    processing_message: object
+    url: str
+    job_id: int | None = None
+    video_key: str | None = None
+    flight: object = None
+    # Пакет ссылок из одного сообщения (MediaBatch): видео уходит общей группой
+    batch: object = None
+    enqueued_at: float = field(default_factory=time.monotonic)
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -196,6 +239,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         "1) Отправьте ссылку на видео из TikTok или YouTube Shorts\n"
         "2) Подождите, пока я его скачаю\n"
         "3) Получите видео в ответ ✅\n\n"
+        f"Можно прислать до {MEDIA_GROUP_MAX} ссылок в одном сообщении — видео придут одним альбомом.\n"
         "Если что-то не работает — пришлите другую ссылку."
     )
     await update.message.reply_text(help_message)
@@ -212,24 +256,17 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return
 
     # Ban check
-    if _is_banned(user.id):
+    if ban_manager.is_banned(user.id):
         await message.reply_text("❌ Вы заблокированы. Свяжитесь с админом.")
         return
 
-    # Rate limiting
-    now = int(time.time())
-    reqs = user_requests[user.id]
-    # Remove old requests (>1 minute)
-    while reqs and reqs[0] <= now - 60:
-        reqs.popleft()
-    if len(reqs) >= MAX_PER_MINUTE:
+    # Rate limiting и spam detection
+    verdict = rate_limiter.hit(user.id)
+    if verdict == RATE_LIMITED:
         await message.reply_text("❌ Слишком много запросов. Попробуйте через минуту.")
         return
-    reqs.append(now)
-
-    # Spam detection
-    if len(reqs) >= SPAM_THRESHOLD:
-        _ban_user(user.id, "spam")
+    if verdict == RATE_FLOOD:
+        ban_manager.ban(user.id, "spam", SPAM_BAN_MINUTES * 60)
         # Notify admin
         for admin_id in ADMIN_IDS:
             try:
@@ -243,120 +280,682 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return
 
     # Update user stats
-    _update_user(user.id, user.first_name)
+    user_store.touch(user.id, user.first_name)
 
-    text = message.text.strip()
-
-    # Check if the message is a URL
-    if not (text.startswith("http://") or text.startswith("https://")):
-        await message.reply_text(
-            "Пожалуйста, отправьте валидную ссылку на видео из TikTok или YouTube Shorts."
-        )
+    links = _extract_links(message)
+    if not links:
+        if _URL_RE.search(message.text) or message.parse_entities([MessageEntity.URL, MessageEntity.TEXT_LINK]):
+            await message.reply_text("Извините, я поддерживаю только ссылки из TikTok и YouTube Shorts.")
+        else:
+            await message.reply_text(
+                "Пожалуйста, отправьте валидную ссылку на видео из TikTok или YouTube Shorts."
+            )
+        return
+    if len(links) > 1:
+        await _handle_batch(message, user, context.bot, links)
         return
+    text = links[0]
+
+    # Видео уже отправлялось: отвечаем по file_id без скачивания и загрузки
+    video_key = await _video_key(text)
+    file_id = file_id_cache.get(video_key) if video_key else None
+    if file_id:
+        try:
+            await message.reply_video(video=file_id, caption=VIDEO_CAPTION, supports_streaming=True)
+            STATS["requests_total"] += 1
+            STATS["success_total"] += 1
+            STATS["platform"][platform_of(video_key)] += 1
+            return
+        except Exception as e:
+            logger.warning("file_id из кэша не принят (%s): %s", video_key, e)
+            file_id_cache.invalidate(video_key)
+
+    # Загрузка того же видео уже идёт — присоединение к ней очередь не нагружает
+    if not (video_key and video_key in inflight):
+        rejection = admission.check(user.id, _is_admin(user.id))
+        if rejection is not None:
+            await message.reply_text(_rejection_text(rejection))
+            return
+
+    status = await message.reply_text("⏳ Обрабатываю ваше видео, пожалуйста подождите...")
+    job = DownloadJob(
+        context.bot, message.chat_id, user.id, message.message_id, status_updater.wrap(status), text,
+        video_key=video_key,
+    )
+    job.job_id = job_journal.add(job.chat_id, job.user_id, job.message_id, status.message_id, text)
+    _accept(job)
+
+
+_URL_RE = re.compile(r"https?://[^\s<>\"']+", re.IGNORECASE)
+
+
+def _extract_links(message) -> list[str]:
+    """Поддерживаемые ссылки из сообщения по порядку, без повторов, не больше MEDIA_GROUP_MAX.
+
+    Берутся и сущности URL/TEXT_LINK (ссылки под текстом, ссылки без схемы),
+    и адреса прямо в тексте.
+    """
+    text = message.text
+    utf16 = text.encode("utf-16-le")
+    found = []
+    for entity, value in message.parse_entities([MessageEntity.URL, MessageEntity.TEXT_LINK]).items():
+        # Смещения сущностей — в UTF-16, приводим к позиции в строке для порядка
+        position = len(utf16[: entity.offset * 2].decode("utf-16-le"))
+        found.append((position, entity.url if entity.type == MessageEntity.TEXT_LINK else value))
+    found += [(match.start(), match.group()) for match in _URL_RE.finditer(text)]
+    found.sort(key=lambda item: item[0])
+
+    links, seen = [], set()
+    for _, url in found:
+        url = url.strip().rstrip(".,;:!?)»")
+        if not url.lower().startswith(("http://", "https://")):
+            url = "https://" + url
+        ref = classify(url)
+        if ref is None:
+            continue
+        # Короткие ссылки без id сравниваются как есть: их разворачивает _video_key
+        key = ref if ref[1] else url
+        if key in seen:
+            continue
+        seen.add(key)
+        links.append(url)
+    return links[:MEDIA_GROUP_MAX]
+
+
+async def _handle_batch(message, user, bot, links: list[str]) -> None:
+    """Несколько ссылок в одном сообщении: общий статус, загрузки в пределах лимита пользователя, одна группа."""
+    keys = await asyncio.gather(*(_video_key(url) for url in links))
+    # Короткая и полная ссылка на одно видео — одна загрузка и одно видео в группе
+    seen: set[str] = set()
+    pairs = []
+    for url, key in zip(links, keys):
+        if key is not None:
+            if key in seen:
+                continue
+            seen.add(key)
+        pairs.append((url, key))
+    links, keys = [url for url, _ in pairs], [key for _, key in pairs]
+    if not all(key and key in inflight for key in keys):
+        rejection = admission.check(user.id, _is_admin(user.id))
+        if rejection is not None:
+            await message.reply_text(_rejection_text(rejection))
+            return
+
+    status = await message.reply_text(f"⏳ Обрабатываю {len(links)} видео, пожалуйста подождите...")
+    batch = MediaBatch(status_updater.wrap(status), _accept, _complete_batch)
+    jobs = []
+    for url, key in zip(links, keys):
+        job = DownloadJob(bot, message.chat_id, user.id, message.message_id, None, url, video_key=key, batch=batch)
+        job.processing_message = batch.add(job)
+        job.job_id = job_journal.add(job.chat_id, job.user_id, job.message_id, status.message_id, url)
+        jobs.append(job)
+    _start_batch(batch, jobs)
+
+
+def _start_batch(batch: MediaBatch, jobs: list[DownloadJob]) -> None:
+    _open_batches.add(batch)
+    # Уже загруженные в Telegram видео идут в группу по file_id, без очереди
+    for job in jobs:
+        file_id = file_id_cache.get(job.video_key) if job.video_key else None
+        if file_id:
+            STATS["requests_total"] += 1
+            STATS["platform"][platform_of(job.video_key)] += 1
+            batch.deliver(job, job.video_key, None, file_id)
+    batch.start(admission.room(jobs[0].user_id, _is_admin(jobs[0].user_id)))
+
+
+def _finish_job(job: DownloadJob, ok: bool) -> None:
+    """Итог задачи в журнал; задачи пакета журнал закрывает сам пакет после отправки группы."""
+    if job.batch is None:
+        job_journal.finish(job.job_id, ok)
+    elif not ok:
+        job.batch.fail(job)
+
+
+def _holds_file(job: DownloadJob) -> bool:
+    """Файл сдан пакету и будет отпущен после отправки группы."""
+    return job.batch is not None and job.batch.holds(job)
+
+
+def _accept(job: DownloadJob) -> None:
+    """Присоединяет задачу к идущей загрузке того же видео или ставит её в очередь."""
+    if job.video_key:
+        job.flight, is_leader = inflight.join(job.video_key)
+        if not is_leader:
+            task = asyncio.create_task(serve_waiter(job))
+            _waiter_tasks.add(task)
+            task.add_done_callback(_waiter_tasks.discard)
+            return
+
+    # Своя очередь у каждого пользователя, обход по кругу
+    weight = ADMIN_QUEUE_WEIGHT if _is_admin(job.user_id) else 1
+    if not scheduler.submit(job, job.user_id, platform_of(job.url), weight):
+        if job.flight:
+            inflight.resolve(job.video_key, None)
+            inflight.release(job.video_key, job.flight)
+        job.processing_message.set("❌ Сейчас слишком много загрузок. Попробуйте через пару минут.")
+        _finish_job(job, False)
+
+
+async def run_job(job: DownloadJob) -> None:
+    stage_seconds.observe(time.monotonic() - job.enqueued_at, stage="queue_wait", platform=platform_of(job.url))
+    job_journal.start(job.job_id)
+    ok = await process_download(job)
+    # При отмене (остановка бота) задача остаётся незавершённой и продолжится после старта
+    _finish_job(job, ok)
+
+
+async def _resume_jobs(bot) -> None:
+    """Продолжает загрузки, прерванные перезапуском, или закрывает их с пояснением пользователю."""
+    now = time.time()
+    resumed = failed = 0
+    # Ссылки одного сообщения делят статус: они снова собираются в пакет
+    groups: dict[tuple[int, int], list] = {}
+    for record in job_journal.unfinished():
+        groups.setdefault((record.chat_id, record.status_message_id), []).append(record)
+    for (chat_id, status_message_id), records in groups.items():
+        status = status_updater.wrap_ids(bot, chat_id, status_message_id)
+        first = records[0]
+        if now - first.created_at > JOB_RESUME_MAX_AGE or any(r.attempts >= JOB_MAX_ATTEMPTS for r in records):
+            for record in records:
+                job_journal.finish(record.id, False)
+            status.set("⚠️ Бот перезапускался, и загрузка не завершилась. Отправьте ссылку ещё раз.")
+            failed += len(records)
+            continue
+        batch = MediaBatch(status, _accept, _complete_batch) if len(records) > 1 else None
+        jobs = []
+        for record in records:
+            job_journal.requeue(record.id)
+            job = DownloadJob(
+                bot, record.chat_id, record.user_id, record.message_id, status, record.url,
+                job_id=record.id, video_key=await _video_key(record.url), batch=batch,
+            )
+            if batch is not None:
+                job.processing_message = batch.add(job)
+            jobs.append(job)
+        resumed += len(records)
+        if batch is None:
+            status.set("🔄 Бот перезапустился, продолжаю загрузку...")
+            _accept(jobs[0])
+        else:
+            batch.render("🔄 Бот перезапустился, продолжаю загрузку...")
+            _start_batch(batch, jobs)
+    if resumed or failed:
+        logger.info("Журнал задач: продолжено %d, закрыто %d", resumed, failed)
+
+
+def _format_wait(seconds: float) -> str:
+    if seconds < 60:
+        return "меньше минуты"
+    return f"~{round(seconds / 60)} мин"
+
 
-    # Check if the URL is from a supported platform
-    if not (downloader.is_tiktok(text) or downloader.is_youtube_shorts(text)):
-        await message.reply_text("Извините, я поддерживаю только ссылки из TikTok и YouTube Shorts.")
+def _announce_position(job: DownloadJob, position: int, wait: float) -> None:
+    if wait <= 0:
+        return  # воркер свободен, загрузка начнётся сразу
+    job.processing_message.set(f"⏳ Вы в очереди: {position}-й. Ожидание {_format_wait(wait)}")
+
+
+scheduler = DownloadScheduler(
+    run_job,
+    workers=MAX_CONCURRENT,
+    max_queue=QUEUE_MAXSIZE,
+    platform_caps=PLATFORM_MAX_CONCURRENT,
+    on_position=_announce_position,
+)
+admission = AdmissionControl(scheduler, max_wait=ADMISSION_MAX_WAIT, per_user=USER_MAX_QUEUED)
+
+
+def _rejection_text(rejection: Rejection) -> str:
+    retry = _format_wait(rejection.retry_in)
+    if rejection.reason == "user_limit":
+        return (f"⏳ У вас уже {admission.per_user} видео в очереди. "
+                f"Дождитесь их и отправьте ссылку снова (примерно через {retry}).")
+    if rejection.reason == "overloaded":
+        return (f"😔 Бот сейчас перегружен: ожидание было бы {_format_wait(admission.predicted_wait())}. "
+                f"Попробуйте через {retry}.")
+    return f"❌ Сейчас слишком много загрузок. Попробуйте через {retry}."
+
+
+download_executor = DownloadExecutor(DOWNLOAD_WORKERS, DOWNLOAD_TIMEOUT, WORKER_MAX_JOBS)
+inflight = InFlightDownloads()
+_waiter_tasks: set[asyncio.Task] = set()
+# Пакеты ссылок, группа которых ещё не отправлена
+_open_batches: set[MediaBatch] = set()
+
+
+def _hit_ratio(hits: int, misses: int) -> float:
+    total = hits + misses
+    return hits / total if total else 0.0
+
+
+# Значения снимаются при каждом запросе /metrics
+metrics_registry.callback(
+    "bot_queue_depth", "Задач в очереди загрузки", (), "gauge", lambda: [((), scheduler.pending)]
+)
+metrics_registry.callback(
+    "bot_active_workers", "Задач загрузки в работе", (), "gauge", lambda: [((), scheduler.active)]
+)
+metrics_registry.callback(
+    "bot_busy_processes", "Занятых процессов загрузки", (), "gauge", lambda: [((), download_executor.busy)]
+)
+metrics_registry.callback(
+    "bot_cache_lookups_total", "Обращения к кэшам", ("cache", "result"), "counter",
+    lambda: [
+        (("file_id", "hit"), file_id_cache.hits),
+        (("file_id", "miss"), file_id_cache.misses),
+        (("download", "hit"), download_cache.hits),
+        (("download", "miss"), download_cache.misses),
+        (("short_link", "hit"), short_links.hits),
+        (("short_link", "miss"), short_links.misses),
+    ],
+)
+metrics_registry.callback(
+    "bot_cache_hit_ratio", "Доля попаданий в кэш", ("cache",), "gauge",
+    lambda: [
+        (("file_id",), _hit_ratio(file_id_cache.hits, file_id_cache.misses)),
+        (("download",), _hit_ratio(download_cache.hits, download_cache.misses)),
+    ],
+)
+metrics_registry.callback(
+    "bot_admission_rejected_total", "Отказы в приёме загрузки", ("reason",), "counter",
+    lambda: [((reason,), count) for reason, count in sorted(admission.rejected.items())],
+)
+metrics_registry.callback(
+    "bot_predicted_wait_seconds", "Прогноз ожидания для новой загрузки", (), "gauge",
+    lambda: [((), admission.predicted_wait())],
+)
+metrics_registry.callback(
+    "bot_rate_limiter_users", "Пользователей в памяти rate limiter", (), "gauge", lambda: [((), len(rate_limiter))]
+)
+metrics_registry.callback(
+    "bot_download_cache_bytes", "Размер кэша загрузок", (), "gauge", lambda: [((), download_cache.total_bytes)]
+)
+metrics_registry.callback(
+    "bot_requests_total", "Запросы на скачивание", ("result",), "counter",
+    lambda: [
+        (("total",), STATS["requests_total"]),
+        (("success",), STATS["success_total"]),
+        (("fail",), STATS["fail_total"]),
+    ],
+)
+
+
+def _release_video(video_key: str | None, flight, video_path: str | None) -> None:
+    """Отпускает файл, когда его отправил последний из ожидающих.
+
+    Файл из кэша загрузок открепляется (дальше им распоряжается LRU),
+    файл без ключа кэша удаляется.
+    """
+    if flight is not None and not inflight.release(video_key, flight):
+        return
+    if not video_path:
         return
+    if video_key and download_cache.release(video_key):
+        return
+    if os.path.exists(video_path):
+        try:
+            os.remove(video_path)
+            logger.info("Файл удален: %s", video_path)
+        except OSError:
+            pass
 
-    processing_message = await message.reply_text("⏳ Обрабатываю ваше видео, пожалуйста подождите...")
 
-    # Add to queue
-    await download_queue.put((update, context, processing_message, text))
+async def _download_video(
+    processing_message, text: str, video_key: str | None, stream: bool = False
+) -> tuple[str | dict | None, str | None]:
+    """Берёт видео из кэша загрузок или скачивает его и кладёт в кэш.
 
+    Возвращает (путь, ключ кэша); путь None — ошибка уже показана пользователю.
+    Ключ может появиться только после загрузки (короткие ссылки TikTok).
+    stream=True: вместо пути может вернуться план потоковой отправки (dict),
+    выбранный тем же вызовом в пуле и по тому же probe, что и загрузка.
+    """
+    if video_key:
+        cached_path = download_cache.acquire(video_key)
+        if cached_path:
+            logger.info("Видео из кэша загрузок: %s", cached_path)
+            return cached_path, video_key
 
-async def worker():
-    """Background worker to process downloads with concurrency limit."""
-    while True:
-        task = await download_queue.get()
-        update, context, processing_message, url = task
-        async with download_sem:
-            try:
-                await process_download(update, context, processing_message, url)
-            except Exception as e:
-                logger.exception("Worker error: %s", e)
-            finally:
-                download_queue.task_done()
+    # Обновляем статус для пользователя
+    await processing_message.edit_text("🔍 Поиск видео...")
 
+    def on_progress(fraction: float) -> None:
+        processing_message.set(f"{label} {fraction:.0%}")
 
-async def process_download(update: Update, context: ContextTypes.DEFAULT_TYPE, processing_message, text: str) -> None:
-    """Actual download and send logic."""
-    video_path = None
     try:
-        STATS["requests_total"] += 1
-        
-        # Обновляем статус для пользователя
-        await processing_message.edit_text("🔍 Поиск видео...")
-        
         if downloader.is_tiktok(text):
-            STATS["platform"]["tiktok"] += 1
-            await processing_message.edit_text("⬇️ Скачивание TikTok видео...")
+            label = "⬇️ Скачивание TikTok видео..."
+            await processing_message.edit_text(label)
             logger.info("Начало загрузки TikTok: %s", text)
-            video_path = await asyncio.to_thread(downloader.download_tiktok, text)
+            video_path = await download_executor.run(
+                VideoDownloader.download_tiktok, text, stream, on_progress=on_progress
+            )
             logger.info("Результат загрузки TikTok: %s", video_path)
         else:
-            STATS["platform"]["youtube"] += 1
-            await processing_message.edit_text("⬇️ Скачивание YouTube видео...")
+            label = "⬇️ Скачивание YouTube видео..."
+            await processing_message.edit_text(label)
             logger.info("Начало загрузки YouTube: %s", text)
-            video_path = await asyncio.to_thread(downloader.download_youtube_shorts, text)
+            video_path = await download_executor.run(
+                VideoDownloader.download_youtube_shorts, text, stream, on_progress=on_progress
+            )
             logger.info("Результат загрузки YouTube: %s", video_path)
+    except VideoTooLarge as e:
+        job_failures_total.inc(platform=platform_of(text), cause="too_large")
+        await processing_message.edit_text(f"❌ {e}")
+        logger.info("Слишком большое видео (%s): %s", e.size, text)
+        return None, video_key
+
+    if not video_path:
+        job_failures_total.inc(platform=platform_of(text), cause="no_file")
+        await processing_message.edit_text("❌ Не удалось скачать видео. Попробуй другую ссылку или повтори позже.")
+        logger.warning("Не удалось скачать видео: %s", text)
+        return None, video_key
+
+    if isinstance(video_path, dict):
+        # План потоковой отправки: файла нет, отправляет _stream_video
+        return video_path, video_key
+
+    if not os.path.exists(video_path):
+        await processing_message.edit_text("❌ Не удалось загрузить видео (файл не найден)")
+        logger.error("Файл не существует: %s", video_path)
+        return None, video_key
+
+    file_size = os.path.getsize(video_path)
+    logger.info("Файл найден: %s, размер: %d bytes", video_path, file_size)
+
+    if file_size == 0:
+        job_failures_total.inc(platform=platform_of(text), cause="empty_file")
+        await processing_message.edit_text("❌ Файл видео пустой")
+        logger.error("Файл пустой: %s", video_path)
+        os.remove(video_path)
+        return None, video_key
+
+    if file_size > UPLOAD_LIMIT_BYTES:
+        job_failures_total.inc(platform=platform_of(text), cause="too_large")
+        await processing_message.edit_text(f"❌ {VideoTooLarge(file_size)}")
+        logger.error("Файл больше лимита Telegram: %s (%d bytes)", video_path, file_size)
+        os.remove(video_path)
+        return None, video_key
+
+    video_key = video_key or _key_from_file(video_path)
+    if video_key:
+        video_path = download_cache.put(video_key, video_path)
+    return video_path, video_key
+
+
+async def _send_video(job: DownloadJob, video_key: str | None, video_path: str, file_id: str | None = None) -> bool:
+    """Отправляет видео пользователю: по file_id, если его уже загрузил другой запрос, иначе файлом.
+
+    Видео из пакета не отправляется сразу, а сдаётся пакету для общей группы.
+    """
+    if job.batch is not None:
+        job.batch.deliver(job, video_key, video_path, file_id)
+        return True
+    processing_message = job.processing_message
+    await processing_message.edit_text("📤 Отправка видео...")
+    # Исходное сообщение могли удалить, пока шла загрузка
+    reply_to = ReplyParameters(message_id=job.message_id, allow_sending_without_reply=True)
 
-        if not video_path:
-            await processing_message.edit_text("❌ Не удалось скачать видео. Попробуй другую ссылку или повтори позже.")
-            logger.warning("Не удалось скачать видео: %s", text)
-            return
-            
-        if not os.path.exists(video_path):
-            await processing_message.edit_text("❌ Не удалось загрузить видео (файл не найден)")
-            logger.error("Файл не существует: %s", video_path)
-            return
-            
-        file_size = os.path.getsize(video_path)
-        logger.info("Файл найден: %s, размер: %d bytes", video_path, file_size)
-        
-        if file_size == 0:
-            await processing_message.edit_text("❌ Файл видео пустой")
-            logger.error("Файл пустой: %s", video_path)
-            return
-
-        await processing_message.edit_text("📤 Отправка видео...")
-        
-        try:
+    try:
+        if file_id:
+            await job.bot.send_video(
+                chat_id=job.chat_id,
+                video=file_id,
+                caption=VIDEO_CAPTION,
+                supports_streaming=True,
+                reply_parameters=reply_to,
+            )
+        else:
+            started = time.monotonic()
             with open(video_path, "rb") as video_file:
                 input_file = InputFile(video_file, filename=os.path.basename(video_path) or "video.mp4")
-                await update.message.reply_video(
+                sent = await job.bot.send_video(
+                    chat_id=job.chat_id,
                     video=input_file,
-                    caption="Вот ваше видео! 🎬\n@tikshorst_dowlonder_bot",
+                    caption=VIDEO_CAPTION,
                     supports_streaming=True,
+                    reply_parameters=reply_to,
                 )
-            logger.info("Видео успешно отправлено")
-        except Exception as send_error:
-            logger.exception("Ошибка при отправке видео: %s", send_error)
-            await processing_message.edit_text(f"❌ Ошибка отправки: {send_error}")
-            return
+            platform = platform_of(video_key or video_path)
+            stage_seconds.observe(time.monotonic() - started, stage="upload", platform=platform)
+            bytes_uploaded_total.inc(os.path.getsize(video_path), platform=platform)
+            if video_key and sent and sent.video:
+                file_id_cache.put(video_key, sent.video.file_id)
+        logger.info("Видео успешно отправлено")
+    except Exception as send_error:
+        job_failures_total.inc(platform=platform_of(video_key or video_path), cause="upload")
+        logger.exception("Ошибка при отправке видео: %s", send_error)
+        await processing_message.edit_text(f"❌ Ошибка отправки: {send_error}")
+        return False
+
+    STATS["success_total"] += 1
+
+    await processing_message.delete()
+    return True
+
+
+def _video_source(stack: ExitStack, video_path: str | None, file_id: str | None):
+    if file_id:
+        return file_id
+    video_file = stack.enter_context(open(video_path, "rb"))
+    return InputFile(video_file, filename=os.path.basename(video_path) or "video.mp4")
 
+
+def _record_upload(video_key: str | None, video_path: str | None, file_id: str | None, message) -> None:
+    if file_id:
+        return
+    bytes_uploaded_total.inc(os.path.getsize(video_path), platform=platform_of(video_key or video_path))
+    if video_key and message and message.video:
+        file_id_cache.put(video_key, message.video.file_id)
+
+
+async def _send_group(delivered: list) -> list[bool]:
+    """Отправляет видео пакета одной группой (send_media_group) и запоминает их file_id.
+
+    Одно негодное видео (например, устаревший file_id из кэша) валит всю
+    группу — тогда видео отправляются по одному, а отвергнутые file_id
+    удаляются из кэша. Возвращает успех по каждому видео.
+    """
+    job = delivered[0][0]
+    reply_to = ReplyParameters(message_id=job.message_id, allow_sending_without_reply=True)
+    platform = platform_of(job.video_key or job.url)
+    started = time.monotonic()
+    # В группе должно быть от двух видео
+    if len(delivered) > 1:
+        try:
+            with ExitStack() as stack:
+                media = [
+                    InputMediaVideo(
+                        _video_source(stack, video_path, file_id),
+                        caption=VIDEO_CAPTION if n == 0 else None,
+                        supports_streaming=True,
+                    )
+                    for n, (_, _, video_path, file_id) in enumerate(delivered)
+                ]
+                sent = await job.bot.send_media_group(chat_id=job.chat_id, media=media, reply_parameters=reply_to)
+        except Exception as e:
+            logger.warning("Группа из %d видео не принята (%s), отправляю по одному", len(delivered), e)
+        else:
+            stage_seconds.observe(time.monotonic() - started, stage="upload", platform=platform)
+            for (_, video_key, video_path, file_id), message in zip(delivered, sent):
+                _record_upload(video_key, video_path, file_id, message)
+            STATS["success_total"] += len(delivered)
+            logger.info("Группа из %d видео отправлена", len(delivered))
+            return [True] * len(delivered)
+
+    results = []
+    for _, video_key, video_path, file_id in delivered:
+        try:
+            with ExitStack() as stack:
+                message = await job.bot.send_video(
+                    chat_id=job.chat_id,
+                    video=_video_source(stack, video_path, file_id),
+                    caption=VIDEO_CAPTION,
+                    supports_streaming=True,
+                    reply_parameters=reply_to,
+                )
+        except Exception as send_error:
+            job_failures_total.inc(platform=platform_of(video_key or video_path), cause="upload")
+            if file_id and video_key:
+                file_id_cache.invalidate(video_key)
+            logger.exception("Ошибка при отправке видео из пакета (%s): %s", video_key, send_error)
+            results.append(False)
+            continue
+        _record_upload(video_key, video_path, file_id, message)
         STATS["success_total"] += 1
+        results.append(True)
+    stage_seconds.observe(time.monotonic() - started, stage="upload", platform=platform)
+    return results
+
+
+async def _complete_batch(batch: MediaBatch) -> None:
+    """Все ссылки пакета скачаны или упали: одна группа, затем файлы и журнал."""
+    delivered = batch.delivered()
+    results = []
+    try:
+        if delivered:
+            batch.render("📤 Отправка видео...")
+            results = await _send_group(delivered)
+    finally:
+        _open_batches.discard(batch)
+        for job, video_key, video_path, _ in delivered:
+            _release_video(video_key, job.flight, video_path)
+        sent = {id(job): ok for (job, *_), ok in zip(delivered, results)}
+        for item in batch.items:
+            job_journal.finish(item.job.job_id, sent.get(id(item.job), False))
+
+    count = sum(sent.values())
+    if count == len(batch.items):
+        await batch.status.delete()
+        return
+    for item in batch.items:
+        if item.result is not None:
+            item.text = "✅ Отправлено" if sent.get(id(item.job)) else "❌ Ошибка отправки"
+    batch.render(f"📦 Отправлено {count} из {len(batch.items)} видео")
+
+
+def _can_stream(job: DownloadJob) -> bool:
+    # Видео пакета уходят группой: нужен файл или file_id, поток не подходит
+    return STREAM_UPLOAD and stream_client is not None and job.batch is None and bool(job.video_key)
+
+
+async def _stream_video(job: DownloadJob, plan: dict) -> bool | None:
+    """Скачивает и одновременно отправляет видео по плану, без файла на диске.
+
+    None — поток не удался до того, как Telegram получил файл: нужен обычный путь.
+    """
+    processing_message = job.processing_message
+    label = "📤 Скачивание и отправка видео..."
+    await processing_message.edit_text(label)
+
+    def on_progress(sent: int, total: int | None) -> None:
+        if total:
+            processing_message.set(f"{label} {sent / total:.0%}")
+
+    fields = {
+        "chat_id": job.chat_id,
+        "caption": VIDEO_CAPTION,
+        "supports_streaming": True,
+        "duration": plan["duration"],
+        "width": plan["width"],
+        "height": plan["height"],
+        "reply_parameters": {"message_id": job.message_id, "allow_sending_without_reply": True},
+    }
+    platform = platform_of(job.video_key)
+    started = time.monotonic()
+    try:
+        sent = await upload_stream(
+            stream_client, f"{job.bot.base_url}/sendVideo", fields, plan,
+            buffer_bytes=int(STREAM_BUFFER_MB * 1024 * 1024), on_progress=on_progress,
+            timeout=DOWNLOAD_TIMEOUT,
+        )
+    except StreamUploadError as e:
+        if not e.body_sent:
+            logger.warning("Потоковая отправка не удалась (%s), качаем в файл: %s", job.video_key, e)
+            return None
+        # Файл дошёл до Telegram, ответа нет: повтор мог бы прислать видео дважды
+        job_failures_total.inc(platform=platform, cause="upload")
+        logger.exception("Потоковая отправка без ответа (%s): %s", job.video_key, e)
+        await processing_message.edit_text(f"❌ Ошибка отправки: {e}")
+        return False
+
+    size = (sent.get("video") or {}).get("file_size") or plan["size"] or 0
+    stage_seconds.observe(time.monotonic() - started, stage="stream", platform=platform)
+    bytes_downloaded_total.inc(size, platform=platform)
+    bytes_uploaded_total.inc(size, platform=platform)
+    STATS["success_total"] += 1
+    if sent.get("video"):
+        file_id_cache.put(job.video_key, sent["video"]["file_id"])
+    logger.info("Видео отправлено потоком: %s", job.video_key)
+    await processing_message.delete()
+    return True
+
 
-        await processing_message.delete()
+async def _report_error(job: DownloadJob, e: Exception) -> None:
+    STATS["fail_total"] += 1
+    logger.exception("Общая ошибка при обработке ссылки: %s", e)
+    await job.processing_message.edit_text(f"❌ Ошибка: {e}")
 
+
+async def process_download(job: DownloadJob) -> bool:
+    """Actual download and send logic (ведущий запрос single-flight). True — видео отправлено."""
+    video_path = None
+    video_key = job.video_key
+    try:
+        STATS["requests_total"] += 1
+        STATS["platform"][platform_of(job.url)] += 1
+        streamed = None
         try:
-            os.remove(video_path)
-            logger.info("Файл удален: %s", video_path)
-        except OSError:
-            pass
+            result, video_key = await _download_video(job.processing_message, job.url, video_key, _can_stream(job))
+            if isinstance(result, dict):
+                streamed = await _stream_video(job, result)
+                result = None
+                if streamed is None:
+                    result, video_key = await _download_video(job.processing_message, job.url, video_key)
+            video_path = result
+        finally:
+            # Будим ожидающих, даже если загрузка упала или была отменена.
+            # После потоковой отправки файла нет — ожидающие получат file_id
+            if job.flight is not None:
+                inflight.resolve(video_key, video_path)
+        if streamed is not None:
+            return streamed
+        if video_path:
+            return await _send_video(job, video_key, video_path)
+        return False
+    except Exception as e:
+        # JobTimeout, WorkerCrashed и прочие неожиданные ошибки
+        job_failures_total.inc(platform=platform_of(job.url), cause=type(e).__name__)
+        await _report_error(job, e)
+        return False
+    finally:
+        if not _holds_file(job):
+            _release_video(video_key, job.flight, video_path)
+
 
+async def serve_waiter(job: DownloadJob) -> None:
+    """Запрос, присоединившийся к уже идущей загрузке того же видео."""
+    video_path = None
+    ok = False
+    try:
+        STATS["requests_total"] += 1
+        STATS["platform"][platform_of(job.video_key or job.url)] += 1
+        video_path = await job.flight.wait()
+        # Ведущий запрос мог уже загрузить файл в Telegram (или отправить потоком, без файла)
+        file_id = file_id_cache.get(job.video_key)
+        if not video_path and not file_id:
+            await job.processing_message.edit_text(
+                "❌ Не удалось скачать видео. Попробуй другую ссылку или повтори позже."
+            )
+        else:
+            ok = await _send_video(job, job.video_key, video_path, file_id)
     except Exception as e:
-        STATS["fail_total"] += 1
-        logger.exception("Общая ошибка при обработке ссылки: %s", e)
-        try:
-            await processing_message.edit_text(f"❌ Ошибка: {e}")
-        except Exception:
-            await update.message.reply_text(f"❌ Ошибка: {e}")
-        if video_path and os.path.exists(video_path):
-            try:
-                os.remove(video_path)
-            except OSError:
-                pass
+        await _report_error(job, e)
+    finally:
+        if not _holds_file(job):
+            _release_video(job.video_key, job.flight, video_path)
+    _finish_job(job, ok)
 
 
 async def ping_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -374,14 +973,19 @@ async def adminhelp_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
         "/topusers — топ пользователей по количеству запросов\n"
         "/users — список всех user_id, кто когда-либо писал боту\n"
         "/info <user_id> — информация по пользователю (сколько запросов, последняя активность)\n"
-        "/broadcast <сообщение> — отправить всем пользователям (аккуратно, не спамить)\n"
+        "/broadcast <сообщение> — отправить всем пользователям в фоне (аккуратно, не спамить)\n"
+        "/broadcast_stop — приостановить рассылку\n"
+        "/broadcast_resume — продолжить прерванную рассылку\n"
+        "/broadcast_cancel — отменить рассылку\n"
         "/adminhelp — показать все админ-команды\n"
         "/ping — проверить, что бот жив\n"
         "/ban <user_id> [причина] — забанить пользователя\n"
         "/unban <user_id> — разбанить пользователя (пользователь получит уведомление)\n"
         "/banned — список заблокированных и время до разбана\n"
         "/queue — состояние очереди и активных загрузок\n"
-        "/limits — текущие лимиты и пороги"
+        "/limits — текущие лимиты и пороги\n"
+        "/strategies — статистика стратегий загрузки\n"
+        "/admission [параметр значение] — пороги приёма загрузок (max_wait, per_user, queue)"
     )
     await update.message.reply_text(text)
 
@@ -389,11 +993,11 @@ async def adminhelp_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
 async def topusers_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not _is_admin(update.effective_user.id):
         return
-    users = _load_users()
+    users = user_store.users
     if not users:
         await update.message.reply_text("Пользователей пока нет.")
         return
-    sorted_users = sorted(users.items(), key=lambda kv: kv[1].get("request_count", 0), reverse=True)[:10]
+    sorted_users = heapq.nlargest(10, users.items(), key=lambda kv: kv[1].get("request_count", 0))
     lines = ["👥 Топ пользователей (по запросам):\n"]
     for uid, data in sorted_users:
         name = data.get("first_name", "")
@@ -405,7 +1009,7 @@ async def topusers_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -
 async def users_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not _is_admin(update.effective_user.id):
         return
-    users = _load_users()
+    users = user_store.users
     if not users:
         await update.message.reply_text("Пользователей пока нет.")
         return
@@ -427,9 +1031,8 @@ async def info_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
     except ValueError:
         await update.message.reply_text("Неверный user_id.")
         return
-    users = _load_users()
     uid = str(target_id)
-    data = users.get(uid)
+    data = user_store.get(uid)
     if not data:
         await update.message.reply_text("Пользователь не найден.")
         return
@@ -456,7 +1059,7 @@ async def ban_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
         await update.message.reply_text("Неверный user_id.")
         return
     reason = " ".join(context.args[1:]) or "админ"
-    _ban_user(target_id, reason)
+    ban_manager.ban(target_id, reason, SPAM_BAN_MINUTES * 60)
     await update.message.reply_text(f"✅ Пользователь {target_id} забанен. Причина: {reason}")
 
 
@@ -471,7 +1074,9 @@ async def unban_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     except ValueError:
         await update.message.reply_text("Неверный user_id.")
         return
-    _unban_user(target_id)
+    if not ban_manager.unban(target_id):
+        await update.message.reply_text(f"Пользователь {target_id} не заблокирован.")
+        return
     await update.message.reply_text(f"✅ Пользователь {target_id} разбанен.")
     # Notify user
     try:
@@ -483,27 +1088,36 @@ async def unban_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
 async def banned_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not _is_admin(update.effective_user.id):
         return
-    bans = _load_bans()
+    bans = ban_manager.active()
     if not bans:
         await update.message.reply_text("Заблокированных нет.")
         return
     now = int(time.time())
     lines = ["🚨 Заблокированные:"]
-    for uid, data in bans.items():
-        until = data.get("until", 0)
-        reason = data.get("reason", "")
-        if until > now:
-            remaining = int((until - now) // 60)
-            lines.append(f"{uid}: {reason} (осталось {remaining} мин)")
+    for uid, data in bans:
+        remaining = int((data.get("until", 0) - now) // 60)
+        lines.append(f"{uid}: {data.get('reason', '')} (осталось {remaining} мин)")
     await update.message.reply_text("\n".join(lines))
 
 
 async def queue_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not _is_admin(update.effective_user.id):
         return
-    qsize = download_queue.qsize()
-    active = MAX_CONCURRENT - download_sem._value
-    await update.message.reply_text(f"📦 Очередь: {qsize} задач\n🔧 Активных загрузок: {active}/{MAX_CONCURRENT}")
+    running = ", ".join(
+        f"{name} {count}" + (f"/{PLATFORM_MAX_CONCURRENT[name]}" if name in PLATFORM_MAX_CONCURRENT else "")
+        for name, count in sorted(scheduler.running.items())
+    ) or "—"
+    journal = job_journal.counts()
+    await update.message.reply_text(
+        f"📦 Очередь: {scheduler.pending}/{scheduler.max_queue} задач "
+        f"от {len(scheduler.queued_by_user())} пользователей\n"
+        f"🔧 Активных загрузок: {scheduler.active}/{scheduler.workers}\n"
+        f"📊 По платформам: {running}\n"
+        f"⏱ Среднее время обработки: {scheduler.avg_service:.1f} с\n"
+        f"⚙️ Процессов загрузки занято: {download_executor.busy}/{download_executor.size}\n"
+        f"🗂 Журнал: в очереди {journal.get('queued', 0)}, выполняется {journal.get('running', 0)}, "
+        f"готово {journal.get('done', 0)}, ошибок {journal.get('failed', 0)}"
+    )
 
 
 async def limits_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -512,6 +1126,13 @@ async def limits_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     text = (
         f"⚙️ Текущие лимиты:\n\n"
         f"MAX_CONCURRENT: {MAX_CONCURRENT}\n"
+        f"QUEUE_MAXSIZE: {scheduler.max_queue}\n"
+        f"DOWNLOAD_WORKERS: {DOWNLOAD_WORKERS}\n"
+        f"DOWNLOAD_TIMEOUT: {DOWNLOAD_TIMEOUT} с\n"
+        f"PLATFORM_MAX_CONCURRENT: {PLATFORM_MAX_CONCURRENT or 'без лимита'}\n"
+        f"ADMIN_QUEUE_WEIGHT: {ADMIN_QUEUE_WEIGHT}\n"
+        f"ADMISSION_MAX_WAIT: {admission.max_wait} с\n"
+        f"USER_MAX_QUEUED: {admission.per_user}\n"
         f"MAX_PER_MINUTE: {MAX_PER_MINUTE}\n"
         f"SPAM_THRESHOLD: {SPAM_THRESHOLD}\n"
         f"SPAM_BAN_MINUTES: {SPAM_BAN_MINUTES}"
@@ -519,26 +1140,166 @@ async def limits_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     await update.message.reply_text(text)
 
 
+async def admission_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not _is_admin(update.effective_user.id):
+        return
+    if len(context.args) == 2:
+        name, value = context.args
+        try:
+            number = int(value)
+        except ValueError:
+            number = 0
+        if number <= 0:
+            await update.message.reply_text("Значение должно быть положительным числом.")
+            return
+        if name == "max_wait":
+            admission.max_wait = number
+        elif name == "per_user":
+            admission.per_user = number
+        elif name == "queue":
+            scheduler.max_queue = number
+        else:
+            await update.message.reply_text("Параметры: max_wait, per_user, queue")
+            return
+        logger.info("Админ %s изменил порог приёма %s = %d", update.effective_user.id, name, number)
+    elif context.args:
+        await update.message.reply_text("Использование: /admission [max_wait|per_user|queue <число>]")
+        return
+
+    rate = scheduler.throughput()
+    rejected = ", ".join(f"{reason} {count}" for reason, count in sorted(admission.rejected.items())) or "нет"
+    await update.message.reply_text(
+        f"🚦 Приём загрузок:\n\n"
+        f"max_wait: {admission.max_wait} с (прогноз сейчас {admission.predicted_wait():.0f} с)\n"
+        f"per_user: {admission.per_user} задач в очереди\n"
+        f"queue: {scheduler.max_queue} (занято {scheduler.pending})\n"
+        f"Пропускная способность: {f'{rate * 60:.1f} задач/мин' if rate else 'мало данных'}\n"
+        f"Отказов: {rejected}\n\n"
+        f"Изменить: /admission max_wait 300"
+    )
+
+
+async def strategies_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not _is_admin(update.effective_user.id):
+        return
+    stats = strategy_stats.snapshot()
+    if not stats:
+        await update.message.reply_text("Статистики стратегий пока нет.")
+        return
+    now = time.time()
+    lines = ["🧭 Стратегии загрузки (в порядке попыток):"]
+    for platform, by_name in stats.items():
+        lines.append(f"\n{platform}:")
+        for name in strategy_stats.order(platform, list(by_name)):
+            data = by_name[name]
+            line = (
+                f"• {name}: успех {data['success'] * 100:.0f}%, {data['latency']:.1f} с, "
+                f"попыток {data['attempts']}, ошибок {data['failures']}"
+            )
+            cooldown = data.get("cooldown_until", 0) - now
+            if cooldown > 0:
+                line += f" ⏸ пауза {int(cooldown // 60) + 1} мин"
+            lines.append(line)
+    await update.message.reply_text("\n".join(lines))
+
+
+_broadcast_task: asyncio.Task | None = None
+
+
+def _broadcast_running() -> bool:
+    return _broadcast_task is not None and not _broadcast_task.done()
+
+
+async def _run_broadcast(broadcast: Broadcast, status) -> None:
+    started = time.monotonic()
+    try:
+        await broadcast.run(status.set, BROADCAST_REPORT_SECONDS)
+    except asyncio.CancelledError:
+        status.set(f"{broadcast.progress_text()}\n\n⏸ Остановлена. /broadcast_resume — продолжить")
+        raise
+    except Exception as e:
+        logger.exception("Рассылка упала: %s", e)
+        status.set(f"{broadcast.progress_text()}\n\n❌ Ошибка: {e}. /broadcast_resume — продолжить")
+        return
+    state = broadcast.state
+    status.set(
+        f"✅ Рассылка завершена за {time.monotonic() - started:.0f} с.\n"
+        f"Успешно: {state['sent']}\nОшибок: {state['failed']}\nЗаблокировали бота: {state['blocked']}"
+    )
+
+
+async def _start_broadcast(bot, state: dict) -> None:
+    global _broadcast_task
+    broadcast = Broadcast(
+        bot,
+        state,
+        BROADCAST_FILE,
+        SendThrottle(BROADCAST_RATE),
+        BROADCAST_CONCURRENCY,
+        on_blocked=user_store.mark_inactive,
+    )
+    broadcast.save_checkpoint()
+    status = status_updater.wrap(await bot.send_message(chat_id=state["admin_chat_id"], text=broadcast.progress_text()))
+    _broadcast_task = asyncio.create_task(_run_broadcast(broadcast, status))
+
+
 async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     if not _is_admin(update.effective_user.id):
         return
     if not context.args:
         await update.message.reply_text("Использование: /broadcast <сообщение>")
         return
+    if _broadcast_running():
+        await update.message.reply_text("Рассылка уже идёт. /broadcast_stop — остановить.")
+        return
+    if BROADCAST_FILE.exists():
+        await update.message.reply_text(
+            "Есть незавершённая рассылка. /broadcast_resume — продолжить, /broadcast_cancel — отменить."
+        )
+        return
     message_text = " ".join(context.args)
-    users = _load_users()
-    if not users:
+    user_ids = user_store.active_ids()
+    if not user_ids:
         await update.message.reply_text("Нет пользователей для рассылки.")
         return
-    success = 0
-    fail = 0
-    for uid in users.keys():
-        try:
-            await context.bot.send_message(chat_id=int(uid), text=message_text)
-            success += 1
-        except Exception:
-            fail += 1
-    await update.message.reply_text(f"✅ Рассылка завершена.\nУспешно: {success}\nОшибок: {fail}")
+    await _start_broadcast(context.bot, Broadcast.new_state(message_text, update.effective_chat.id, user_ids))
+
+
+async def broadcast_stop_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not _is_admin(update.effective_user.id):
+        return
+    if not _broadcast_running():
+        await update.message.reply_text("Рассылка не идёт.")
+        return
+    _broadcast_task.cancel()
+    await asyncio.gather(_broadcast_task, return_exceptions=True)
+
+
+async def broadcast_resume_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not _is_admin(update.effective_user.id):
+        return
+    if _broadcast_running():
+        await update.message.reply_text("Рассылка уже идёт.")
+        return
+    state = Broadcast.load_checkpoint(BROADCAST_FILE)
+    if not state:
+        await update.message.reply_text("Нет прерванной рассылки.")
+        return
+    state["admin_chat_id"] = update.effective_chat.id
+    await _start_broadcast(context.bot, state)
+
+
+async def broadcast_cancel_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    if not _is_admin(update.effective_user.id):
+        return
+    if _broadcast_running():
+        _broadcast_task.cancel()
+        await asyncio.gather(_broadcast_task, return_exceptions=True)
+    if not BROADCAST_FILE.exists():
+        await update.message.reply_text("Нет рассылки для отмены.")
+        return
+    BROADCAST_FILE.unlink(missing_ok=True)
+    await update.message.reply_text("🗑 Рассылка отменена.")
 
 
 async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -546,16 +1307,8 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     if not _is_admin(user_id):
         return
 
-    downloads_dir = Path("downloads")
-    files_count = 0
-    bytes_total = 0
-    if downloads_dir.exists() and downloads_dir.is_dir():
-        for p in downloads_dir.iterdir():
-            if p.is_file():
-                files_count += 1
-                bytes_total += p.stat().st_size
-
-    size_mb = bytes_total / (1024 * 1024)
+    files_count = len(download_cache)
+    size_mb = download_cache.total_bytes / (1024 * 1024)
     stats_text = (
         f"📊 Статистика бота\n\n"
         f"Всего запросов: {STATS['requests_total']}\n"
@@ -563,13 +1316,21 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
         f"Ошибок: {STATS['fail_total']}\n\n"
         f"TikTok: {STATS['platform']['tiktok']}\n"
         f"YouTube: {STATS['platform']['youtube']}\n\n"
-        f"Файлов в downloads: {files_count}\n"
-        f"Размер downloads: {size_mb:.1f} MB"
+        f"Файлов в кэше загрузок: {files_count}\n"
+        f"Размер кэша: {size_mb:.1f} / {DOWNLOADS_MAX_MB} MB\n\n"
+        f"Кэш file_id: {len(file_id_cache)} записей\n"
+        f"Попаданий: {file_id_cache.hits}, промахов: {file_id_cache.misses} "
+        f"({file_id_cache.hit_ratio() * 100:.0f}%)\n"
+        f"Правок статусов: {status_updater.edits_sent}, пропущено устаревших: {status_updater.edits_dropped}"
     )
     await update.message.reply_text(stats_text)
 
 
 async def cleanup_downloads_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Удаляет брошенные промежуточные файлы (например, от убитых по таймауту загрузок).
+
+    Готовые видео лежат в downloads/cache/ и вытесняются самим кэшем по LRU.
+    """
     downloads_dir = Path("downloads")
     if not downloads_dir.exists() or not downloads_dir.is_dir():
         return
@@ -593,13 +1354,136 @@ async def cleanup_downloads_job(context: ContextTypes.DEFAULT_TYPE) -> None:
 
 
 async def cleanup_task():
-    """Фоновая задача: раз в 30 минут чистить downloads."""
+    """Фоновая задача: раз в 30 минут чистить промежуточные файлы в downloads."""
     await asyncio.sleep(60)  # первый запуск через 1 минуту
     while True:
         await cleanup_downloads_job(None)
         await asyncio.sleep(60 * 30)  # каждые 30 минут
 
 
+_background_tasks: list[asyncio.Task] = []
+
+
+async def _health(body: bytes, headers: dict[str, str]):
+    return 200, "text/plain", b"ok"
+
+
+async def _metrics(body: bytes, headers: dict[str, str]):
+    return 200, "text/plain; version=0.0.4; charset=utf-8", metrics_registry.render().encode()
+
+
+def _webhook_handler(app, secret: str):
+    async def handle(body: bytes, headers: dict[str, str]):
+        if not hmac.compare_digest(headers.get("x-telegram-bot-api-secret-token", ""), secret):
+            return 403, "text/plain", b"forbidden"
+        try:
+            update = Update.de_json(json.loads(body), app.bot)
+        except ValueError:
+            return 400, "text/plain", b"bad update"
+        # Отвечаем сразу: обработка идёт в приложении параллельно (concurrent_updates)
+        await app.update_queue.put(update)
+        return 200, "text/plain", b"ok"
+
+    return handle
+
+
+async def _run_webhook(app, secret: str) -> None:
+    """Режим вебхука: без run_polling, поэтому жизненный цикл и сигналы обрабатываем сами."""
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    async with app:
+        await _post_init(app)
+        await app.start()
+        try:
+            if WEBHOOK_REGISTER:
+                await app.bot.set_webhook(
+                    url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+                    secret_token=secret,
+                    allowed_updates=Update.ALL_TYPES,
+                    max_connections=WEBHOOK_MAX_CONNECTIONS,
+                )
+                logger.info("Вебхук установлен: %s%s", WEBHOOK_URL.rstrip("/"), WEBHOOK_PATH)
+            else:
+                logger.info("WEBHOOK_REGISTER=0: вебхук в Telegram не регистрируется, жду апдейты на %s", WEBHOOK_PATH)
+            await stop.wait()
+        finally:
+            await app.stop()
+            await _post_stop(app)
+
+
+async def _post_init(app) -> None:
+    """Запуск фоновых задач в цикле событий приложения."""
+    global stream_client
+    await web_server.start()
+    # Состояние читается здесь, а не при импорте: модуль импортируют и процессы загрузки
+    user_store.load()
+    ban_manager.load()
+    file_id_cache.load()
+    strategy_stats.load_saved()
+    download_cache.recover()
+    await download_executor.start()
+    scheduler.start()
+    if STREAM_UPLOAD:
+        stream_client = httpx.AsyncClient(timeout=httpx.Timeout(120, connect=15), follow_redirects=True)
+    job_journal.open()
+    job_journal.purge(7 * 24 * 3600)
+    await _resume_jobs(app.bot)
+    _background_tasks.append(asyncio.create_task(cleanup_task()))
+    _background_tasks.append(asyncio.create_task(user_store.run_flusher()))
+    _background_tasks.append(asyncio.create_task(file_id_cache.run_flusher()))
+
+    state = Broadcast.load_checkpoint(BROADCAST_FILE)
+    if state and state.get("pending"):
+        try:
+            await app.bot.send_message(
+                chat_id=state["admin_chat_id"],
+                text=(
+                    f"📣 Рассылка была прервана: осталось {len(state['pending'])} из {state['total']}.\n"
+                    "/broadcast_resume — продолжить, /broadcast_cancel — отменить."
+                ),
+            )
+        except Exception as e:
+            logger.warning("Не удалось напомнить о прерванной рассылке: %s", e)
+
+
+async def _post_stop(app) -> None:
+    """Остановка воркеров; задачи из очереди получают уведомление."""
+    for task in _background_tasks:
+        task.cancel()
+    await asyncio.gather(*_background_tasks, return_exceptions=True)
+    _background_tasks.clear()
+    for task in list(_waiter_tasks):
+        task.cancel()
+    for batch in list(_open_batches):
+        if batch.task is not None:
+            batch.task.cancel()
+    if _broadcast_running():
+        # Оставшиеся получатели сохраняются в checkpoint
+        _broadcast_task.cancel()
+        await asyncio.gather(_broadcast_task, return_exceptions=True)
+    dropped = await scheduler.stop()
+    await download_executor.stop()
+    for job in dropped:
+        try:
+            await job.processing_message.message.edit_text(
+                "⚠️ Бот перезапускается. Загрузка продолжится автоматически после запуска."
+            )
+        except Exception:
+            pass
+    if dropped:
+        logger.info("Остановка: в журнале осталось задач из очереди: %d", len(dropped))
+    job_journal.close()
+    if stream_client is not None:
+        await stream_client.aclose()
+    await web_server.stop()
+    user_store.flush()
+    file_id_cache.flush()
+    ban_manager.compact()
+
+
 def main() -> None:
     """Start the bot."""
     token = os.getenv("TELEGRAM_BOT_TOKEN")
@@ -607,7 +1491,14 @@ def main() -> None:
         logger.error("No TELEGRAM_BOT_TOKEN found in environment variables!")
         return
 
-    app = ApplicationBuilder().token(token).build()
+    app = (
+        ApplicationBuilder()
+        .token(token)
+        .concurrent_updates(UPDATE_CONCURRENCY)
+        .post_init(_post_init)
+        .post_stop(_post_stop)
+        .build()
+    )
 
     app.add_handler(CommandHandler("start", start))
     app.add_handler(CommandHandler("help", help_command))
@@ -618,30 +1509,33 @@ def main() -> None:
     app.add_handler(CommandHandler("users", users_command))
     app.add_handler(CommandHandler("info", info_command))
     app.add_handler(CommandHandler("broadcast", broadcast_command))
+    app.add_handler(CommandHandler("broadcast_stop", broadcast_stop_command))
+    app.add_handler(CommandHandler("broadcast_resume", broadcast_resume_command))
+    app.add_handler(CommandHandler("broadcast_cancel", broadcast_cancel_command))
     app.add_handler(CommandHandler("ban", ban_command))
     app.add_handler(CommandHandler("unban", unban_command))
     app.add_handler(CommandHandler("banned", banned_command))
     app.add_handler(CommandHandler("queue", queue_command))
     app.add_handler(CommandHandler("limits", limits_command))
+    app.add_handler(CommandHandler("strategies", strategies_command))
+    app.add_handler(CommandHandler("admission", admission_command))
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
 
+    web_server.route("GET", "/", _health)
+    web_server.route("GET", "/health", _health)
+    web_server.route("GET", "/metrics", _metrics)
+
     logger.info("Бот запускается...")
-    
-    # Запускаем фоновые задачи
-    async def start_background_tasks():
-        loop = asyncio.get_running_loop()
-        loop.create_task(worker())
-        loop.create_task(cleanup_task())
-    
-    # Создаем и запускаем event loop
-    loop = asyncio.new_event_loop()
-    asyncio.set_event_loop(loop)
-    
-    # Запускаем фоновые задачи
-    loop.run_until_complete(start_background_tasks())
-    
-    # Запускаем бота
-    app.run_polling()
+
+    if WEBHOOK_URL:
+        # Секрет по умолчанию выводится из токена: стабилен между перезапусками
+        secret = WEBHOOK_SECRET or hashlib.sha256(token.encode()).hexdigest()[:32]
+        web_server.route("POST", WEBHOOK_PATH, _webhook_handler(app, secret))
+        asyncio.run(_run_webhook(app, secret))
+    else:
+        # Фоновые задачи стартуют в post_init, останавливаются в post_stop;
+        # run_polling сам снимает вебхук, если он был установлен
+        app.run_polling()
 
 
 if __name__ == "__main__":
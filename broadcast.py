@@ -0,0 +1,185 @@
+import asyncio
+import json
+import logging
+import time
+from collections import deque
+from pathlib import Path
+from typing import Callable
+
+from telegram.error import BadRequest, Forbidden, RetryAfter
+
+from status_updater import retry_after_seconds
+from storage import _atomic_write
+
+logger = logging.getLogger(__name__)
+
+# Попыток на одного получателя при сетевых ошибках (RetryAfter не считается)
+MAX_ATTEMPTS = 3
+
+
+class SendThrottle:
+    """Раздаёт слоты отправки: общий темп per_second и не чаще раза в per_chat_interval в один чат.
+
+    pause() после RetryAfter сдвигает все будущие слоты, а не только у того, кто получил 429.
+    """
+
+    def __init__(self, per_second: float, per_chat_interval: float = 1.0):
+        self.interval = 1.0 / per_second
+        self.per_chat_interval = per_chat_interval
+        self._next = 0.0
+        self._paused_until = 0.0
+        self._chat_last: dict[int, float] = {}
+
+    def pause(self, seconds: float) -> None:
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    async def acquire(self, chat_id: int) -> None:
+        while True:
+            now = time.monotonic()
+            chat_ready = self._chat_last.get(chat_id, float("-inf")) + self.per_chat_interval
+            start = max(self._next, self._paused_until, chat_ready)
+            if start <= now:
+                self._next = now + self.interval
+                self._chat_last[chat_id] = now
+                return
+            await asyncio.sleep(start - now)
+
+
+class Broadcast:
+    """Фоновая рассылка одного текста списку пользователей.
+
+    Несколько задач отправляют параллельно через общий SendThrottle.
+    Заблокировавшие бота передаются в on_blocked и не считаются ошибкой.
+    Оставшиеся получатели периодически пишутся в checkpoint-файл, поэтому
+    прерванную рассылку (остановка, перезапуск) можно продолжить. Сообщения,
+    отправлявшиеся в момент прерывания, при продолжении уйдут повторно.
+    """
+
+    def __init__(
+        self,
+        bot,
+        state: dict,
+        checkpoint_path: Path,
+        throttle: SendThrottle,
+        concurrency: int,
+        on_blocked: Callable[[str], None],
+    ):
+        self.bot = bot
+        self.state = state
+        self.checkpoint_path = checkpoint_path
+        self.throttle = throttle
+        self.concurrency = concurrency
+        self.on_blocked = on_blocked
+        self._pending: deque[str] = deque(state["pending"])
+        self._in_flight: set[str] = set()
+        self._started = time.monotonic()
+        self._done_at_start = self.done
+
+    @staticmethod
+    def new_state(text: str, admin_chat_id: int, user_ids: list[str]) -> dict:
+        return {
+            "text": text,
+            "admin_chat_id": admin_chat_id,
+            "total": len(user_ids),
+            "pending": list(user_ids),
+            "sent": 0,
+            "failed": 0,
+            "blocked": 0,
+            "created_at": int(time.time()),
+        }
+
+    @staticmethod
+    def load_checkpoint(path: Path) -> dict | None:
+        if not path.exists():
+            return None
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except Exception:
+            logger.exception("Не удалось прочитать %s", path)
+            return None
+
+    @property
+    def done(self) -> int:
+        return self.state["sent"] + self.state["failed"] + self.state["blocked"]
+
+    def progress_text(self) -> str:
+        state = self.state
+        elapsed = time.monotonic() - self._started
+        rate = (self.done - self._done_at_start) / elapsed if elapsed > 0 else 0.0
+        remaining = state["total"] - self.done
+        eta = f"~{remaining / rate:.0f} с" if rate > 0 else "—"
+        return (
+            f"📣 Рассылка: {self.done}/{state['total']}\n"
+            f"Успешно: {state['sent']}, ошибок: {state['failed']}, заблокировали: {state['blocked']}\n"
+            f"Скорость: {rate:.1f} сообщ./с, осталось {eta}"
+        )
+
+    def _checkpoint_payload(self) -> str:
+        self.state["pending"] = list(self._in_flight) + list(self._pending)
+        return json.dumps(self.state, ensure_ascii=False)
+
+    def save_checkpoint(self) -> None:
+        try:
+            _atomic_write(self.checkpoint_path, self._checkpoint_payload())
+        except Exception:
+            logger.exception("Не удалось сохранить %s", self.checkpoint_path)
+
+    async def run(self, on_progress: Callable[[str], None], report_interval: float) -> None:
+        """Отправляет всем оставшимся; по завершении checkpoint удаляется, при отмене — сохраняется."""
+        workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+        try:
+            pending = set(workers)
+            while pending:
+                _, pending = await asyncio.wait(pending, timeout=report_interval)
+                if pending:
+                    payload = self._checkpoint_payload()
+                    try:
+                        await asyncio.to_thread(_atomic_write, self.checkpoint_path, payload)
+                    except Exception:
+                        logger.exception("Не удалось сохранить %s", self.checkpoint_path)
+                    on_progress(self.progress_text())
+        finally:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            if self._pending or self._in_flight:
+                self.save_checkpoint()
+        self.checkpoint_path.unlink(missing_ok=True)
+
+    async def _worker(self) -> None:
+        while self._pending:
+            uid = self._pending.popleft()
+            self._in_flight.add(uid)
+            # При отмене получатель остаётся в _in_flight и попадает в checkpoint
+            await self._send(uid)
+            self._in_flight.discard(uid)
+
+    async def _send(self, uid: str) -> None:
+        chat_id = int(uid)
+        attempts = 0
+        while attempts < MAX_ATTEMPTS:
+            await self.throttle.acquire(chat_id)
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=self.state["text"])
+                self.state["sent"] += 1
+                return
+            except RetryAfter as e:
+                self.throttle.pause(retry_after_seconds(e))
+                continue
+            except Forbidden:
+                self.state["blocked"] += 1
+                self.on_blocked(uid)
+                return
+            except BadRequest as e:
+                if "chat not found" in str(e).lower():
+                    self.state["blocked"] += 1
+                    self.on_blocked(uid)
+                else:
+                    self.state["failed"] += 1
+                    logger.warning("Рассылка: %s: %s", uid, e)
+                return
+            except Exception as e:
+                attempts += 1
+                logger.warning("Рассылка: %s (попытка %d): %s", uid, attempts, e)
+        self.state["failed"] += 1
@@ -0,0 +1,155 @@
+import logging
+import os
+import shutil
+from collections import OrderedDict
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry:
+    __slots__ = ("path", "size", "pins")
+
+    def __init__(self, path: Path, size: int):
+        self.path = path
+        self.size = size
+        self.pins = 0
+
+
+class DownloadCache:
+    """Скачанные видео на диске по ключу "<platform>:<id>" с лимитом по байтам.
+
+    Файлы лежат в <root>/cache/<platform>/<id><ext>, индекс (размеры, порядок
+    LRU) хранится в памяти, поэтому поиск, подсчёт и вытеснение не сканируют
+    каталог. Файл, который сейчас отправляется, закреплён (pin) и не вытесняется.
+    Всё, что лежит в <root> вне cache/, — промежуточные файлы загрузок: при
+    старте они считаются недописанными и удаляются.
+    """
+
+    def __init__(self, root: Path, max_bytes: int):
+        self.root = root
+        self.cache_dir = root / "cache"
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._index: OrderedDict[str, _Entry] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._index
+
+    def _path_for(self, key: str, ext: str) -> Path:
+        platform, _, video_id = key.partition(":")
+        return self.cache_dir / platform / f"{video_id}{ext}"
+
+    def recover(self) -> None:
+        """Старт: удаляет недописанные файлы и строит индекс (единственный обход каталога)."""
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        removed = 0
+        for p in self.root.iterdir():
+            if p == self.cache_dir:
+                continue
+            if p.is_dir():
+                shutil.rmtree(p, ignore_errors=True)
+            else:
+                p.unlink(missing_ok=True)
+            removed += 1
+
+        entries = []
+        for platform_dir in self.cache_dir.iterdir():
+            if not platform_dir.is_dir():
+                platform_dir.unlink(missing_ok=True)
+                continue
+            for p in platform_dir.iterdir():
+                if not p.is_file() or p.suffix in (".part", ".tmp", ".ytdl"):
+                    p.unlink(missing_ok=True)
+                    removed += 1
+                    continue
+                st = p.stat()
+                entries.append((st.st_mtime, f"{platform_dir.name}:{p.stem}", p, st.st_size))
+
+        # Восстанавливаем порядок LRU: acquire() обновляет mtime файла
+        for _, key, path, size in sorted(entries):
+            self._index[key] = _Entry(path, size)
+            self.total_bytes += size
+        self._evict()
+        if removed:
+            logger.info("Кэш загрузок: удалено недописанных файлов: %d", removed)
+        logger.info("Кэш загрузок: %d файлов, %.1f MB", len(self._index), self.total_bytes / 1024 / 1024)
+
+    def acquire(self, key: str) -> str | None:
+        """Путь к файлу из кэша (закреплённый до release) или None."""
+        entry = self._index.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if not entry.path.exists():
+            # Удалён снаружи
+            self._drop(key)
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._index.move_to_end(key)
+        entry.pins += 1
+        try:
+            os.utime(entry.path)
+        except OSError:
+            pass
+        return str(entry.path)
+
+    def put(self, key: str, src_path: str) -> str:
+        """Переносит скачанный файл в кэш (закреплённым до release) и возвращает новый путь.
+
+        Если под ключом уже лежит закреплённый файл (его сейчас отправляет
+        другая задача), он не заменяется: новый файл удаляется, а возвращается
+        путь к уже закреплённому.
+        """
+        entry = self._index.get(key)
+        if entry is not None and entry.pins > 0 and entry.path.exists():
+            try:
+                os.remove(src_path)
+            except OSError:
+                pass
+            entry.pins += 1
+            self._index.move_to_end(key)
+            return str(entry.path)
+        dst = self._path_for(key, Path(src_path).suffix or ".mp4")
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        if entry is not None:
+            self._drop(key)
+        os.replace(src_path, dst)
+        entry = _Entry(dst, dst.stat().st_size)
+        entry.pins = 1
+        self._index[key] = entry
+        self.total_bytes += entry.size
+        self._evict()
+        return str(dst)
+
+    def release(self, key: str) -> bool:
+        """Открепляет файл. False — такого ключа в кэше нет."""
+        entry = self._index.get(key)
+        if entry is None:
+            return False
+        entry.pins = max(entry.pins - 1, 0)
+        self._evict()
+        return True
+
+    def _drop(self, key: str) -> None:
+        entry = self._index.pop(key)
+        self.total_bytes -= entry.size
+        try:
+            entry.path.unlink(missing_ok=True)
+        except OSError:
+            pass
+
+    def _evict(self) -> None:
+        if self.total_bytes <= self.max_bytes:
+            return
+        for key in list(self._index):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if self._index[key].pins == 0:
+                self._drop(key)
@@ -0,0 +1,242 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class JobTimeout(Exception):
+    pass
+
+
+class WorkerCrashed(Exception):
+    pass
+
+
+def _warm_up() -> None:
+    """Импорт yt-dlp, поиск ffmpeg и готовые YoutubeDL — один раз на процесс, а не на задачу."""
+    from metrics import registry
+    from video_downloader import ffmpeg_exe, strategy_stats, ydl_pool
+
+    ffmpeg_exe()
+    for platform in ("youtube", "tiktok"):
+        with ydl_pool.lease(platform):
+            pass
+    # Статистику стратегий и метрики ведёт только основной процесс
+    strategy_stats.autosave = False
+    registry.buffering = True
+
+
+# Не чаще одного сообщения о прогрессе за столько секунд на задачу
+PROGRESS_INTERVAL = 1.0
+
+
+def _worker_main(conn) -> None:
+    # Своя группа процессов: при убийстве задачи заодно гибнет и ffmpeg
+    if hasattr(os, "setsid"):
+        os.setsid()
+    _warm_up()
+    import video_downloader
+    from metrics import registry
+    from video_downloader import strategy_stats
+
+    # Прогресс приходит из потоков параллельных попыток, ответ — из основного
+    send_lock = threading.Lock()
+    last_progress = [0.0]
+
+    def report_progress(fraction: float) -> None:
+        now = time.monotonic()
+        if now - last_progress[0] < PROGRESS_INTERVAL:
+            return
+        last_progress[0] = now
+        with send_lock:
+            conn.send(("progress", fraction, None, None))
+
+    video_downloader.progress_callback = report_progress
+
+    while True:
+        try:
+            msg = conn.recv()
+        except (EOFError, OSError):
+            return
+        if msg is None:
+            return
+        fn, args, stats_snapshot = msg
+        strategy_stats.load(stats_snapshot)
+        last_progress[0] = 0.0
+        try:
+            result = fn(*args)
+            reply = ("ok", result)
+        except Exception as e:
+            reply = ("error", e)
+        with send_lock:
+            records, observations = strategy_stats.drain(), registry.drain()
+            try:
+                conn.send((*reply, records, observations))
+            except Exception as e:
+                # Непиклуемое исключение/результат
+                conn.send(("error", RuntimeError(repr(e)), records, observations))
+
+
+class _Worker:
+    __slots__ = ("process", "conn", "jobs")
+
+    def __init__(self, process, conn):
+        self.process = process
+        self.conn = conn
+        self.jobs = 0
+
+
+class DownloadExecutor:
+    """Ограниченный пул процессов для загрузок yt-dlp.
+
+    В отличие от asyncio.to_thread, зависшую задачу можно действительно
+    остановить: по дедлайну или отмене процесс убивается вместе с группой
+    (ffmpeg), а на его место сразу поднимается новый прогретый воркер.
+    Воркер пересоздаётся и после max_jobs задач, чтобы не копилась память.
+    """
+
+    def __init__(self, size: int, job_timeout: float, max_jobs: int):
+        self.size = size
+        self.job_timeout = job_timeout
+        self.max_jobs = max_jobs
+        self._ctx = multiprocessing.get_context("spawn")
+        self._idle: asyncio.Queue = asyncio.Queue()
+        self._workers: set[_Worker] = set()
+        self._spawning: set[asyncio.Task] = set()
+        self._stopping = False
+
+    @property
+    def busy(self) -> int:
+        return len(self._workers) - self._idle.qsize()
+
+    def _spawn(self) -> _Worker:
+        # Заодно дожидаемся убитых/отработавших процессов, чтобы не копились зомби
+        multiprocessing.active_children()
+        parent_conn, child_conn = self._ctx.Pipe()
+        process = self._ctx.Process(target=_worker_main, args=(child_conn,), daemon=True, name="download-worker")
+        process.start()
+        child_conn.close()
+        worker = _Worker(process, parent_conn)
+        self._workers.add(worker)
+        return worker
+
+    async def _add_worker(self) -> None:
+        if self._stopping:
+            return
+        worker = await asyncio.to_thread(self._spawn)
+        self._idle.put_nowait(worker)
+
+    def _replace(self) -> None:
+        task = asyncio.create_task(self._add_worker())
+        self._spawning.add(task)
+        task.add_done_callback(self._spawning.discard)
+
+    async def start(self) -> None:
+        await asyncio.gather(*(self._add_worker() for _ in range(self.size)))
+        logger.info("Пул загрузки: %d процессов (таймаут %s с, пересоздание после %d задач)",
+                    self.size, self.job_timeout, self.max_jobs)
+
+    def _kill(self, worker: _Worker) -> None:
+        self._workers.discard(worker)
+        pid = worker.process.pid
+        try:
+            if hasattr(os, "killpg"):
+                os.killpg(pid, signal.SIGKILL)
+            else:
+                worker.process.kill()
+        except OSError:
+            # Группа ещё не создана (воркер только стартует) или процесс уже завершён
+            try:
+                worker.process.kill()
+            except OSError:
+                pass
+        worker.conn.close()
+
+    def _retire(self, worker: _Worker) -> None:
+        self._workers.discard(worker)
+        try:
+            worker.conn.send(None)
+        except OSError:
+            pass
+        worker.conn.close()
+
+    async def _recv(self, conn):
+        """Ждёт ответ воркера без занятого потока: по готовности дескриптора в цикле событий."""
+        loop = asyncio.get_running_loop()
+        ready = loop.create_future()
+        fd = conn.fileno()
+        loop.add_reader(fd, lambda: ready.done() or ready.set_result(None))
+        try:
+            await ready
+        finally:
+            loop.remove_reader(fd)
+        return conn.recv()
+
+    async def _result(self, conn, on_progress):
+        while True:
+            status, payload, records, observations = await self._recv(conn)
+            if status != "progress":
+                return status, payload, records, observations
+            if on_progress is not None:
+                try:
+                    on_progress(payload)
+                except Exception:
+                    logger.exception("Ошибка в обработчике прогресса")
+
+    async def run(self, fn, *args, timeout: float | None = None, on_progress=None):
+        """Выполняет fn(*args) в процессе пула. fn должна быть доступна по имени модуля (пиклуемой).
+
+        on_progress(доля 0..1) вызывается в цикле событий по мере загрузки.
+        """
+        from metrics import registry
+        from video_downloader import strategy_stats
+
+        timeout = timeout or self.job_timeout
+        worker = await self._idle.get()
+        started = time.monotonic()
+        try:
+            worker.conn.send((fn, args, strategy_stats.snapshot()))
+            status, payload, records, observations = await asyncio.wait_for(
+                self._result(worker.conn, on_progress), timeout
+            )
+        except asyncio.TimeoutError:
+            logger.warning("Задача %s убита по таймауту (%.0f с)", getattr(fn, "__qualname__", fn), timeout)
+            self._kill(worker)
+            self._replace()
+            raise JobTimeout(f"Загрузка не уложилась в {timeout:.0f} с") from None
+        except asyncio.CancelledError:
+            self._kill(worker)
+            self._replace()
+            raise
+        except (EOFError, OSError) as e:
+            self._kill(worker)
+            self._replace()
+            raise WorkerCrashed(f"Процесс загрузки завершился аварийно: {e!r}") from None
+
+        strategy_stats.merge(records)
+        registry.merge(observations)
+        worker.jobs += 1
+        if worker.jobs >= self.max_jobs:
+            self._retire(worker)
+            self._replace()
+        else:
+            self._idle.put_nowait(worker)
+        logger.debug("Задача %s: %.1f с", getattr(fn, "__qualname__", fn), time.monotonic() - started)
+
+        if status == "error":
+            raise payload
+        return payload
+
+    async def stop(self) -> None:
+        self._stopping = True
+        for task in list(self._spawning):
+            task.cancel()
+        for worker in list(self._workers):
+            self._kill(worker)
+        while not self._idle.empty():
+            self._idle.get_nowait()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Локальная проверка режима вебхука: шлёт боту поддельные апдейты Telegram.
+
+Запустите бота в режиме вебхука без регистрации в Telegram (локальный адрес
+Telegram не примет) и с тем же WEBHOOK_SECRET:
+
+    WEBHOOK_URL=http://127.0.0.1:10000 WEBHOOK_REGISTER=0 WEBHOOK_SECRET=mysecret python run_bot.py
+
+Затем:
+
+    python fake_webhook_sender.py --secret mysecret --count 20 --text /start
+"""
+import argparse
+import http.client
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+
+def make_update(update_id, chat_id, text):
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private", "first_name": "Fake"},
+            "from": {"id": chat_id, "is_bot": False, "first_name": "Fake"},
+            "text": text,
+        },
+    }
+
+
+def post(url, secret, payload):
+    parts = urlsplit(url)
+    conn = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=10)
+    body = json.dumps(payload).encode()
+    headers = {"Content-Type": "application/json"}
+    if secret is not None:
+        headers["X-Telegram-Bot-Api-Secret-Token"] = secret
+    started = time.perf_counter()
+    conn.request("POST", parts.path or "/", body=body, headers=headers)
+    status = conn.getresponse().status
+    conn.close()
+    return status, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Поддельные апдейты для вебхука бота")
+    parser.add_argument("--url", default="http://127.0.0.1:10000/telegram")
+    parser.add_argument("--secret", required=True)
+    parser.add_argument("--count", type=int, default=10)
+    parser.add_argument("--parallel", type=int, default=5)
+    parser.add_argument("--chat-id", type=int, default=1)
+    parser.add_argument("--text", default="/start")
+    args = parser.parse_args()
+
+    parts = urlsplit(args.url)
+    health = http.client.HTTPConnection(parts.hostname, parts.port or 80, timeout=5)
+    health.request("GET", "/health")
+    print(f"/health: {health.getresponse().status}")
+
+    status, _ = post(args.url, "wrong-secret", make_update(0, args.chat_id, args.text))
+    print(f"Неверный секрет: {status} (ожидается 403)")
+    status, _ = post(args.url, None, make_update(0, args.chat_id, args.text))
+    print(f"Без секрета: {status} (ожидается 403)")
+
+    base_id = int(time.time())
+    with ThreadPoolExecutor(args.parallel) as pool:
+        results = list(pool.map(
+            lambda i: post(args.url, args.secret, make_update(base_id + i, args.chat_id, args.text)),
+            range(args.count),
+        ))
+    ok = sum(1 for status, _ in results if status == 200)
+    latencies = sorted(latency for _, latency in results)
+    print(f"Апдейтов принято: {ok}/{args.count}")
+    if latencies:
+        print(f"Задержка ответа: медиана {latencies[len(latencies) // 2] * 1000:.1f} мс, "
+              f"макс {latencies[-1] * 1000:.1f} мс")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+
+class FileIdCache:
+    """Кэш Telegram file_id по каноническому ID видео ("youtube:<id>", "tiktok:<id>").
+
+    Повторная ссылка на уже отправленное видео отдаётся одним reply_video(file_id)
+    без скачивания и повторной загрузки в Telegram. Вытеснение — LRU по количеству
+    записей плюс TTL. Хранится в JSON-файле, порядок записей = порядок LRU;
+    изменения пишутся на диск не сразу, а по таймеру (run_flusher) и при остановке.
+    """
+
+    def __init__(self, path: Path, ttl_seconds: int, max_entries: int, flush_interval: float = 30):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.flush_interval = flush_interval
+        self.hits = 0
+        self.misses = 0
+        # key -> (file_id, stored_at)
+        self._items: OrderedDict[str, tuple[str, float]] = OrderedDict()
+        self._dirty = False
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def load(self) -> None:
+        if not self.path.exists():
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                raw = json.load(f)
+        except Exception:
+            return
+        now = time.time()
+        for key, file_id, stored_at in raw:
+            if now - stored_at < self.ttl_seconds:
+                self._items[key] = (file_id, stored_at)
+        self._evict()
+
+    def _snapshot(self) -> str | None:
+        if not self._dirty:
+            return None
+        self._dirty = False
+        data = [[key, file_id, stored_at] for key, (file_id, stored_at) in self._items.items()]
+        return json.dumps(data, ensure_ascii=False)
+
+    def _write(self, payload: str) -> None:
+        tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(payload)
+        os.replace(tmp_path, self.path)
+
+    def flush(self) -> None:
+        """Синхронный сброс на диск (используется при остановке)."""
+        payload = self._snapshot()
+        if payload is None:
+            return
+        try:
+            self._write(payload)
+        except Exception:
+            self._dirty = True
+
+    async def run_flusher(self) -> None:
+        """Фоновая задача: снимок — в цикле событий, запись файла — в потоке."""
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            payload = self._snapshot()
+            if payload is None:
+                continue
+            try:
+                await asyncio.to_thread(self._write, payload)
+            except Exception:
+                self._dirty = True
+
+    def _evict(self) -> None:
+        while len(self._items) > self.max_entries:
+            self._items.popitem(last=False)
+
+    def get(self, key: str) -> str | None:
+        item = self._items.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        file_id, stored_at = item
+        if time.time() - stored_at >= self.ttl_seconds:
+            del self._items[key]
+            self.misses += 1
+            return None
+        self._items.move_to_end(key)
+        self.hits += 1
+        return file_id
+
+    def put(self, key: str, file_id: str) -> None:
+        self._items[key] = (file_id, time.time())
+        self._items.move_to_end(key)
+        self._evict()
+        self._dirty = True
+
+    def invalidate(self, key: str) -> None:
+        if self._items.pop(key, None) is not None:
+            self._dirty = True
+
+    def hit_ratio(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
@@ -0,0 +1,62 @@
+import asyncio
+
+
+class Flight:
+    """Одна загрузка видео, к которой присоединяются все запросившие его пользователи."""
+
+    __slots__ = ("future", "refs")
+
+    def __init__(self) -> None:
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.refs = 1
+
+    async def wait(self):
+        # shield: отмена одного ожидающего не должна отменять результат для остальных
+        return await asyncio.shield(self.future)
+
+
+class InFlightDownloads:
+    """Дедупликация одновременных загрузок одного и того же видео (single-flight).
+
+    Первый запрос по ключу становится ведущим и скачивает файл, остальные
+    присоединяются как ожидающие. Запись живёт, пока файл кем-то используется,
+    поэтому поздние запросы тоже получают уже скачанный файл, а не перезаписывают его.
+    """
+
+    def __init__(self) -> None:
+        self._flights: dict[str, Flight] = {}
+
+    def __len__(self) -> int:
+        return len(self._flights)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._flights
+
+    def join(self, key: str) -> tuple[Flight, bool]:
+        """Возвращает (flight, is_leader)."""
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = Flight()
+            self._flights[key] = flight
+            return flight, True
+        flight.refs += 1
+        return flight, False
+
+    def resolve(self, key: str, result: str | None) -> None:
+        flight = self._flights.get(key)
+        if flight is None:
+            return
+        if not flight.future.done():
+            flight.future.set_result(result)
+        if result is None:
+            # Неудача: следующий запрос начнёт загрузку заново
+            self._flights.pop(key, None)
+
+    def release(self, key: str, flight: Flight) -> bool:
+        """Отпускает файл. True — это был последний пользователь, файл можно удалять."""
+        flight.refs -= 1
+        if flight.refs > 0:
+            return False
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+        return True
@@ -0,0 +1,103 @@
+import logging
+import sqlite3
+import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER NOT NULL,
+    user_id INTEGER NOT NULL,
+    message_id INTEGER NOT NULL,
+    status_message_id INTEGER NOT NULL,
+    url TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state);
+"""
+
+# Незавершённые состояния: такие задачи при старте продолжаются или закрываются
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobRecord:
+    __slots__ = ("id", "chat_id", "user_id", "message_id", "status_message_id", "url", "state", "attempts", "created_at")
+
+    def __init__(self, row: tuple):
+        (self.id, self.chat_id, self.user_id, self.message_id, self.status_message_id,
+         self.url, self.state, self.attempts, self.created_at) = row
+
+
+class JobJournal:
+    """Журнал загрузок в SQLite: переживает перезапуск/редеплой.
+
+    Хранятся только компактные поля (чат, id сообщений, ссылка, состояние),
+    а не объекты Update/context. Записи короткие, WAL + synchronous=NORMAL,
+    поэтому запись идёт прямо из цикла событий.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self._db: sqlite3.Connection | None = None
+
+    def open(self) -> None:
+        self._db = sqlite3.connect(self.path, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._db.close()
+            self._db = None
+
+    def add(self, chat_id: int, user_id: int, message_id: int, status_message_id: int, url: str) -> int:
+        now = time.time()
+        cur = self._db.execute(
+            "INSERT INTO jobs (chat_id, user_id, message_id, status_message_id, url, state, created_at, updated_at)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (chat_id, user_id, message_id, status_message_id, url, QUEUED, now, now),
+        )
+        return cur.lastrowid
+
+    def start(self, job_id: int) -> None:
+        self._db.execute(
+            "UPDATE jobs SET state = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+            (RUNNING, time.time(), job_id),
+        )
+
+    def finish(self, job_id: int, ok: bool) -> None:
+        self._db.execute(
+            "UPDATE jobs SET state = ?, updated_at = ? WHERE id = ?",
+            (DONE if ok else FAILED, time.time(), job_id),
+        )
+
+    def requeue(self, job_id: int) -> None:
+        self._db.execute("UPDATE jobs SET state = ?, updated_at = ? WHERE id = ?", (QUEUED, time.time(), job_id))
+
+    def unfinished(self) -> list[JobRecord]:
+        rows = self._db.execute(
+            "SELECT id, chat_id, user_id, message_id, status_message_id, url, state, attempts, created_at"
+            " FROM jobs WHERE state IN (?, ?) ORDER BY id",
+            (QUEUED, RUNNING),
+        ).fetchall()
+        return [JobRecord(row) for row in rows]
+
+    def purge(self, older_than: float) -> int:
+        """Удаляет завершённые задачи старше older_than секунд."""
+        cur = self._db.execute(
+            "DELETE FROM jobs WHERE state IN (?, ?) AND updated_at < ?",
+            (DONE, FAILED, time.time() - older_than),
+        )
+        return cur.rowcount
+
+    def counts(self) -> dict[str, int]:
+        return dict(self._db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
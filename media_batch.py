@@ -0,0 +1,139 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+# Лимит Bot API на число элементов в send_media_group
+MEDIA_GROUP_MAX = 10
+
+
+class _Item:
+    __slots__ = ("job", "text", "result", "submitted", "settled")
+
+    def __init__(self, job: Any):
+        self.job = job
+        self.text = "⏳ В очереди"
+        # (video_key, video_path, file_id) после успешной загрузки
+        self.result: tuple | None = None
+        self.submitted = False
+        self.settled = False
+
+
+class ItemStatus:
+    """Статус одной ссылки внутри общего сообщения пакета.
+
+    Тот же интерфейс, что у StatusMessage: задача не знает, что её строка —
+    часть общего сообщения.
+    """
+
+    __slots__ = ("_batch", "_item")
+
+    def __init__(self, batch: "MediaBatch", item: _Item):
+        self._batch = batch
+        self._item = item
+
+    @property
+    def message(self):
+        return self._batch.status.message
+
+    def set(self, text: str) -> None:
+        self._item.text = text
+        self._batch.render()
+
+    async def edit_text(self, text: str) -> None:
+        self.set(text)
+
+    async def delete(self) -> None:
+        self.set("✅ Готово")
+
+    async def flush(self) -> None:
+        await self._batch.status.flush()
+
+
+class MediaBatch:
+    """Несколько ссылок из одного сообщения: общий статус и одна отправка группой.
+
+    Каждая ссылка — обычная задача загрузки. В очередь одновременно
+    отдаётся не больше limit задач пакета (submit), следующая — когда
+    предыдущая завершилась, так что пакет не выходит за лимит пользователя.
+    Успешная задача не отправляет видео сама, а сдаёт файл пакету (deliver)
+    и освобождает воркер; когда все задачи сданы или упали, вызывается
+    on_complete(batch), который отправляет группу и отпускает файлы.
+    """
+
+    def __init__(
+        self,
+        status,
+        submit: Callable[[Any], None],
+        on_complete: Callable[["MediaBatch"], Awaitable[None]],
+    ):
+        self.status = status
+        self.items: list[_Item] = []
+        self._submit = submit
+        self._on_complete = on_complete
+        self._limit = 0
+        self._settled = 0
+        self.task: asyncio.Task | None = None
+
+    def add(self, job: Any) -> ItemStatus:
+        item = _Item(job)
+        self.items.append(item)
+        return ItemStatus(self, item)
+
+    def start(self, limit: int) -> None:
+        self._limit = max(1, limit)
+        self._feed()
+
+    def _feed(self) -> None:
+        running = sum(item.submitted and not item.settled for item in self.items)
+        for item in self.items:
+            if running >= self._limit:
+                break
+            if not item.submitted and not item.settled:
+                item.submitted = True
+                running += 1
+                self._submit(item.job)
+
+    def _item(self, job: Any) -> _Item:
+        return next(item for item in self.items if item.job is job)
+
+    def holds(self, job: Any) -> bool:
+        """Файл задачи у пакета: его отпустит пакет после отправки группы."""
+        return self._item(job).result is not None
+
+    def delivered(self) -> list[tuple[Any, str | None, str | None, str | None]]:
+        return [(item.job, *item.result) for item in self.items if item.result is not None]
+
+    def deliver(self, job: Any, video_key: str | None, video_path: str | None, file_id: str | None) -> None:
+        item = self._item(job)
+        item.result = (video_key, video_path, file_id)
+        item.text = "✅ Скачано"
+        self._settle(item)
+
+    def fail(self, job: Any) -> None:
+        self._settle(self._item(job))
+
+    def _settle(self, item: _Item) -> None:
+        if item.settled:
+            return
+        item.settled = True
+        self._settled += 1
+        self.render()
+        if self._settled == len(self.items):
+            self.task = asyncio.create_task(self._complete())
+        elif self._limit:
+            self._feed()
+
+    async def _complete(self) -> None:
+        try:
+            await self._on_complete(self)
+        except Exception:
+            logger.exception("Ошибка при отправке пакета видео")
+
+    def render(self, header: str | None = None) -> None:
+        if header is None:
+            done = sum(item.result is not None for item in self.items)
+            header = f"📦 Видео: {len(self.items)}, готово {done}"
+        lines = [header] + [f"{n}. {item.text}" for n, item in enumerate(self.items, 1)]
+        self.status.set("\n".join(lines))
@@ -0,0 +1,180 @@
+import bisect
+import threading
+from typing import Callable
+
+# Границы корзин гистограмм этапов, секунды
+STAGE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+
+def _escape_label(value) -> str:
+    # Экранирование значений меток по формату экспозиции Prometheus
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape_label(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, registry: "Registry", name: str, help_text: str, labels: tuple[str, ...]):
+        self.registry = registry
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(n, "") for n in self.labels)
+
+    def _header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        self.registry._record(self, self._key(labels), amount)
+
+    def _apply(self, key: tuple, amount: float) -> None:
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = self._header()
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, *args, buckets: tuple[float, ...] = STAGE_BUCKETS):
+        super().__init__(*args)
+        self.buckets = buckets
+        # key -> [счётчики по корзинам..., +Inf], сумма
+        self._values: dict[tuple, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        self.registry._record(self, self._key(labels), value)
+
+    def _apply(self, key: tuple, value: float) -> None:
+        counts, total = self._values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0]))
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        total[0] += value
+
+    def render(self) -> list[str]:
+        lines = self._header()
+        for key, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total[0])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class CallbackMetric(_Metric):
+    """Значения снимаются в момент запроса /metrics (глубина очереди, попадания в кэш и т.п.)."""
+
+    def __init__(self, registry, name, help_text, labels, kind: str, fn: Callable[[], list[tuple[tuple, float]]]):
+        super().__init__(registry, name, help_text, labels)
+        self.kind = kind
+        self.fn = fn
+
+    def render(self) -> list[str]:
+        lines = self._header()
+        for key, value in self.fn():
+            lines.append(f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}")
+        return lines
+
+
+class Registry:
+    """Метрики в формате Prometheus (text exposition).
+
+    В процессах-воркерах загрузки buffering включён: наблюдения копятся в
+    pending и передаются в основной процесс вместе с результатом задачи
+    (drain/merge), как статистика стратегий.
+    """
+
+    def __init__(self):
+        self.buffering = False
+        self.pending: list[tuple[str, tuple, float]] = []
+        self._metrics: dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def counter(self, name: str, help_text: str, labels: tuple[str, ...] = ()) -> Counter:
+        return self._add(Counter(self, name, help_text, labels))
+
+    def histogram(self, name: str, help_text: str, labels: tuple[str, ...] = (), **kwargs) -> Histogram:
+        return self._add(Histogram(self, name, help_text, labels, **kwargs))
+
+    def callback(self, name: str, help_text: str, labels: tuple[str, ...], kind: str, fn) -> CallbackMetric:
+        return self._add(CallbackMetric(self, name, help_text, labels, kind, fn))
+
+    def _add(self, metric):
+        self._metrics[metric.name] = metric
+        return metric
+
+    def _record(self, metric: _Metric, key: tuple, value: float) -> None:
+        with self._lock:
+            if self.buffering:
+                self.pending.append((metric.name, key, value))
+            else:
+                metric._apply(key, value)
+
+    def drain(self) -> list[tuple[str, tuple, float]]:
+        with self._lock:
+            records, self.pending = self.pending, []
+            return records
+
+    def merge(self, records: list[tuple[str, tuple, float]]) -> None:
+        with self._lock:
+            for name, key, value in records:
+                metric = self._metrics.get(name)
+                if metric is not None:
+                    metric._apply(tuple(key), value)
+
+    def render(self) -> str:
+        with self._lock:
+            lines: list[str] = []
+            for metric in self._metrics.values():
+                lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+stage_seconds = registry.histogram(
+    "bot_stage_seconds", "Длительность этапов обработки видео", ("stage", "platform")
+)
+failures_total = registry.counter(
+    "bot_failures_total", "Неудачные попытки загрузки по причине и стратегии", ("platform", "cause", "strategy")
+)
+job_failures_total = registry.counter(
+    "bot_job_failures_total", "Запросы, закончившиеся ошибкой, по причине", ("platform", "cause")
+)
+bytes_downloaded_total = registry.counter(
+    "bot_bytes_downloaded_total", "Скачано байт (до сжатия)", ("platform",)
+)
+bytes_uploaded_total = registry.counter(
+    "bot_bytes_uploaded_total", "Загружено в Telegram байт", ("platform",)
+)
+
+
+def platform_of(url_or_extractor: str | None) -> str:
+    return "tiktok" if "tiktok" in (url_or_extractor or "").lower() else "youtube"
@@ -0,0 +1,176 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Размер куска, которым ответ пишется в файл
+_READ_SIZE = 256 * 1024
+
+
+class RangedFetchError(Exception):
+    """Ускоренная загрузка невозможна или не удалась — нужна обычная загрузка."""
+
+
+class FetchCancelled(Exception):
+    pass
+
+
+class _Progress:
+    __slots__ = ("done", "total", "callback", "lock")
+
+    def __init__(self, total: int, callback: Callable[[int, int], None] | None):
+        self.done = 0
+        self.total = total
+        self.callback = callback
+        self.lock = threading.Lock()
+
+    def add(self, n: int) -> None:
+        with self.lock:
+            self.done += n
+            done = self.done
+        if self.callback is not None:
+            self.callback(done, self.total)
+
+
+def _make_session() -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+# Общий пул соединений на процесс: куски и последующие загрузки переиспользуют TLS-сессии
+_session = _make_session()
+
+
+def probe_size(url: str, headers: dict | None = None, timeout: float = 30, session: requests.Session | None = None) -> int:
+    """Размер файла по ответу на Range: bytes=0-0. RangedFetchError — сервер не отдаёт диапазоны."""
+    session = session or _session
+    try:
+        with session.get(url, headers={**(headers or {}), "Range": "bytes=0-0"}, timeout=timeout, stream=True) as r:
+            content_range = r.headers.get("Content-Range", "")
+            if r.status_code != 206 or "/" not in content_range:
+                raise RangedFetchError(f"сервер не поддерживает Range (HTTP {r.status_code})")
+            total = content_range.rsplit("/", 1)[1]
+    except requests.RequestException as e:
+        raise RangedFetchError(f"не удалось узнать размер: {e}") from e
+    if not total.isdigit():
+        raise RangedFetchError(f"неизвестный размер файла: {content_range}")
+    return int(total)
+
+
+def _fetch_range(
+    session: requests.Session,
+    url: str,
+    headers: dict,
+    fd: int,
+    start: int,
+    end: int,
+    retries: int,
+    timeout: float,
+    progress: _Progress,
+    should_stop: Callable[[], bool],
+) -> None:
+    """Скачивает байты [start, end] прямо в нужное место файла; при обрыве докачивает с места остановки."""
+    offset = start
+    for attempt in range(retries + 1):
+        try:
+            r = session.get(url, headers={**headers, "Range": f"bytes={offset}-{end}"}, timeout=timeout, stream=True)
+            with r:
+                # Сервер может проигнорировать Range и отдать файл целиком
+                if r.status_code != 206 or not r.headers.get("Content-Range", "").startswith(f"bytes {offset}-"):
+                    raise RangedFetchError(f"HTTP {r.status_code} на диапазон {offset}-{end}")
+                for chunk in r.iter_content(_READ_SIZE):
+                    if should_stop():
+                        raise FetchCancelled()
+                    chunk = chunk[: end + 1 - offset]
+                    written = 0
+                    while written < len(chunk):
+                        written += os.pwrite(fd, chunk[written:], offset + written)
+                    offset += len(chunk)
+                    progress.add(len(chunk))
+                    if offset > end:
+                        return
+            raise RangedFetchError(f"диапазон {start}-{end} оборвался на {offset}")
+        except (requests.RequestException, RangedFetchError) as e:
+            if attempt == retries:
+                raise RangedFetchError(f"диапазон {start}-{end}: {e}") from e
+            time.sleep(min(0.5 * 2 ** attempt, 4))
+
+
+def fetch_ranges(
+    url: str,
+    path: str,
+    size: int | None = None,
+    headers: dict | None = None,
+    chunk_size: int = 4 * 1024 * 1024,
+    parallel: int = 4,
+    retries: int = 3,
+    timeout: float = 30,
+    on_progress: Callable[[int, int], None] | None = None,
+    cancel: threading.Event | None = None,
+    session: requests.Session | None = None,
+) -> int:
+    """Скачивает файл по HTTP параллельными диапазонами (Range) в заранее выделенный файл.
+
+    Не больше parallel запросов одновременно, каждый кусок по chunk_size пишется
+    на своё место через os.pwrite. Упавший кусок повторяется до retries раз
+    с места обрыва. Возвращает размер. При ошибке файл удаляется и
+    выбрасывается RangedFetchError (или FetchCancelled при отмене).
+    """
+    session = session or _session
+    headers = dict(headers or {})
+    if size is None:
+        size = probe_size(url, headers, timeout, session)
+    if size <= 0:
+        raise RangedFetchError("пустой файл")
+
+    ranges = [(start, min(start + chunk_size, size) - 1) for start in range(0, size, chunk_size)]
+    progress = _Progress(size, on_progress)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+    ok = False
+    try:
+        # Место под файл выделяется сразу, куски пишутся на свои места в любом порядке
+        try:
+            os.posix_fallocate(fd, 0, size)
+        except (AttributeError, OSError):
+            os.ftruncate(fd, size)
+        failed = threading.Event()
+
+        def should_stop() -> bool:
+            return failed.is_set() or (cancel is not None and cancel.is_set())
+
+        def run(bounds: tuple[int, int]) -> None:
+            if should_stop():
+                raise FetchCancelled()
+            try:
+                _fetch_range(session, url, headers, fd, *bounds, retries, timeout, progress, should_stop)
+            except RangedFetchError:
+                # Остальные куски бессмысленны: останавливаем их
+                failed.set()
+                raise
+
+        with ThreadPoolExecutor(max_workers=max(1, min(parallel, len(ranges)))) as pool:
+            futures = [pool.submit(run, bounds) for bounds in ranges]
+            errors = [f.exception() for f in futures]
+        if cancel is not None and cancel.is_set():
+            raise FetchCancelled()
+        for error in errors:
+            if error is not None and not isinstance(error, FetchCancelled):
+                raise error
+        if progress.done != size:
+            raise RangedFetchError(f"получено {progress.done} из {size} байт")
+        ok = True
+        return size
+    finally:
+        os.close(fd)
+        if not ok:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -0,0 +1,83 @@
+import time
+from typing import Hashable
+
+# Результаты RateLimiter.hit
+ALLOWED = "allowed"
+LIMITED = "limited"
+FLOOD = "flood"
+
+
+class _Window:
+    __slots__ = ("index", "accepted", "prev_accepted", "attempts", "prev_attempts")
+
+    def __init__(self, index: int):
+        self.index = index
+        self.accepted = 0
+        self.prev_accepted = 0
+        self.attempts = 0
+        self.prev_attempts = 0
+
+    def roll(self, index: int) -> None:
+        # Соседнее окно переходит в "предыдущее", более старые счётчики обнуляются
+        adjacent = index == self.index + 1
+        self.prev_accepted = self.accepted if adjacent else 0
+        self.prev_attempts = self.attempts if adjacent else 0
+        self.accepted = 0
+        self.attempts = 0
+        self.index = index
+
+
+class RateLimiter:
+    """Скользящее окно на пользователя с ограниченной памятью.
+
+    Окно приближается двумя счётчиками (текущее и предыдущее окно, вес
+    предыдущего убывает линейно), поэтому запись — пять чисел в __slots__,
+    а не очередь меток времени. Отдельно считаются все попытки, включая
+    отклонённые: флуд (flood_threshold попыток за окно) обнаруживается,
+    даже если порог выше лимита. Записи пользователей, молчавших два окна,
+    удаляются проходом раз в окно.
+    """
+
+    def __init__(self, limit: int, flood_threshold: int, window: float = 60.0):
+        self.limit = limit
+        self.flood_threshold = flood_threshold
+        self.window = window
+        self._records: dict[Hashable, _Window] = {}
+        self._next_sweep = 0.0
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def hit(self, key: Hashable, now: float | None = None) -> str:
+        """Учитывает сообщение пользователя: ALLOWED, LIMITED или FLOOD."""
+        now = time.monotonic() if now is None else now
+        if now >= self._next_sweep:
+            self.sweep(now)
+        index = int(now // self.window)
+        record = self._records.get(key)
+        if record is None:
+            record = self._records[key] = _Window(index)
+        elif record.index != index:
+            record.roll(index)
+        # Доля предыдущего окна, ещё попадающая в скользящее окно
+        weight = 1.0 - (now % self.window) / self.window
+
+        record.attempts += 1
+        if record.prev_attempts * weight + record.attempts >= self.flood_threshold:
+            # После бана пользователь начинает с чистого листа
+            del self._records[key]
+            return FLOOD
+        if record.prev_accepted * weight + record.accepted >= self.limit:
+            return LIMITED
+        record.accepted += 1
+        return ALLOWED
+
+    def sweep(self, now: float | None = None) -> int:
+        """Удаляет записи, в которых оба окна уже пусты. Возвращает число удалённых."""
+        now = time.monotonic() if now is None else now
+        self._next_sweep = now + self.window
+        current = int(now // self.window)
+        idle = [key for key, record in self._records.items() if record.index < current - 1]
+        for key in idle:
+            del self._records[key]
+        return len(idle)
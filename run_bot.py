@@ -5,9 +5,12 @@
 import os
 import sys
 import asyncio
-from bot import main
 
 if __name__ == "__main__":
+    # Импорт внутри: процессы загрузки (spawn) перевыполняют этот файл как
+    # __mp_main__ и не должны тянуть за собой весь bot.py
+    from bot import main
+
     # Устанавливаем переменные окружения если не установлены
     if not os.getenv("TELEGRAM_BOT_TOKEN"):
         print("Ошибка: TELEGRAM_BOT_TOKEN не найден!")
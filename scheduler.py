@@ -0,0 +1,234 @@
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Hashable, Iterator
+
+logger = logging.getLogger(__name__)
+
+# Вес нового наблюдения в скользящем среднем времени обслуживания
+SERVICE_EWMA_ALPHA = 0.2
+# Оценка до первой выполненной задачи, секунды
+DEFAULT_SERVICE_SECONDS = 30.0
+# Окно, по которому считается пропускная способность (задач в секунду)
+THROUGHPUT_WINDOW = 300.0
+THROUGHPUT_MIN_SAMPLES = 5
+
+
+class _Pending:
+    __slots__ = ("job", "platform")
+
+    def __init__(self, job: Any, platform: str):
+        self.job = job
+        self.platform = platform
+
+
+class DownloadScheduler:
+    """Пул из N воркеров с честной очередью по пользователям.
+
+    У каждого пользователя своя очередь; воркеры берут задачи по кругу
+    (round-robin), пользователь с весом w получает до w задач за круг —
+    так пачка ссылок от одного человека не ставит остальных в хвост.
+    platform_caps ограничивает число одновременных задач платформы: при
+    сбое TikTok его задачи не занимают все воркеры. Задача, упёршаяся в
+    лимит платформы, ждёт, а воркер берёт следующую по кругу.
+
+    on_position(job, позиция, ожидание_с) вызывается при постановке в
+    очередь и не чаще раза в position_interval при движении очереди.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[Any], Awaitable[None]],
+        workers: int,
+        max_queue: int,
+        platform_caps: dict[str, int] | None = None,
+        on_position: Callable[[Any, int, float], None] | None = None,
+        position_interval: float = 10.0,
+    ):
+        self._handler = handler
+        self.workers = workers
+        self.max_queue = max_queue
+        self.platform_caps = platform_caps or {}
+        self.on_position = on_position
+        self.position_interval = position_interval
+        self.active = 0
+        self.pending = 0
+        self.running: dict[str, int] = {}
+        self.avg_service = DEFAULT_SERVICE_SECONDS
+        self._served = 0
+        self._queues: dict[Hashable, deque[_Pending]] = {}
+        self._weights: dict[Hashable, int] = {}
+        # Пользователи с задачами в порядке обхода и их остаток квоты на текущий круг
+        self._ring: deque[Hashable] = deque()
+        self._credit: dict[Hashable, int] = {}
+        self._wake = asyncio.Event()
+        self._tasks: list[asyncio.Task] = []
+        self._last_positions = 0.0
+        self._completions: deque[float] = deque(maxlen=1000)
+
+    def is_full(self) -> bool:
+        return self.pending >= self.max_queue
+
+    def queued_by_user(self) -> dict[Hashable, int]:
+        return {user: len(q) for user, q in self._queues.items()}
+
+    def queued(self, user: Hashable) -> int:
+        queue = self._queues.get(user)
+        return len(queue) if queue else 0
+
+    def submit(self, job: Any, user: Hashable, platform: str, weight: int = 1) -> bool:
+        """Ставит задачу в очередь пользователя. False — общая очередь заполнена."""
+        if self.is_full():
+            return False
+        queue = self._queues.get(user)
+        if queue is None:
+            queue = self._queues[user] = deque()
+            self._ring.append(user)
+            self._credit[user] = max(1, weight)
+        self._weights[user] = max(1, weight)
+        queue.append(_Pending(job, platform))
+        self.pending += 1
+        self._wake.set()
+        if self.on_position is not None:
+            position = self.position_of(job)
+            self._notify(job, position)
+        return True
+
+    def _projected(self) -> Iterator[_Pending]:
+        """Порядок, в котором задачи будут взяты, если лимиты платформ не вмешаются."""
+        ring = deque(self._ring)
+        taken = dict.fromkeys(ring, 0)
+        credit = {user: self._credit[user] for user in ring}
+        while ring:
+            user = ring[0]
+            queue = self._queues[user]
+            yield queue[taken[user]]
+            taken[user] += 1
+            credit[user] -= 1
+            if taken[user] >= len(queue):
+                ring.popleft()
+            elif credit[user] <= 0:
+                credit[user] = self._weights[user]
+                ring.rotate(-1)
+
+    def position_of(self, job: Any) -> int:
+        for position, item in enumerate(self._projected(), 1):
+            if item.job is job:
+                return position
+        return 0
+
+    def throughput(self) -> float | None:
+        """Выполнено задач в секунду за последние THROUGHPUT_WINDOW; None — мало данных."""
+        now = time.monotonic()
+        while self._completions and now - self._completions[0] > THROUGHPUT_WINDOW:
+            self._completions.popleft()
+        if len(self._completions) < THROUGHPUT_MIN_SAMPLES:
+            return None
+        # Пока бот работает меньше окна, делим на фактически прошедшее время
+        span = min(THROUGHPUT_WINDOW, now - self._completions[0])
+        return len(self._completions) / span if span > 0 else None
+
+    def expected_wait(self, position: int) -> float:
+        """Сколько секунд ждать начала задачи на позиции position.
+
+        Основа — недавняя пропускная способность (учитывает реальную загрузку
+        и сбои), пока её нет — среднее время обслуживания на воркер.
+        """
+        idle = self.workers - self.active
+        if position <= idle:
+            return 0.0
+        rate = self.throughput()
+        if rate is not None and self.active >= self.workers:
+            return (position - idle) / rate
+        return math.ceil((position - idle) / self.workers) * self.avg_service
+
+    def _notify(self, job: Any, position: int) -> None:
+        try:
+            self.on_position(job, position, self.expected_wait(position))
+        except Exception:
+            logger.exception("Ошибка в обработчике позиции в очереди")
+
+    def _notify_all(self) -> None:
+        now = time.monotonic()
+        if self.on_position is None or now - self._last_positions < self.position_interval:
+            return
+        self._last_positions = now
+        for position, item in enumerate(self._projected(), 1):
+            self._notify(item.job, position)
+
+    def _take(self) -> _Pending | None:
+        """Следующая задача по кругу, пропуская платформы, упёршиеся в лимит."""
+        for _ in range(len(self._ring)):
+            user = self._ring[0]
+            queue = self._queues[user]
+            item = queue[0]
+            cap = self.platform_caps.get(item.platform)
+            if cap is not None and self.running.get(item.platform, 0) >= cap:
+                # Очередь пользователя упорядочена: пропускаем его в этом круге
+                self._ring.rotate(-1)
+                continue
+            queue.popleft()
+            self.pending -= 1
+            self._credit[user] -= 1
+            if not queue:
+                self._ring.popleft()
+                del self._queues[user], self._credit[user], self._weights[user]
+            elif self._credit[user] <= 0:
+                self._credit[user] = self._weights[user]
+                self._ring.rotate(-1)
+            return item
+        return None
+
+    def start(self) -> None:
+        if self._tasks:
+            return
+        for n in range(self.workers):
+            self._tasks.append(asyncio.create_task(self._worker(n), name=f"download-worker-{n}"))
+        logger.info(
+            "Запущено воркеров загрузки: %d (очередь до %d, лимиты платформ: %s)",
+            self.workers, self.max_queue, self.platform_caps or "нет",
+        )
+
+    async def _worker(self, n: int) -> None:
+        while True:
+            item = self._take()
+            if item is None:
+                self._wake.clear()
+                await self._wake.wait()
+                continue
+            self.active += 1
+            self.running[item.platform] = self.running.get(item.platform, 0) + 1
+            self._notify_all()
+            started = time.monotonic()
+            try:
+                await self._handler(item.job)
+            except Exception as e:
+                logger.exception("Worker %d error: %s", n, e)
+            finally:
+                self.active -= 1
+                self.running[item.platform] -= 1
+                elapsed = time.monotonic() - started
+                if self._served == 0:
+                    self.avg_service = elapsed
+                else:
+                    self.avg_service += SERVICE_EWMA_ALPHA * (elapsed - self.avg_service)
+                self._served += 1
+                self._completions.append(time.monotonic())
+                # Освободился слот платформы: другие воркеры могут взять задачу, которую пропускали
+                self._wake.set()
+
+    async def stop(self) -> list[Any]:
+        """Отменяет воркеров (вместе с текущими загрузками) и возвращает невыполненные задачи."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+        dropped = [item.job for queue in self._queues.values() for item in queue]
+        self._queues.clear()
+        self._ring.clear()
+        self._credit.clear()
+        self._weights.clear()
+        self.pending = 0
+        return dropped
@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import time
+
+from telegram.error import BadRequest, RetryAfter
+
+logger = logging.getLogger(__name__)
+
+
+def retry_after_seconds(e: RetryAfter) -> float:
+    value = e.retry_after
+    return value.total_seconds() if hasattr(value, "total_seconds") else float(value)
+
+
+class StatusUpdater:
+    """Общие правила для сообщений статуса: минимальный интервал правок и пауза после 429."""
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.paused_until = 0.0
+        self.edits_sent = 0
+        self.edits_dropped = 0
+
+    def pause(self, seconds: float) -> None:
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        logger.warning("Flood control: правки статусов приостановлены на %.0f с", seconds)
+
+    def wrap(self, message) -> "StatusMessage":
+        return StatusMessage(message, self)
+
+    def wrap_ids(self, bot, chat_id: int, message_id: int, text: str | None = None) -> "StatusMessage":
+        """Сообщение, известное только по id (например, восстановленное из журнала задач)."""
+        return StatusMessage(_MessageRef(bot, chat_id, message_id, text), self)
+
+
+class _MessageRef:
+    """Минимальная замена telegram.Message для StatusMessage: правка и удаление по id."""
+
+    __slots__ = ("bot", "chat_id", "message_id", "text")
+
+    def __init__(self, bot, chat_id: int, message_id: int, text: str | None):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.text = text
+
+    async def edit_text(self, text: str):
+        return await self.bot.edit_message_text(text=text, chat_id=self.chat_id, message_id=self.message_id)
+
+    async def delete(self):
+        return await self.bot.delete_message(chat_id=self.chat_id, message_id=self.message_id)
+
+
+class StatusMessage:
+    """Сообщение статуса ("⏳ ...", "⬇️ ...") с отложенными правками.
+
+    set()/edit_text() только запоминают желаемый текст; фоновая задача
+    отправляет не чаще раза в interval и всегда самый свежий текст —
+    промежуточные состояния, устаревшие до отправки, выбрасываются.
+    """
+
+    def __init__(self, message, updater: StatusUpdater):
+        self.message = message
+        self._updater = updater
+        self._desired: str | None = None
+        self._sent_text = message.text
+        self._sent_at = time.monotonic()
+        self._task: asyncio.Task | None = None
+        self._closed = False
+
+    def set(self, text: str) -> None:
+        if self._closed:
+            return
+        if self._desired is not None and self._desired != self._sent_text:
+            self._updater.edits_dropped += 1
+        self._desired = text
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def edit_text(self, text: str) -> None:
+        self.set(text)
+
+    async def _flush_loop(self) -> None:
+        updater = self._updater
+        while not self._closed and self._desired is not None and self._desired != self._sent_text:
+            delay = max(self._sent_at + updater.interval, updater.paused_until) - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            text = self._desired
+            try:
+                await self.message.edit_text(text)
+                updater.edits_sent += 1
+            except RetryAfter as e:
+                updater.pause(retry_after_seconds(e))
+                continue
+            except BadRequest as e:
+                if "not modified" not in str(e).lower():
+                    logger.warning("Не удалось обновить статус: %s", e)
+            except Exception as e:
+                logger.warning("Не удалось обновить статус: %s", e)
+            self._sent_text = text
+            self._sent_at = time.monotonic()
+
+    async def flush(self) -> None:
+        """Дожидается отправки последнего текста."""
+        if self._task is not None:
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def delete(self) -> None:
+        """Удаляет сообщение; неотправленные правки отменяются."""
+        self._closed = True
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            self._updater.edits_dropped += 1
+        for _ in range(2):
+            try:
+                await self.message.delete()
+                return
+            except RetryAfter as e:
+                self._updater.pause(retry_after_seconds(e))
+                await asyncio.sleep(retry_after_seconds(e))
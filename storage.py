@@ -0,0 +1,221 @@
+import asyncio
+import heapq
+import json
+import logging
+import os
+import time
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+def _atomic_write(path: Path, payload: str) -> None:
+    """Пишет во временный файл и переименовывает: файл никогда не бывает наполовину записан."""
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(payload)
+    os.replace(tmp_path, path)
+
+
+class UserStore:
+    """Реестр пользователей в памяти с отложенной пакетной записью в users.json.
+
+    Файл читается один раз при старте (load(), не в конструкторе: модуль
+    импортируют и процессы загрузки). Изменения копятся в памяти и сбрасываются
+    на диск по таймеру или после flush_dirty изменённых записей, а также при остановке.
+    """
+
+    def __init__(self, path: Path, flush_interval: float, flush_dirty: int):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.flush_dirty = flush_dirty
+        self.users: dict[str, dict] = {}
+        self._dirty: set[str] = set()
+        self._wake = asyncio.Event()
+
+    def __len__(self) -> int:
+        return len(self.users)
+
+    def load(self) -> None:
+        if self.path.exists():
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self.users = json.load(f)
+            except Exception:
+                logger.exception("Не удалось прочитать %s", self.path)
+
+    def get(self, user_id: int | str) -> dict | None:
+        return self.users.get(str(user_id))
+
+    def touch(self, user_id: int, first_name: str | None = None) -> None:
+        """Учитывает запрос пользователя."""
+        uid = str(user_id)
+        now = int(time.time())
+        data = self.users.get(uid)
+        if data is None:
+            data = self.users[uid] = {
+                "first_name": first_name or "",
+                "request_count": 0,
+                "last_seen": now,
+            }
+        data["request_count"] += 1
+        data["last_seen"] = now
+        if first_name:
+            data["first_name"] = first_name
+        # Написал снова — значит, бот больше не заблокирован
+        data.pop("inactive", None)
+        self._mark_dirty(uid)
+
+    def mark_inactive(self, user_id: int | str) -> None:
+        """Пользователь заблокировал бота: рассылки его пропускают до следующего сообщения."""
+        uid = str(user_id)
+        data = self.users.get(uid)
+        if data is None or data.get("inactive"):
+            return
+        data["inactive"] = True
+        self._mark_dirty(uid)
+
+    def active_ids(self) -> list[str]:
+        return [uid for uid, data in self.users.items() if not data.get("inactive")]
+
+    def _mark_dirty(self, uid: str) -> None:
+        self._dirty.add(uid)
+        if len(self._dirty) >= self.flush_dirty:
+            self._wake.set()
+
+    def _snapshot(self) -> str | None:
+        if not self._dirty:
+            return None
+        self._dirty.clear()
+        return json.dumps(self.users, ensure_ascii=False, indent=2)
+
+    def flush(self) -> None:
+        """Синхронный сброс на диск (используется при остановке)."""
+        payload = self._snapshot()
+        if payload is None:
+            return
+        try:
+            _atomic_write(self.path, payload)
+        except Exception:
+            self._dirty.update(self.users)
+            logger.exception("Не удалось сохранить %s", self.path)
+
+    async def run_flusher(self) -> None:
+        """Фоновая задача: сериализует снимок в цикле событий, пишет файл в потоке."""
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            payload = self._snapshot()
+            if payload is None:
+                continue
+            try:
+                await asyncio.to_thread(_atomic_write, self.path, payload)
+            except Exception:
+                self._dirty.update(self.users)
+                logger.exception("Не удалось сохранить %s", self.path)
+
+
+class BanManager:
+    """Баны в памяти с min-heap по времени окончания.
+
+    Истёкшие баны снимаются с вершины кучи при каждой проверке, поэтому
+    проверка — O(1), а список банов содержит только действующие. Изменения
+    дописываются строкой в журнал; при загрузке (load()) и по мере роста
+    журнал сворачивается в снимок bans.json. Конструктор файлов не трогает.
+    """
+
+    def __init__(self, path: Path, compact_every: int = 200):
+        self.path = path
+        self.journal_path = path.with_suffix(".log")
+        self.compact_every = compact_every
+        self._bans: dict[str, dict] = {}
+        self._heap: list[tuple[int, str]] = []
+        self._journal_lines = 0
+
+    def __len__(self) -> int:
+        self._purge()
+        return len(self._bans)
+
+    def load(self) -> None:
+        if self.path.exists():
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self._bans = json.load(f)
+            except Exception:
+                logger.exception("Не удалось прочитать %s", self.path)
+        if self.journal_path.exists():
+            try:
+                with open(self.journal_path, "r", encoding="utf-8") as f:
+                    for line in f:
+                        try:
+                            entry = json.loads(line)
+                        except ValueError:
+                            continue  # недописанная строка при падении
+                        if entry.get("op") == "ban":
+                            self._bans[entry["uid"]] = {"until": entry["until"], "reason": entry["reason"]}
+                        else:
+                            self._bans.pop(entry["uid"], None)
+            except Exception:
+                logger.exception("Не удалось прочитать %s", self.journal_path)
+        self._heap = [(data.get("until", 0), uid) for uid, data in self._bans.items()]
+        heapq.heapify(self._heap)
+        self._purge()
+        self.compact()
+
+    def _purge(self) -> None:
+        now = time.time()
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            until, uid = heapq.heappop(heap)
+            data = self._bans.get(uid)
+            # Запись в куче могла устареть (повторный бан или разбан)
+            if data is not None and data.get("until", 0) == until:
+                del self._bans[uid]
+
+    def _append(self, entry: dict) -> None:
+        try:
+            with open(self.journal_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        except Exception:
+            logger.exception("Не удалось записать %s", self.journal_path)
+            return
+        self._journal_lines += 1
+        if self._journal_lines >= self.compact_every:
+            self.compact()
+
+    def compact(self) -> None:
+        """Пишет снимок действующих банов и очищает журнал."""
+        self._purge()
+        try:
+            _atomic_write(self.path, json.dumps(self._bans, ensure_ascii=False, indent=2))
+            self.journal_path.unlink(missing_ok=True)
+            self._journal_lines = 0
+        except Exception:
+            logger.exception("Не удалось сохранить %s", self.path)
+
+    def is_banned(self, user_id: int) -> bool:
+        self._purge()
+        return str(user_id) in self._bans
+
+    def ban(self, user_id: int, reason: str, seconds: int) -> None:
+        uid = str(user_id)
+        until = int(time.time()) + seconds
+        self._bans[uid] = {"until": until, "reason": reason}
+        heapq.heappush(self._heap, (until, uid))
+        self._append({"op": "ban", "uid": uid, "until": until, "reason": reason})
+
+    def unban(self, user_id: int) -> bool:
+        uid = str(user_id)
+        if self._bans.pop(uid, None) is None:
+            return False
+        # Запись в куче остаётся и будет отброшена при истечении
+        self._append({"op": "unban", "uid": uid})
+        return True
+
+    def active(self) -> list[tuple[str, dict]]:
+        """Действующие баны, отсортированные по времени окончания."""
+        self._purge()
+        return sorted(self._bans.items(), key=lambda kv: kv[1].get("until", 0))
@@ -0,0 +1,126 @@
+import json
+import os
+import threading
+import time
+from pathlib import Path
+
+# Вес нового наблюдения в скользящих средних
+EWMA_ALPHA = 0.2
+# После стольких неудач подряд стратегия уходит на паузу (circuit breaker)
+FAILURES_TO_COOLDOWN = 3
+COOLDOWN_BASE_SECONDS = 60
+COOLDOWN_MAX_SECONDS = 3600
+
+
+class StrategySelector:
+    """Статистика успеха/задержки стратегий загрузки по платформам.
+
+    order() ставит первыми стратегии с лучшим скользящим процентом успеха
+    (при равенстве — с меньшей задержкой). Стратегия, упавшая
+    FAILURES_TO_COOLDOWN раз подряд, уходит в конец списка на экспоненциально
+    растущую паузу. Статистика хранится в JSON и переживает перезапуск.
+    Методы потокобезопасны: попытки идут из потоков загрузки.
+
+    В процессах-воркерах загрузки autosave выключен: там наблюдения копятся
+    в pending и передаются в основной процесс (drain/merge), а перед задачей
+    воркер получает актуальный снимок (load). Файл читает только основной
+    процесс (load_saved() при старте), не конструктор: модуль импортируют и воркеры.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.autosave = True
+        self.pending: list[tuple[str, str, bool, float]] = []
+        self._lock = threading.Lock()
+        # "platform" -> "strategy" -> stats
+        self._stats: dict[str, dict[str, dict]] = {}
+
+    def load_saved(self) -> None:
+        if not self.path.exists():
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                stats = json.load(f)
+        except Exception:
+            return
+        with self._lock:
+            self._stats = stats
+
+    def _save(self) -> None:
+        tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self._stats, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_path, self.path)
+        except Exception:
+            pass
+
+    def order(self, platform: str, names: list[str]) -> list[str]:
+        """Порядок попыток: исходный порядок служит приоритетом для ещё не опробованных."""
+        now = time.time()
+        with self._lock:
+            stats = self._stats.get(platform, {})
+
+            def key(item):
+                idx, name = item
+                s = stats.get(name)
+                if s is None:
+                    # Не опробованная: после проверенных успешных, но раньше сбоящих
+                    return (0, -1.0, float("inf"), idx)
+                cooling = 1 if s.get("cooldown_until", 0) > now else 0
+                return (cooling, -round(s["success"], 2), s["latency"], idx)
+
+            return [name for _, name in sorted(enumerate(names), key=key)]
+
+    def record(self, platform: str, name: str, ok: bool, latency: float) -> None:
+        with self._lock:
+            if not self.autosave:
+                self.pending.append((platform, name, ok, latency))
+            self._apply(platform, name, ok, latency)
+            if self.autosave:
+                self._save()
+
+    def _apply(self, platform: str, name: str, ok: bool, latency: float) -> None:
+        s = self._stats.setdefault(platform, {}).setdefault(name, {
+            "success": 1.0,
+            "latency": latency,
+            "attempts": 0,
+            "failures": 0,
+            "streak": 0,
+            "cooldown_until": 0,
+        })
+        s["attempts"] += 1
+        s["success"] += EWMA_ALPHA * ((1.0 if ok else 0.0) - s["success"])
+        if ok:
+            s["latency"] += EWMA_ALPHA * (latency - s["latency"])
+            s["streak"] = 0
+            s["cooldown_until"] = 0
+        else:
+            s["failures"] += 1
+            s["streak"] += 1
+            if s["streak"] >= FAILURES_TO_COOLDOWN:
+                pause = COOLDOWN_BASE_SECONDS * 2 ** (s["streak"] - FAILURES_TO_COOLDOWN)
+                s["cooldown_until"] = time.time() + min(pause, COOLDOWN_MAX_SECONDS)
+
+    def load(self, snapshot: dict[str, dict[str, dict]]) -> None:
+        with self._lock:
+            self._stats = snapshot
+
+    def drain(self) -> list[tuple[str, str, bool, float]]:
+        with self._lock:
+            records, self.pending = self.pending, []
+            return records
+
+    def merge(self, records: list[tuple[str, str, bool, float]]) -> None:
+        """Наблюдения из воркера: файл переписывается один раз на пачку, а не на каждую запись."""
+        if not records:
+            return
+        with self._lock:
+            for record in records:
+                self._apply(*record)
+            if self.autosave:
+                self._save()
+
+    def snapshot(self) -> dict[str, dict[str, dict]]:
+        with self._lock:
+            return json.loads(json.dumps(self._stats))
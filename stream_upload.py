@@ -0,0 +1,120 @@
+import asyncio
+import json
+import uuid
+from typing import AsyncIterator, Callable
+
+import httpx
+
+# Кусок чтения из источника; буфер между скачиванием и отправкой — buffer_bytes
+CHUNK_SIZE = 64 * 1024
+
+
+class StreamUploadError(Exception):
+    """Потоковая отправка не удалась.
+
+    body_sent — Telegram получил файл целиком, но ответа нет: видео могло
+    уйти пользователю, и повторять загрузку файлом нельзя (будет дубль).
+    """
+
+    def __init__(self, message: str, body_sent: bool = False):
+        super().__init__(message)
+        self.body_sent = body_sent
+
+
+def _field(boundary: str, name: str, value) -> bytes:
+    if not isinstance(value, str):
+        # Числа, true/false и объекты (reply_parameters) Bot API принимает в JSON
+        value = json.dumps(value)
+    return (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="{name}"\r\n\r\n'
+        f"{value}\r\n"
+    ).encode()
+
+
+async def _produce(client: httpx.AsyncClient, plan: dict, queue: asyncio.Queue) -> None:
+    """Скачивает источник в очередь; в конце кладёт None, при ошибке — исключение."""
+    try:
+        async with client.stream("GET", plan["url"], headers=plan.get("headers")) as r:
+            r.raise_for_status()
+            async for chunk in r.aiter_bytes(CHUNK_SIZE):
+                await queue.put(chunk)
+        await queue.put(None)
+    except Exception as e:
+        await queue.put(e)
+
+
+async def upload_stream(
+    client: httpx.AsyncClient,
+    api_url: str,
+    fields: dict,
+    plan: dict,
+    buffer_bytes: int = 4 * 1024 * 1024,
+    on_progress: Callable[[int, int | None], None] | None = None,
+    timeout: float | None = None,
+) -> dict:
+    """Отправляет видео методом Bot API (sendVideo), передавая байты прямо из скачивания.
+
+    plan: url и headers источника, size (если известен), filename. Скачивание
+    и отправка идут одновременно, между ними очередь не больше buffer_bytes,
+    файл на диск не пишется. timeout — предел на всю передачу (таймауты
+    клиента ограничивают только отдельные чтения). Возвращает отправленное
+    сообщение (result).
+    """
+    boundary = uuid.uuid4().hex
+    head = b"".join(_field(boundary, name, value) for name, value in fields.items() if value is not None)
+    head += (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="video"; filename="{plan["filename"]}"\r\n'
+        f"Content-Type: video/mp4\r\n\r\n"
+    ).encode()
+    tail = f"\r\n--{boundary}--\r\n".encode()
+    size = plan.get("size")
+
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, buffer_bytes // CHUNK_SIZE))
+    producer = asyncio.create_task(_produce(client, plan, queue))
+    state = {"sent": 0, "done": False}
+
+    async def body() -> AsyncIterator[bytes]:
+        yield head
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise StreamUploadError(f"ошибка скачивания: {item}")
+            state["sent"] += len(item)
+            if size is not None and state["sent"] > size:
+                raise StreamUploadError(f"источник больше заявленного размера {size}")
+            if on_progress is not None:
+                on_progress(state["sent"], size)
+            yield item
+        if size is not None and state["sent"] != size:
+            raise StreamUploadError(f"получено {state['sent']} из {size} байт")
+        yield tail
+        state["done"] = True
+
+    headers = {"Content-Type": f"multipart/form-data; boundary={boundary}"}
+    if size is not None:
+        # С известной длиной запрос идёт без chunked-кодирования
+        headers["Content-Length"] = str(len(head) + size + len(tail))
+    try:
+        response = await asyncio.wait_for(client.post(api_url, content=body(), headers=headers), timeout)
+    except StreamUploadError:
+        raise
+    except asyncio.TimeoutError:
+        raise StreamUploadError(f"передача не уложилась в {timeout:g} с", body_sent=state["done"]) from None
+    except Exception as e:
+        raise StreamUploadError(f"ошибка отправки: {e}", body_sent=state["done"]) from e
+    finally:
+        producer.cancel()
+        await asyncio.gather(producer, return_exceptions=True)
+
+    try:
+        data = response.json()
+    except ValueError:
+        raise StreamUploadError(f"HTTP {response.status_code} от Bot API", body_sent=state["done"]) from None
+    if not data.get("ok"):
+        # Telegram отклонил запрос — видео не отправлено, можно повторить файлом
+        raise StreamUploadError(f"Bot API: {data.get('description', response.status_code)}")
+    return data["result"]
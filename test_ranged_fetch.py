@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""
+Проверка ranged_fetch на локальном HTTP-сервере с поддержкой Range.
+
+Сервер отдаёт большой случайный файл, ограничивает скорость каждого
+соединения (чтобы был виден выигрыш от параллельности) и умеет обрывать
+ответы, чтобы проверить повтор упавших диапазонов.
+"""
+import argparse
+import hashlib
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from ranged_fetch import FetchCancelled, RangedFetchError, fetch_ranges, probe_size
+
+
+class FileServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, data: bytes, per_connection_bps: int):
+        super().__init__(("127.0.0.1", 0), RangeHandler)
+        self.data = data
+        self.per_connection_bps = per_connection_bps
+        self.ranges_supported = True
+        # Сколько ещё ответов оборвать на середине; always_fail — обрывать все
+        self.drop_next = 0
+        self.always_fail = False
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def handle_error(self, request, client_address):
+        # Клиент закрыл соединение (отмена, проба размера) — для теста это норма
+        pass
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}/video.mp4"
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        server = self.server
+        data = server.data
+        with server.lock:
+            server.requests += 1
+            drop = server.always_fail or server.drop_next > 0
+            if server.drop_next > 0:
+                server.drop_next -= 1
+
+        header = self.headers.get("Range")
+        if header and server.ranges_supported:
+            start, _, end = header.removeprefix("bytes=").partition("-")
+            start, end = int(start), min(int(end or len(data) - 1), len(data) - 1)
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+        else:
+            start, end = 0, len(data) - 1
+            self.send_response(200)
+        self.send_header("Content-Type", "video/mp4")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+
+        body = memoryview(data)[start:end + 1]
+        if drop:
+            # Обрыв на середине ответа
+            self.wfile.write(body[: len(body) // 2])
+            self.close_connection = True
+            return
+        step = 64 * 1024
+        delay = step / server.per_connection_bps if server.per_connection_bps else 0
+        for offset in range(0, len(body), step):
+            self.wfile.write(body[offset:offset + step])
+            if delay:
+                time.sleep(delay)
+
+
+_server: FileServer | None = None
+
+
+def start_server(size_mb: int = 24, mbps: int = 8) -> FileServer:
+    """Один сервер на все проверки (и при запуске скриптом, и под pytest)."""
+    global _server
+    if _server is None:
+        _server = FileServer(os.urandom(size_mb * 1024 * 1024 + 12345), mbps * 1024 * 1024)
+        threading.Thread(target=_server.serve_forever, daemon=True).start()
+    return _server
+
+
+def sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def test_parallel_matches():
+    server = start_server()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "parallel.mp4")
+        size = fetch_ranges(server.url, path, chunk_size=1024 * 1024, parallel=4)
+        assert size == len(server.data)
+        assert sha256(path) == hashlib.sha256(server.data).hexdigest()
+
+
+def test_retry_failed_ranges():
+    server = start_server()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "retry.mp4")
+        server.drop_next = 3
+        seen = []
+        fetch_ranges(server.url, path, chunk_size=1024 * 1024, parallel=4, on_progress=lambda d, t: seen.append(d))
+        assert sha256(path) == hashlib.sha256(server.data).hexdigest()
+        assert max(seen) == len(server.data)
+
+
+def test_persistent_failure_removes_file():
+    server = start_server()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "broken.mp4")
+        server.always_fail = True
+        try:
+            fetch_ranges(server.url, path, len(server.data), chunk_size=1024 * 1024, retries=1)
+        except RangedFetchError:
+            pass
+        else:
+            raise AssertionError("ожидалась RangedFetchError")
+        finally:
+            server.always_fail = False
+        assert not os.path.exists(path)
+
+
+def test_no_range_support():
+    server = start_server()
+    with tempfile.TemporaryDirectory() as tmp:
+        server.ranges_supported = False
+        try:
+            probe_size(server.url)
+        except RangedFetchError:
+            pass
+        else:
+            raise AssertionError("ожидалась RangedFetchError")
+        try:
+            fetch_ranges(server.url, os.path.join(tmp, "norange.mp4"), len(server.data), retries=0)
+        except RangedFetchError:
+            pass
+        else:
+            raise AssertionError("ожидалась RangedFetchError")
+        finally:
+            server.ranges_supported = True
+
+
+def test_cancel():
+    server = start_server()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "cancel.mp4")
+        cancel = threading.Event()
+        threading.Timer(0.2, cancel.set).start()
+        started = time.monotonic()
+        try:
+            fetch_ranges(server.url, path, chunk_size=1024 * 1024, parallel=2, cancel=cancel)
+        except FetchCancelled:
+            pass
+        else:
+            raise AssertionError("ожидалась FetchCancelled")
+        assert time.monotonic() - started < 2 and not os.path.exists(path)
+
+
+def test_download_format():
+    """Прямой формат из метаданных yt-dlp идёт через параллельную загрузку."""
+    server = start_server()
+    with tempfile.TemporaryDirectory() as tmp:
+        from video_downloader import VideoDownloader
+
+        size = len(server.data)
+        fmt = {"format_id": "h264", "url": server.url, "protocol": "http", "ext": "mp4",
+               "vcodec": "avc1", "acodec": "mp4a", "filesize": size}
+        info = {"id": "ranged", "title": "ranged", "extractor": "generic", "extractor_key": "Generic",
+                "webpage_url": server.url, "formats": [fmt]}
+        before = server.requests
+        path = VideoDownloader.download_format(info, "h264", os.path.join(tmp, "%(id)s.%(ext)s"), max_bytes=None)
+        assert path == os.path.join(tmp, "ranged.mp4"), path
+        assert sha256(path) == hashlib.sha256(server.data).hexdigest()
+        assert server.requests - before > 1, "ожидались параллельные Range-запросы"
+
+
+def bench(server, tmp):
+    print(f"\n=== Скорость ({len(server.data) // 1024 // 1024} МБ, "
+          f"{server.per_connection_bps // 1024 // 1024} МБ/с на соединение) ===")
+    for parallel in (1, 2, 4, 8):
+        path = os.path.join(tmp, f"bench{parallel}.mp4")
+        started = time.perf_counter()
+        fetch_ranges(server.url, path, chunk_size=2 * 1024 * 1024, parallel=parallel)
+        elapsed = time.perf_counter() - started
+        print(f"parallel={parallel}: {elapsed:6.2f} с, {len(server.data) / elapsed / 1024 / 1024:6.1f} МБ/с")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size-mb", type=int, default=24)
+    parser.add_argument("--mbps", type=int, default=8, help="ограничение скорости одного соединения, МБ/с")
+    parser.add_argument("--no-bench", action="store_true")
+    args = parser.parse_args()
+
+    server = start_server(args.size_mb, args.mbps)
+    failed = 0
+    for test in (
+        test_parallel_matches,
+        test_retry_failed_ranges,
+        test_persistent_failure_removes_file,
+        test_no_range_support,
+        test_cancel,
+        test_download_format,
+    ):
+        try:
+            test()
+            print(f"OK   {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"FAIL {test.__name__}: {e}")
+    if not args.no_bench:
+        with tempfile.TemporaryDirectory() as tmp:
+            bench(server, tmp)
+    server.shutdown()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
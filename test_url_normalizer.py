@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Проверка url_normalizer на таблице ссылок: (ссылка, ожидаемый результат classify).
+Разворачивание коротких ссылок проверяется на подставной сессии, без сети.
+"""
+import sys
+
+from url_normalizer import ShortLinkResolver, classify
+
+YT = "dQw4w9WgXcQ"
+TT = "7301234567890123456"
+
+CASES = [
+    # YouTube: Shorts, watch, youtu.be, мобильные и встраиваемые варианты
+    (f"https://www.youtube.com/shorts/{YT}", ("youtube", YT)),
+    (f"https://youtube.com/shorts/{YT}?feature=share", ("youtube", YT)),
+    (f"https://m.youtube.com/shorts/{YT}/", ("youtube", YT)),
+    (f"http://YouTube.com/shorts/{YT}#t=3", ("youtube", YT)),
+    (f"https://www.youtube.com/watch?v={YT}", ("youtube", YT)),
+    (f"https://www.youtube.com/watch?feature=shared&v={YT}&t=10s", ("youtube", YT)),
+    (f"https://m.youtube.com/watch?v={YT}&si=abc", ("youtube", YT)),
+    (f"https://music.youtube.com/watch?v={YT}", ("youtube", YT)),
+    (f"https://youtu.be/{YT}", ("youtube", YT)),
+    (f"https://youtu.be/{YT}?si=Xy12", ("youtube", YT)),
+    (f"https://www.youtube.com/embed/{YT}", ("youtube", YT)),
+    (f"https://www.youtube-nocookie.com/embed/{YT}", ("youtube", YT)),
+    (f"https://www.youtube.com/live/{YT}?feature=share", ("youtube", YT)),
+    (f"  https://youtu.be/{YT}  ", ("youtube", YT)),
+    # YouTube: не видео или битый ID
+    ("https://www.youtube.com/", None),
+    ("https://www.youtube.com/@channel/shorts", None),
+    ("https://www.youtube.com/watch?v=short", None),
+    ("https://www.youtube.com/shorts/", None),
+    ("https://youtu.be/", None),
+    (f"https://notyoutube.com/watch?v={YT}", None),
+    # TikTok: полные ссылки с параметрами отслеживания
+    (f"https://www.tiktok.com/@user.name/video/{TT}", ("tiktok", TT)),
+    (f"https://www.tiktok.com/@user/video/{TT}?is_from_webapp=1&sender_device=pc", ("tiktok", TT)),
+    (f"https://tiktok.com/@user/video/{TT}/", ("tiktok", TT)),
+    (f"https://m.tiktok.com/v/{TT}.html", ("tiktok", TT)),
+    (f"https://www.tiktok.com/embed/v2/{TT}", ("tiktok", TT)),
+    (f"https://www.tiktok.com/embed/{TT}", ("tiktok", TT)),
+    (f"https://www.tiktok.com/@user/photo/{TT}", ("tiktok", TT)),
+    # TikTok: короткие ссылки — ID только после редиректа
+    ("https://vm.tiktok.com/ZMabc123/", ("tiktok", None)),
+    ("https://vt.tiktok.com/ZSxyz789/", ("tiktok", None)),
+    ("https://www.tiktok.com/t/ZTRabc123/", ("tiktok", None)),
+    ("https://vm.tiktok.com/", None),
+    # TikTok: не видео
+    ("https://www.tiktok.com/@user", None),
+    ("https://www.tiktok.com/@user/video/notanid", None),
+    ("https://www.tiktok.com/foryou", None),
+    # Прочее
+    (f"ftp://youtu.be/{YT}", None),
+    ("not a url", None),
+    ("https://example.com/tiktok.com/@user/video/1234567890", None),
+    ("https://vimeo.com/12345", None),
+    ("http://[::1", None),
+]
+
+
+class FakeResponse:
+    def __init__(self, url, status_code=200):
+        self.url = url
+        self.status_code = status_code
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class FakeSession:
+    """Редиректы коротких ссылок; считает обращения, чтобы проверить кэш."""
+
+    def __init__(self, redirects, head_status=200):
+        self.redirects = redirects
+        self.head_status = head_status
+        self.calls = 0
+
+    def head(self, url, allow_redirects, timeout):
+        self.calls += 1
+        return FakeResponse(self.redirects.get(url, url), self.head_status)
+
+    def get(self, url, allow_redirects, timeout, stream):
+        self.calls += 1
+        return FakeResponse(self.redirects.get(url, url))
+
+
+def test_corpus():
+    failures = []
+    for url, expected in CASES:
+        got = classify(url)
+        if got != expected:
+            failures.append(f"{url!r}: ожидалось {expected}, получено {got}")
+    assert not failures, "\n".join(failures)
+
+
+def test_short_links():
+    short = "https://vm.tiktok.com/ZMabc123/"
+    full = f"https://www.tiktok.com/@user/video/{TT}?_r=1&u_code=xyz"
+    session = FakeSession({short: full})
+    resolver = ShortLinkResolver(cache_size=2, session=session)
+    assert resolver.normalize(short) == ("tiktok", TT)
+    assert resolver.normalize(short) == ("tiktok", TT)
+    assert session.calls == 1 and resolver.hits == 1 and resolver.misses == 1
+    # Полные ссылки в сеть не ходят
+    assert resolver.normalize(f"https://youtu.be/{YT}") == ("youtube", YT)
+    assert session.calls == 1
+    # Редирект на главную (капча, регион) — ID остаётся неизвестным
+    assert resolver.normalize("https://vt.tiktok.com/ZSnowhere/") == ("tiktok", None)
+    # LRU: самая старая запись вытесняется
+    resolver.resolve("https://vm.tiktok.com/a/")
+    resolver.resolve("https://vm.tiktok.com/b/")
+    assert short not in resolver._cache and len(resolver._cache) == 2
+    # HEAD не поддерживается — повтор через GET
+    session = FakeSession({short: full}, head_status=405)
+    assert ShortLinkResolver(session=session).normalize(short) == ("tiktok", TT)
+    assert session.calls == 2
+
+
+if __name__ == "__main__":
+    failed = 0
+    for test in (test_corpus, test_short_links):
+        try:
+            test()
+            print(f"OK   {test.__name__}")
+        except AssertionError as e:
+            failed += 1
+            print(f"FAIL {test.__name__}\n{e}")
+    print(f"\nСсылок в таблице: {len(CASES)}")
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,148 @@
+import re
+import threading
+from collections import OrderedDict
+from urllib.parse import parse_qs, urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+TIKTOK = "tiktok"
+YOUTUBE = "youtube"
+
+_YOUTUBE_ID = re.compile(r"[A-Za-z0-9_-]{11}")
+_TIKTOK_ID = re.compile(r"\d{8,25}")
+# Префиксы хоста, которые не меняют видео
+_HOST_PREFIXES = ("www.", "m.", "mobile.")
+_YOUTUBE_HOSTS = frozenset({"youtube.com", "music.youtube.com", "youtube-nocookie.com"})
+# Короткие ссылки TikTok: ID видео появляется только после редиректа
+_TIKTOK_SHORT_HOSTS = frozenset({"vm.tiktok.com", "vt.tiktok.com"})
+_YOUTUBE_PATH_PREFIXES = ("shorts", "embed", "live", "v", "e")
+
+_USER_AGENT = (
+    "Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) "
+    "AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.0 Mobile/15E148 Safari/604.1"
+)
+
+
+def _host(netloc: str) -> str:
+    host = netloc.rsplit("@", 1)[-1].split(":", 1)[0].lower().rstrip(".")
+    for prefix in _HOST_PREFIXES:
+        if host.startswith(prefix):
+            return host[len(prefix):]
+    return host
+
+
+def _youtube_id(host: str, path: str, query: str) -> str | None:
+    parts = [p for p in path.split("/") if p]
+    if host == "youtu.be":
+        candidate = parts[0] if parts else ""
+    elif parts and parts[0] == "watch":
+        candidate = (parse_qs(query).get("v") or [""])[0]
+    elif len(parts) >= 2 and parts[0] in _YOUTUBE_PATH_PREFIXES:
+        candidate = parts[1]
+    else:
+        return None
+    return candidate if _YOUTUBE_ID.fullmatch(candidate) else None
+
+
+def _tiktok_id(path: str) -> str | None:
+    parts = [p for p in path.split("/") if p]
+    # /@user/video/<id>, /@user/photo/<id>, /embed/v2/<id>, /embed/<id>, /v/<id>.html
+    if len(parts) >= 3 and parts[0].startswith("@") and parts[1] in ("video", "photo"):
+        candidate = parts[2]
+    elif parts and parts[0] in ("embed", "v"):
+        candidate = parts[-1].removesuffix(".html")
+    else:
+        return None
+    return candidate if _TIKTOK_ID.fullmatch(candidate) else None
+
+
+def classify(url: str) -> tuple[str, str | None] | None:
+    """Ссылка -> (платформа, ID видео) без обращения к сети.
+
+    None — ссылка не поддерживается. ID None — короткая ссылка TikTok,
+    её нужно развернуть через ShortLinkResolver. Хост (www./m.), схема,
+    параметры отслеживания и фрагмент на результат не влияют.
+    """
+    try:
+        parts = urlsplit(url.strip())
+    except ValueError:
+        return None
+    if parts.scheme.lower() not in ("http", "https"):
+        return None
+    host = _host(parts.netloc)
+    if host in _YOUTUBE_HOSTS or host == "youtu.be":
+        vid = _youtube_id(host, parts.path, parts.query)
+        return (YOUTUBE, vid) if vid else None
+    if host in _TIKTOK_SHORT_HOSTS:
+        return (TIKTOK, None) if parts.path.strip("/") else None
+    if host == "tiktok.com":
+        if parts.path.startswith("/t/") and parts.path[3:].strip("/"):
+            return TIKTOK, None
+        vid = _tiktok_id(parts.path)
+        return (TIKTOK, vid) if vid else None
+    return None
+
+
+def video_key(platform: str, video_id: str) -> str:
+    """Ключ для кэшей и дедупликации: "youtube:<id>" или "tiktok:<id>"."""
+    return f"{platform}:{video_id}"
+
+
+class ShortLinkResolver:
+    """Разворачивает короткие ссылки TikTok (vm./vt./tiktok.com/t/) в полные.
+
+    Один requests.Session с пулом соединений на все запросы: HEAD со
+    следованием редиректам, без скачивания страницы. Результаты хранятся
+    в LRU, так что одна и та же ссылка разворачивается один раз. Вызов
+    блокирующий (из бота — через asyncio.to_thread), потокобезопасен.
+    """
+
+    def __init__(self, cache_size: int = 4096, timeout: float = 10.0, session: requests.Session | None = None):
+        self.cache_size = cache_size
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._cache: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=16, max_retries=1)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers["User-Agent"] = _USER_AGENT
+        self._session = session
+
+    def resolve(self, url: str) -> str | None:
+        """Полная ссылка или None, если развернуть не удалось (ошибка не кэшируется)."""
+        url = url.strip()
+        with self._lock:
+            final = self._cache.get(url)
+            if final is not None:
+                self._cache.move_to_end(url)
+                self.hits += 1
+                return final
+            self.misses += 1
+        try:
+            r = self._session.head(url, allow_redirects=True, timeout=self.timeout)
+            final = r.url
+            if r.status_code == 405:
+                # Некоторые узлы не принимают HEAD
+                with self._session.get(url, allow_redirects=True, timeout=self.timeout, stream=True) as r:
+                    final = r.url
+        except requests.RequestException:
+            return None
+        with self._lock:
+            self._cache[url] = final
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return final
+
+    def normalize(self, url: str) -> tuple[str, str | None] | None:
+        """Как classify, но короткие ссылки разворачиваются (ID None — развернуть не вышло)."""
+        ref = classify(url)
+        if ref is None or ref[1] is not None:
+            return ref
+        final = self.resolve(url)
+        resolved = classify(final) if final else None
+        return resolved if resolved and resolved[1] else ref
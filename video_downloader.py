@@ -1,111 +1,769 @@
+import copy
+import functools
+import glob
 import os
 import re
 import requests
+import subprocess
+import threading
 import time
-from urllib.parse import urlparse, parse_qs
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable
 
 import certifi
 import yt_dlp
 import imageio_ffmpeg
 
+from metrics import bytes_downloaded_total, failures_total, platform_of, stage_seconds
+from ranged_fetch import FetchCancelled, RangedFetchError, fetch_ranges, probe_size
+from strategy_stats import StrategySelector
+from url_normalizer import TIKTOK, YOUTUBE, classify
 
-def extract_youtube_id(url: str) -> str | None:
-    p = urlparse(url)
 
-    # youtu.be/<id>
-    if p.netloc in ("youtu.be", "www.youtu.be"):
-        vid = p.path.strip("/").split("/")[0]
-        return vid or None
+# Сколько секунд живёт результат extract_info(download=False) для одной ссылки.
+# Ссылки на форматы со временем протухают, поэтому кэш короткий.
+PROBE_TTL = 120
 
-    # youtube.com/shorts/<id>
-    if p.path.startswith("/shorts/"):
-        parts = p.path.split("/")
-        return parts[2] if len(parts) > 2 and parts[2] else None
+# Хеджирование YouTube-подходов: следующий стартует, если предыдущий не ответил
+# за YT_HEDGE_DELAY секунд; одновременно не больше YT_HEDGE_PARALLEL попыток.
+YT_HEDGE_DELAY = float(os.getenv("YT_HEDGE_DELAY", "8"))
+YT_HEDGE_PARALLEL = int(os.getenv("YT_HEDGE_PARALLEL", "2"))
+# Общий дедлайн на одну загрузку, секунд
+DOWNLOAD_DEADLINE = float(os.getenv("DOWNLOAD_DEADLINE", "180"))
 
-    # youtube.com/watch?v=<id>
-    qs = parse_qs(p.query)
-    if "v" in qs and qs["v"]:
-        return qs["v"][0]
+# Лимит Bot API на загрузку файла
+UPLOAD_LIMIT_BYTES = int(os.getenv("UPLOAD_LIMIT_MB", "50")) * 1024 * 1024
+# Во сколько раз файл может превышать лимит, чтобы его ещё имело смысл сжимать
+COMPRESS_MAX_FACTOR = float(os.getenv("COMPRESS_MAX_FACTOR", "4"))
+COMPRESS_TIMEOUT = int(os.getenv("COMPRESS_TIMEOUT", "150"))
+# Ниже этого битрейта видео сжатие теряет смысл
+MIN_VIDEO_KBPS = 150
+COMPRESS_AUDIO_KBPS = 96
 
+# Прямые (не фрагментированные) форматы от RANGED_MIN_MB качаются кусками по
+# RANGED_CHUNK_MB в RANGED_PARALLEL соединений; 1 — обычная загрузка yt-dlp
+RANGED_PARALLEL = int(os.getenv("RANGED_PARALLEL", "4"))
+RANGED_CHUNK_MB = float(os.getenv("RANGED_CHUNK_MB", "2"))
+RANGED_MIN_MB = float(os.getenv("RANGED_MIN_MB", "3"))
+# Фрагменты HLS/DASH yt-dlp качает параллельно
+FRAGMENT_CONCURRENCY = int(os.getenv("FRAGMENT_CONCURRENCY", "4"))
+
+_probe_cache: dict[tuple[str, str], tuple[float, dict]] = {}
+_probe_lock = threading.Lock()
+
+# Порядок UA-подходов YouTube и форматов TikTok подстраивается под наблюдаемый успех
+strategy_stats = StrategySelector(Path("strategy_stats.json"))
+
+# Доля скачанного (0..1); в процессе-воркере сюда подставляется отправка прогресса в бота
+progress_callback: Callable[[float], None] | None = None
+
+# На macOS/Python 3.13 иногда не подтягиваются корневые сертификаты.
+# CA bundle из certifi указываем один раз на процесс.
+os.environ.setdefault("SSL_CERT_FILE", certifi.where())
+os.environ.setdefault("REQUESTS_CA_BUNDLE", certifi.where())
+
+
+@functools.cache
+def ffmpeg_exe() -> str:
+    """ffmpeg без Homebrew (из imageio_ffmpeg); путь ищется один раз на процесс."""
+    return imageio_ffmpeg.get_ffmpeg_exe()
+
+
+def _failure_cause(e: Exception) -> str:
+    """Короткая причина неудачи для метрик (ограниченный набор значений)."""
+    text = str(e).lower()
+    for needle, cause in (
+        ("http error 403", "http_403"),
+        ("http error 429", "http_429"),
+        ("sign in", "login_required"),
+        ("timed out", "timeout"),
+        ("unavailable", "unavailable"),
+        ("ffmpeg", "ffmpeg"),
+    ):
+        if needle in text:
+            return cause
+    return type(e).__name__
+
+
+def _report_progress(d: dict, cancel: threading.Event | None = None) -> None:
+    """Прогресс текущей задачи воркера.
+
+    Отменённая (проигравшая) попытка может доработать уже после ответа, когда
+    воркер взял следующую задачу: её отчёты отбрасываются, чтобы не попасть
+    в прогресс чужой задачи.
+    """
+    if progress_callback is None or d.get("status") != "downloading":
+        return
+    if cancel is not None and cancel.is_set():
+        return
+    total = d.get("total_bytes") or d.get("total_bytes_estimate")
+    done = d.get("downloaded_bytes")
+    if total and done:
+        progress_callback(min(done / total, 1.0))
+
+
+class VideoTooLarge(Exception):
+    """Видео не помещается в лимит Telegram даже со сжатием."""
+
+    def __init__(self, size: int):
+        super().__init__(size)
+        self.size = size
+
+    def __str__(self) -> str:
+        return (f"Видео слишком большое для Telegram (~{self.size / 1024 / 1024:.0f} МБ, "
+                f"лимит {UPLOAD_LIMIT_BYTES // 1024 // 1024} МБ)")
+
+
+def _is_h264(codec: str | None) -> bool:
+    return bool(codec) and codec.lower().startswith(("avc1", "h264"))
+
+
+def _is_aac(codec: str | None) -> bool:
+    return bool(codec) and codec.lower().startswith(("mp4a", "aac"))
+
+
+def _ffmpeg_info(path: str) -> str:
+    """Вывод `ffmpeg -i` (ffprobe в imageio_ffmpeg нет)."""
+    proc = subprocess.run(
+        [ffmpeg_exe(), "-hide_banner", "-i", path],
+        capture_output=True,
+        text=True,
+        errors="replace",
+    )
+    return proc.stderr
+
+
+def probe_codecs(path: str) -> tuple[str | None, str | None]:
+    """Кодеки видео/аудио файла."""
+    out = _ffmpeg_info(path)
+    video = re.search(r"Stream #\S+.*?: Video: (\w+)", out)
+    audio = re.search(r"Stream #\S+.*?: Audio: (\w+)", out)
+    return (video.group(1) if video else None, audio.group(1) if audio else None)
+
+
+def probe_duration(path: str) -> float | None:
+    m = re.search(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", _ffmpeg_info(path))
+    if not m:
+        return None
+    return int(m.group(1)) * 3600 + int(m.group(2)) * 60 + float(m.group(3))
+
+
+def estimate_size(f: dict, duration: float | None) -> float | None:
+    """Размер формата в байтах: точный, приблизительный или из битрейта × длительность."""
+    size = f.get("filesize") or f.get("filesize_approx")
+    if size:
+        return size
+    if f.get("tbr") and duration:
+        return f["tbr"] * 1000 / 8 * duration
     return None
 
 
+def compress_to_size(path: str, max_bytes: int, duration: float | None = None) -> str:
+    """Сжимает видео под лимит по целевому битрейту (H.264/AAC).
+
+    Ограничено: не больше двух проходов (второй с запасом) и COMPRESS_TIMEOUT
+    на каждый. Если нужный битрейт ниже MIN_VIDEO_KBPS — VideoTooLarge.
+    """
+    started = time.monotonic()
+    size = os.path.getsize(path)
+    duration = duration or probe_duration(path)
+    if not duration:
+        raise VideoTooLarge(size)
+
+    base, _ = os.path.splitext(path)
+    tmp_path = base + ".small.mp4"
+    for factor in (0.92, 0.8):
+        video_kbps = int(max_bytes * 8 / 1000 / duration * factor) - COMPRESS_AUDIO_KBPS
+        if video_kbps < MIN_VIDEO_KBPS:
+            break
+        args = ["-c:v", "libx264", "-preset", "veryfast", "-b:v", f"{video_kbps}k",
+                "-maxrate", f"{video_kbps}k", "-bufsize", f"{video_kbps * 2}k", "-pix_fmt", "yuv420p",
+                "-c:a", "aac", "-b:a", f"{COMPRESS_AUDIO_KBPS}k"]
+        if video_kbps < 1500:
+            # На низком битрейте меньшая сторона не больше 720 — иначе каша
+            args += ["-vf", "scale='trunc(min(1,720/min(iw,ih))*iw/2)*2':-2"]
+        try:
+            subprocess.run(
+                [ffmpeg_exe(), "-hide_banner", "-loglevel", "error", "-y", "-i", path,
+                 *args, "-movflags", "+faststart", tmp_path],
+                check=True,
+                capture_output=True,
+                timeout=COMPRESS_TIMEOUT,
+            )
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        if os.path.getsize(tmp_path) <= max_bytes:
+            result = base + ".mp4"
+            os.replace(tmp_path, result)
+            if result != path:
+                os.remove(path)
+            print(f"Сжатие {os.path.basename(result)}: {size} -> {os.path.getsize(result)} байт "
+                  f"({video_kbps} кбит/с) за {time.monotonic() - started:.1f} с")
+            return result
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    raise VideoTooLarge(size)
+
+
+def ensure_telegram_mp4(path: str, vcodec: str | None = None, acodec: str | None = None) -> str:
+    """Приводит файл к MP4 с H.264/AAC, делая минимально необходимую работу.
+
+    - уже mp4 + H.264/AAC — файл не трогаем;
+    - кодеки подходят, контейнер нет — ремакс без перекодирования (-c copy);
+    - видео H.264, звук нет — перекодируем только звук;
+    - иначе полное перекодирование.
+    Кодеки берутся из метаданных yt-dlp, неизвестные — из `ffmpeg -i`.
+    """
+    started = time.monotonic()
+    if vcodec in (None, "") or acodec in (None, ""):
+        probed_v, probed_a = probe_codecs(path)
+        vcodec = vcodec or probed_v or "none"
+        acodec = acodec or probed_a or "none"
+
+    video_ok = _is_h264(vcodec)
+    audio_ok = _is_aac(acodec) or acodec == "none"
+    is_mp4 = path.lower().endswith(".mp4")
+
+    if video_ok and audio_ok and is_mp4:
+        mode = "как есть"
+        args = None
+    elif video_ok and audio_ok:
+        mode = "ремакс"
+        args = ["-c", "copy"]
+    elif video_ok:
+        mode = "перекодирование звука"
+        args = ["-c:v", "copy", "-c:a", "aac", "-b:a", "128k"]
+    else:
+        mode = "перекодирование"
+        args = ["-c:v", "libx264", "-preset", "veryfast", "-crf", "23", "-pix_fmt", "yuv420p",
+                "-c:a", "aac", "-b:a", "128k"]
+
+    result = path
+    if args is not None:
+        base, _ = os.path.splitext(path)
+        tmp_path = base + ".tg.mp4"
+        try:
+            subprocess.run(
+                [ffmpeg_exe(), "-hide_banner", "-loglevel", "error", "-y", "-i", path,
+                 *args, "-movflags", "+faststart", tmp_path],
+                check=True,
+                capture_output=True,
+            )
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        result = base + ".mp4"
+        os.replace(tmp_path, result)
+        if result != path:
+            os.remove(path)
+
+    print(f"Постобработка ({mode}, {vcodec}/{acodec}) {os.path.basename(result)}: {time.monotonic() - started:.1f} с")
+    return result
+
+
+def run_hedged(
+    attempts: list[tuple[str, Callable[[threading.Event], str | None]]],
+    delay: float,
+    deadline: float,
+    max_parallel: int,
+    cleanup: Callable[[int, str | None], None],
+    fatal: tuple[type[Exception], ...] = (),
+) -> str | None:
+    """Хеджированный запуск попыток: первая успешная побеждает, остальные отменяются.
+
+    Попытка i стартует сразу после неудачи предыдущей или через `delay` секунд,
+    если ответа ещё нет. `deadline` — момент time.monotonic(), после которого
+    ждать перестаём. Проигравшим выставляется cancel-событие, а
+    cleanup(i, result) вызывается для каждой из них после её фактического завершения.
+    Исключения из `fatal` останавливают все попытки и пробрасываются наружу.
+    """
+    cancel = threading.Event()
+    pool = ThreadPoolExecutor(max_workers=max_parallel, thread_name_prefix="hedge")
+    running: dict = {}
+    next_idx = 0
+    next_launch = 0.0
+    winner = None
+    winner_idx = None
+
+    def launch() -> None:
+        nonlocal next_idx, next_launch
+        name, fn = attempts[next_idx]
+        running[pool.submit(fn, cancel)] = next_idx
+        next_idx += 1
+        next_launch = time.monotonic() + delay
+
+    try:
+        while winner is None:
+            now = time.monotonic()
+            if now >= deadline:
+                print("Дедлайн загрузки истёк")
+                break
+            can_launch = next_idx < len(attempts) and len(running) < max_parallel
+            if can_launch and (not running or now >= next_launch):
+                launch()
+                continue
+            if not running:
+                break
+            timeout = deadline - now
+            if can_launch:
+                timeout = min(timeout, next_launch - now)
+            done, _ = wait(list(running), timeout=max(timeout, 0), return_when=FIRST_COMPLETED)
+            for fut in done:
+                idx = running.pop(fut)
+                try:
+                    result = fut.result()
+                except fatal:
+                    cleanup(idx, None)
+                    raise
+                except Exception as e:
+                    print(f"{attempts[idx][0]}: ошибка - {e}")
+                    result = None
+                if result and winner is None:
+                    winner, winner_idx = result, idx
+                else:
+                    cleanup(idx, result)
+    finally:
+        cancel.set()
+        # Проигравшие потоки не убить: они выходят на ближайшем progress hook,
+        # а их файлы удаляются после фактического завершения
+        for fut, idx in running.items():
+            fut.add_done_callback(lambda f, i=idx: cleanup(i, None if f.cancelled() or f.exception() else f.result()))
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    if winner is not None:
+        print(f"Победил подход: {attempts[winner_idx][0]}")
+    return winner
+
+
+class _YdlContext:
+    """YoutubeDL под одну платформу и набор заголовков, переживающий загрузки.
+
+    Экстракторы, cookie jar и пул HTTP-соединений yt-dlp создаются один раз.
+    Перед каждой операцией меняются только шаблон имени, формат и хуки.
+    """
+
+    __slots__ = ("ydl", "hooks", "_selectors")
+
+    def __init__(self, headers: dict | None):
+        self.ydl = yt_dlp.YoutubeDL(VideoDownloader._base_opts(headers))
+        self.ydl.add_progress_hook(self._on_progress)
+        self.hooks: list[Callable[[dict], None]] = []
+        self._selectors: dict[str, Callable] = {}
+
+    def _on_progress(self, d: dict) -> None:
+        for hook in self.hooks:
+            hook(d)
+
+    def prepare(
+        self, outtmpl: str, fmt: str, merge_output_format: str | None = None, max_filesize: int | None = None
+    ) -> None:
+        params = self.ydl.params
+        params["outtmpl"]["default"] = outtmpl
+        params["format"] = fmt
+        params["merge_output_format"] = merge_output_format
+        params["max_filesize"] = max_filesize
+        # Разбор строки формата тоже кэшируем: набор форматов невелик
+        selector = self._selectors.get(fmt)
+        if selector is None:
+            selector = self._selectors[fmt] = self.ydl.build_format_selector(fmt)
+        self.ydl.format_selector = selector
+
+    def reset(self) -> None:
+        # Формат по умолчанию: probe (extract_info без скачивания) не должен наследовать чужой
+        self.hooks = []
+        self.ydl.params["format"] = None
+        self.ydl.params["merge_output_format"] = None
+        self.ydl.params["max_filesize"] = None
+        self.ydl.format_selector = None
+
+
+class YdlPool:
+    """Готовые экземпляры YoutubeDL по ключу (платформа, заголовки стратегии).
+
+    Экземпляр берётся на одну операцию (он не потокобезопасен) и затем
+    возвращается; параллельные попытки с одним ключом получают разные
+    экземпляры. Свободных на ключ хранится не больше max_idle.
+    """
+
+    def __init__(self, max_idle: int = 2):
+        self.max_idle = max_idle
+        self.created = 0
+        self.reused = 0
+        self._idle: dict[tuple, list[_YdlContext]] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def lease(self, platform: str, headers: dict | None = None):
+        key = (platform, tuple(sorted((headers or {}).items())))
+        with self._lock:
+            idle = self._idle.get(key)
+            ctx = idle.pop() if idle else None
+            if ctx is None:
+                self.created += 1
+            else:
+                self.reused += 1
+        if ctx is None:
+            ctx = _YdlContext(headers)
+        try:
+            yield ctx
+        finally:
+            ctx.reset()
+            with self._lock:
+                idle = self._idle.setdefault(key, [])
+                if len(idle) < self.max_idle:
+                    idle.append(ctx)
+                    ctx = None
+            if ctx is not None:
+                ctx.ydl.close()
+
+    def close(self) -> None:
+        with self._lock:
+            contexts = [ctx for idle in self._idle.values() for ctx in idle]
+            self._idle.clear()
+        for ctx in contexts:
+            ctx.ydl.close()
+
+
+ydl_pool = YdlPool()
+
+
 class VideoDownloader:
     @staticmethod
     def is_tiktok(url):
-        return 'tiktok.com' in url
+        ref = classify(url)
+        return ref is not None and ref[0] == TIKTOK
 
     @staticmethod
     def is_youtube_shorts(url):
-        u = url.lower()
-        return 'youtube.com/shorts/' in u or 'youtu.be/' in u or 'youtube.com/watch' in u
+        ref = classify(url)
+        return ref is not None and ref[0] == YOUTUBE
 
     @staticmethod
-    def download_youtube_shorts(url: str):
-        # На macOS/Python 3.13 иногда не подтягиваются корневые сертификаты.
-        # Пытаемся явно указать CA bundle из certifi.
-        os.environ.setdefault("SSL_CERT_FILE", certifi.where())
-        os.environ.setdefault("REQUESTS_CA_BUNDLE", certifi.where())
+    def _base_opts(headers: dict | None = None, retries: int = 3) -> dict:
+        opts = {
+            "noplaylist": True,
+            "quiet": True,
+            "no_warnings": True,
+            "socket_timeout": 30,
+            "retries": retries,
+            "fragment_retries": retries,
+            "concurrent_fragment_downloads": FRAGMENT_CONCURRENCY,
+            # Подкладываем ffmpeg без Homebrew
+            "ffmpeg_location": ffmpeg_exe(),
+        }
+        # Добавляем headers для обхода блокировки
+        if headers:
+            opts["http_headers"] = headers
+        return opts
 
-        os.makedirs("downloads", exist_ok=True)
+    @staticmethod
+    def probe(url: str, headers: dict | None = None) -> dict | None:
+        """Один extract_info(download=False): метаданные и список форматов без скачивания.
 
-        # yt-dlp намного стабильнее pytube.
-        # Проблема "только звук" возникает, когда выбран аудио-only формат.
-        # Поэтому:
-        # 1) сначала пробуем progressive MP4 (видео+аудио в одном файле) — ffmpeg не нужен
-        # 2) если не получилось — пробуем bestvideo+bestaudio (нужен ffmpeg для склейки)
-
-        outtmpl = os.path.join("downloads", "%(id)s.%(ext)s")
-        ffmpeg_path = imageio_ffmpeg.get_ffmpeg_exe()
-
-        def _download_with_format(fmt: str, need_merge: bool, force_mp4: bool, headers: dict = None):
-            ydl_opts = {
-                "outtmpl": outtmpl,
-                "format": fmt,
-                "noplaylist": True,
-                "quiet": True,
-                "no_warnings": True,
-                "socket_timeout": 30,
-                "retries": 3,
-                "fragment_retries": 3,
-            }
-            # Добавляем headers для обхода блокировки
-            if headers:
-                ydl_opts["http_headers"] = headers
-            # Подкладываем ffmpeg без Homebrew
-            ydl_opts["ffmpeg_location"] = ffmpeg_path
+        Результат кэшируется на PROBE_TTL секунд по (url, User-Agent).
+        """
+        key = (url, (headers or {}).get("User-Agent", ""))
+        now = time.time()
+        with _probe_lock:
+            cached = _probe_cache.get(key)
+            if cached and now - cached[0] < PROBE_TTL:
+                return cached[1]
+            # Заодно выбрасываем протухшие записи
+            for k in [k for k, (ts, _) in _probe_cache.items() if now - ts >= PROBE_TTL]:
+                del _probe_cache[k]
+
+        started = time.monotonic()
+        with ydl_pool.lease(platform_of(url), headers) as ctx:
+            info = ctx.ydl.extract_info(url, download=False)
+            # Плейлист/подборка: берём первое видео
+            if info and info.get("_type") == "playlist":
+                info = next((e for e in info.get("entries") or [] if e), None)
+            if info:
+                # Куки, выставленные при probe, есть только в jar этого экземпляра,
+                # а скачивание может получить из пула другой
+                for f in info.get("formats") or []:
+                    if f.get("url") and f.get("protocol") in ("http", "https"):
+                        cookie = ctx.ydl.cookiejar.get_cookie_header(f["url"])
+                        if cookie:
+                            f["_cookie"] = cookie
+        stage_seconds.observe(time.monotonic() - started, stage="probe", platform=platform_of(url))
+        if not info:
+            return None
+
+        with _probe_lock:
+            _probe_cache[key] = (time.time(), info)
+        return info
+
+    @staticmethod
+    def format_candidates(info: dict, max_bytes: int | None = UPLOAD_LIMIT_BYTES) -> list[str]:
+        """Выбирает форматы из метаданных, от лучшего для Telegram к запасным.
+
+        Telegram надёжно играет только MP4 с H.264 + AAC: VP9/AV1/HEVC в mp4
+        на части клиентов показываются как "только звук".
+        В каждой группе берётся лучший формат, который по filesize/filesize_approx
+        помещается в max_bytes; неизвестный размер считается подходящим.
+        Если не помещается ничего, в конце идут самые маленькие варианты
+        (их сожмёт compress_to_size), а если и они больше лимита в
+        COMPRESS_MAX_FACTOR раз — VideoTooLarge ещё до скачивания.
+        """
+        formats = [f for f in info.get("formats") or [] if f.get("format_id")]
+        if not formats:
+            return ["best"]
+        duration = info.get("duration")
+
+        # None = кодек неизвестен (часто у TikTok), "none" = дорожки нет
+        def has_video(f):
+            return (f.get("vcodec") or "").lower() != "none"
+
+        def has_audio(f):
+            return (f.get("acodec") or "").lower() != "none"
+
+        def is_h264(f):
+            return (f.get("vcodec") or "").lower().startswith(("avc1", "h264"))
+
+        def is_aac(f):
+            return (f.get("acodec") or "").lower().startswith(("mp4a", "aac"))
+
+        def quality(f):
+            return (f.get("height") or 0, f.get("tbr") or 0)
+
+        def audio_quality(f):
+            return f.get("abr") or f.get("tbr") or 0
+
+        def total_size(*fs):
+            sizes = [estimate_size(f, duration) for f in fs]
+            return None if None in sizes else sum(sizes)
+
+        def fits(*fs):
+            total = total_size(*fs)
+            return max_bytes is None or total is None or total <= max_bytes
 
-            if need_merge:
-                ydl_opts["merge_output_format"] = "mp4"
+        def smallest(fs):
+            return min(fs, key=lambda f: total_size(f) or 0)
+
+        candidates: list[str] = []
+        # (размер, формат) — варианты больше лимита, кандидаты на сжатие
+        oversized: list[tuple[float, str]] = []
+
+        def add_single(fs):
+            if not fs:
+                return
+            fitting = [f for f in fs if fits(f)]
+            if fitting:
+                candidates.append(max(fitting, key=quality)["format_id"])
+            else:
+                f = smallest(fs)
+                oversized.append((total_size(f), f["format_id"]))
+
+        def add_pair(videos, audios):
+            if not videos or not audios:
+                return
+            for a in (max(audios, key=audio_quality), smallest(audios)):
+                fitting = [v for v in videos if fits(v, a)]
+                if fitting:
+                    candidates.append(f"{max(fitting, key=quality)['format_id']}+{a['format_id']}")
+                    return
+            v, a = smallest(videos), smallest(audios)
+            oversized.append((total_size(v, a), f"{v['format_id']}+{a['format_id']}"))
+
+        progressive = [f for f in formats if has_video(f) and has_audio(f)]
+        video_only = [f for f in formats if has_video(f) and not has_audio(f)]
+        audio_only = [f for f in formats if has_audio(f) and not has_video(f)]
+
+        add_single([f for f in progressive if f.get("ext") == "mp4" and is_h264(f) and (is_aac(f) or not f.get("acodec"))])
+        add_pair([f for f in video_only if f.get("ext") == "mp4" and is_h264(f)], [f for f in audio_only if is_aac(f)])
+        # Запасные варианты (понадобится перекодирование)
+        add_single(progressive)
+        add_pair(video_only, audio_only)
+
+        if not candidates and oversized:
+            min_size = min(size for size, _ in oversized)
+            if max_bytes is not None and min_size > max_bytes * COMPRESS_MAX_FACTOR:
+                raise VideoTooLarge(int(min_size))
+        candidates += [fmt for _, fmt in sorted(oversized)]
+
+        return list(dict.fromkeys(candidates)) or ["best"]
+
+    @staticmethod
+    def download_format(
+        info: dict,
+        fmt: str,
+        outtmpl: str,
+        headers: dict | None = None,
+        force_mp4: bool = False,
+        cancel: threading.Event | None = None,
+        max_bytes: int | None = UPLOAD_LIMIT_BYTES,
+    ):
+        """Скачивает ровно один выбранный формат по уже полученным метаданным (без повторного extract).
 
+        Файл больше max_bytes сжимается (заодно в H.264/AAC, отдельная постобработка не нужна).
+        """
+        need_merge = "+" in fmt
+        hooks = [functools.partial(_report_progress, cancel=cancel)]
+        if cancel is not None:
+            def _check_cancel(d):
+                # Исключение из progress hook прерывает загрузку yt-dlp
+                if cancel.is_set():
+                    raise yt_dlp.utils.DownloadCancelled("отменено: победил другой подход")
+            hooks.insert(0, _check_cancel)
+
+        platform = platform_of(info.get("extractor_key") or info.get("extractor"))
+        started = time.monotonic()
+        with ydl_pool.lease(platform, headers) as ctx:
+            ctx.prepare(outtmpl, fmt, "mp4" if need_merge else None)
+            ctx.hooks = hooks
+            result = VideoDownloader._ranged_download(ctx, info, fmt, cancel)
+            if result is None:
+                result = ctx.ydl.process_ie_result(copy.deepcopy(info), download=True)
+            if not result:
+                return None
+
+            # Когда формат составной (v+a), после merge расширение обычно mp4.
+            path = ctx.ydl.prepare_filename(result)
+
+        base, _ = os.path.splitext(path)
+        mp4_path = base + ".mp4"
+        if need_merge:
+            # Если merge не произошёл (обычно из-за отсутствия ffmpeg),
+            # НЕ возвращаем аудио-файл — иначе в Telegram будет "только звук".
+            if not os.path.exists(mp4_path):
+                return None
+            path = mp4_path
+        elif os.path.exists(mp4_path):
+            path = mp4_path
+        elif not (path and os.path.exists(path)):
+            return None
+
+        size = os.path.getsize(path)
+        stage_seconds.observe(time.monotonic() - started, stage="download", platform=platform)
+        bytes_downloaded_total.inc(size, platform=platform)
+
+        started = time.monotonic()
+        if max_bytes is not None and size > max_bytes:
+            path = compress_to_size(path, max_bytes, info.get("duration"))
+        elif force_mp4:
             # Важно для Telegram: иногда mp4 с VP9/AV1 ведёт себя как "только звук".
-            # Поэтому принудительно ремаксим/перекодируем в mp4 (H.264/AAC).
-            if force_mp4:
-                ydl_opts["postprocessors"] = [
-                    {"key": "FFmpegVideoRemuxer", "preferedformat": "mp4"},
-                    {"key": "FFmpegVideoConvertor", "preferedformat": "mp4"},
-                ]
-
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
-                if not info:
-                    return None
+            # Перекодируем только если кодеки действительно не подходят.
+            path = ensure_telegram_mp4(path, result.get("vcodec"), result.get("acodec"))
+        else:
+            return path
+        stage_seconds.observe(time.monotonic() - started, stage="transcode", platform=platform)
+        return path
 
-                # Когда формат составной (v+a), после merge расширение обычно mp4.
-                path = ydl.prepare_filename(info)
+    @staticmethod
+    def _ranged_download(ctx: _YdlContext, info: dict, fmt: str, cancel: threading.Event | None) -> dict | None:
+        """Параллельная загрузка одиночного прямого формата по диапазонам.
 
-                # После postprocessors итоговый файл почти всегда .mp4
-                base, _ = os.path.splitext(path)
-                mp4_path = base + ".mp4"
-                if force_mp4 and os.path.exists(mp4_path):
-                    return mp4_path
-                if need_merge:
-                    merged = mp4_path
-                    # Если merge не произошёл (обычно из-за отсутствия ffmpeg),
-                    # НЕ возвращаем аудио-файл — иначе в Telegram будет "только звук".
-                    return merged if os.path.exists(merged) else None
+        Возвращает метаданные скачанного формата (как process_ie_result) или
+        None — формат не подходит или загрузка не удалась, качает yt-dlp.
+        """
+        if RANGED_PARALLEL < 2:
+            return None
+        f = next((f for f in info.get("formats") or [] if f.get("format_id") == fmt), None)
+        if f is None or f.get("protocol") not in ("http", "https") or not f.get("url"):
+            return None
+        estimate = estimate_size(f, info.get("duration"))
+        if estimate is not None and estimate < RANGED_MIN_MB * 1024 * 1024:
+            return None
+
+        url = f["url"]
+        headers = dict(f.get("http_headers") or {})
+        # Куки, выставленные при probe (TikTok без них отдаёт 403)
+        cookie = f.get("_cookie") or ctx.ydl.cookiejar.get_cookie_header(url)
+        if cookie:
+            headers["Cookie"] = cookie
+        try:
+            size = f.get("filesize") or probe_size(url, headers)
+        except RangedFetchError as e:
+            print(f"Параллельная загрузка {fmt} недоступна: {e}")
+            return None
+        if size < RANGED_MIN_MB * 1024 * 1024:
+            return None
+
+        # Как в process_info: поля выбранного формата поверх общих метаданных
+        result = {**info, **f}
+        path = ctx.ydl.prepare_filename(result)
+
+        def on_progress(done: int, total: int) -> None:
+            _report_progress({"status": "downloading", "downloaded_bytes": done, "total_bytes": total}, cancel)
+
+        started = time.monotonic()
+        try:
+            fetch_ranges(
+                url, path, size, headers,
+                chunk_size=int(RANGED_CHUNK_MB * 1024 * 1024),
+                parallel=RANGED_PARALLEL,
+                on_progress=on_progress,
+                cancel=cancel,
+            )
+        except FetchCancelled:
+            raise yt_dlp.utils.DownloadCancelled("отменено: победил другой подход")
+        except RangedFetchError as e:
+            print(f"Параллельная загрузка {fmt} не удалась, качаем обычно: {e}")
+            return None
+        print(f"Параллельная загрузка {fmt}: {size} байт за {time.monotonic() - started:.1f} с")
+        return result
+
+    @staticmethod
+    def _stream_plan(info: dict, fmt: str) -> dict | None:
+        """Источник для потоковой отправки (без файла на диске) или None.
 
-                return path if path and os.path.exists(path) else None
+        Строится по уже полученным метаданным и выбранному формату, без
+        отдельного probe. Годится только формат, который не нужно ни склеивать,
+        ни перекодировать, ни сжимать: один прямой MP4 с H.264/AAC, заведомо
+        в лимите Telegram.
+        """
+        f = next((f for f in info.get("formats") or [] if f.get("format_id") == fmt), None)
+        if (
+            f is None
+            or f.get("protocol") not in ("http", "https")
+            or f.get("ext") != "mp4"
+            or not (_is_h264(f.get("vcodec")) and _is_aac(f.get("acodec")))
+        ):
+            return None
+        size = f.get("filesize")
+        estimate = size or estimate_size(f, info.get("duration"))
+        # Приблизительный размер — с запасом: превышение лимита заметно только в конце отправки
+        if not estimate or estimate > (UPLOAD_LIMIT_BYTES if size else UPLOAD_LIMIT_BYTES * 0.9):
+            return None
+
+        headers = dict(f.get("http_headers") or {})
+        # Куки из jar экземпляра, который делал probe (см. probe)
+        if f.get("_cookie"):
+            headers["Cookie"] = f["_cookie"]
+        return {
+            "url": f["url"],
+            "headers": headers,
+            "size": size,
+            "filename": f"{info.get('id') or 'video'}.mp4",
+            "duration": int(info["duration"]) if info.get("duration") else None,
+            "width": f.get("width"),
+            "height": f.get("height"),
+        }
+
+    @staticmethod
+    def download_youtube_shorts(url: str, stream: bool = False):
+        """Скачивает YouTube видео; возвращает путь к файлу или None.
+
+        stream=True: если подход, стоящий первым по статистике, получил формат,
+        пригодный для потоковой отправки, вместо загрузки возвращается план
+        (dict, см. _stream_plan) — по тому же probe, без повторного extract_info.
+        """
+        os.makedirs("downloads", exist_ok=True)
+
+        # yt-dlp намного стабильнее pytube.
+        # Проблема "только звук" возникает, когда выбран аудио-only формат.
+        # Поэтому формат выбирается по метаданным (один extract_info без скачивания):
+        # 1) progressive MP4 (видео+аудио в одном файле) — ffmpeg не нужен
+        # 2) bestvideo+bestaudio (нужен ffmpeg для склейки)
+
+        deadline = time.monotonic() + DOWNLOAD_DEADLINE
 
         # Пробуем разные подходы для обхода блокировки
         approaches = [
@@ -115,130 +773,203 @@ class VideoDownloader:
             ("YouTube Music UA", {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36"}),
             ("Smart TV UA", {"User-Agent": "Mozilla/5.0 (CrKey armv7l 1.5.16041) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/31.0.1650.0 Safari/537.36"})
         ]
-        
-        for approach_name, headers in approaches:
-            try:
+        # Сначала подходы с лучшей статистикой; упорно падающие — в конце
+        by_name = dict(approaches)
+        approaches = [(name, by_name[name]) for name in strategy_stats.order("youtube", list(by_name))]
+
+        # У каждой попытки свой суффикс файла: параллельные подходы не пишут в один путь,
+        # а частичные файлы проигравших можно найти и удалить
+        job_tag = uuid.uuid4().hex[:8]
+        # Последний шанс — тоже со своим суффиксом: одно видео могут качать две задачи сразу
+        outtmpl = os.path.join("downloads", f"%(id)s.{job_tag}.%(ext)s")
+
+        def _attempt_tag(idx: int) -> str:
+            return f"{job_tag}{idx}"
+
+        def _make_attempt(idx: int, approach_name: str, headers: dict):
+            attempt_outtmpl = os.path.join("downloads", f"%(id)s.{_attempt_tag(idx)}.%(ext)s")
+
+            def _run(cancel: threading.Event):
                 print(f"Пробуем YouTube: {approach_name}")
-                
-                # 1) Сначала пытаемся взять сразу mp4 с H.264 + AAC
-                progressive_fmt = "best[ext=mp4][vcodec^=avc1][acodec^=mp4a]/best[ext=mp4][vcodec!=none][acodec!=none]"
-                p = _download_with_format(progressive_fmt, need_merge=False, force_mp4=True, headers=headers)
-                if p:
-                    print(f"YouTube ({approach_name}): {p}")
-                    return p
-                
-                # 2) Fallback: bestvideo + bestaudio
-                merge_fmt = "bestvideo[vcodec^=avc1]+bestaudio[acodec^=mp4a]/bestvideo+bestaudio"
-                p = _download_with_format(merge_fmt, need_merge=True, force_mp4=True, headers=headers)
-                if p:
-                    print(f"YouTube ({approach_name}): {p}")
+                info = VideoDownloader.probe(url, headers)
+                if not info:
+                    return None
+                candidates = VideoDownloader.format_candidates(info)
+                if stream and idx == 0:
+                    plan = VideoDownloader._stream_plan(info, candidates[0])
+                    if plan:
+                        return plan
+                for fmt in candidates[:2]:
+                    if cancel.is_set():
+                        return None
+                    try:
+                        p = VideoDownloader.download_format(
+                            info, fmt, attempt_outtmpl, headers=headers, force_mp4=True, cancel=cancel
+                        )
+                    except yt_dlp.utils.DownloadCancelled:
+                        return None
+                    if p:
+                        print(f"YouTube ({approach_name}, {fmt}): {p}")
+                        return p
+                return None
+
+            def _attempt(cancel: threading.Event):
+                started = time.monotonic()
+                p = None
+                too_large = False
+                cause = "no_file"
+                try:
+                    p = _run(cancel)
                     return p
-                    
-            except Exception as e:
-                print(f"YouTube ({approach_name}): ошибка - {e}")
-                continue
-        
+                except VideoTooLarge:
+                    too_large = True
+                    raise
+                except Exception as e:
+                    cause = _failure_cause(e)
+                    raise
+                finally:
+                    # Отменённая проигравшая попытка или слишком большое видео — не неудача подхода
+                    if not too_large and (p or not cancel.is_set()):
+                        strategy_stats.record("youtube", approach_name, bool(p), time.monotonic() - started)
+                        if not p:
+                            failures_total.inc(platform="youtube", cause=cause, strategy=approach_name)
+
+            return approach_name, _attempt
+
+        def _cleanup(idx: int, result: str | None) -> None:
+            for leftover in glob.glob(os.path.join("downloads", f"*.{_attempt_tag(idx)}.*")):
+                try:
+                    os.remove(leftover)
+                except OSError:
+                    pass
+
+        p = run_hedged(
+            [_make_attempt(i, name, headers) for i, (name, headers) in enumerate(approaches)],
+            delay=YT_HEDGE_DELAY,
+            deadline=deadline,
+            max_parallel=YT_HEDGE_PARALLEL,
+            cleanup=_cleanup,
+            fatal=(VideoTooLarge,),
+        )
+        if p:
+            return p
+
+        if time.monotonic() >= deadline:
+            return None
+
         # Если все User-Agent не сработали, пробуем TikTok API как fallback
         try:
             print("Пробуем TikTok API для YouTube...")
-            return VideoDownloader.download_tiktok(url)
+            p = VideoDownloader.download_tiktok(url)
+            if p:
+                return p
+        except VideoTooLarge:
+            raise
         except Exception as e:
             print(f"TikTok fallback тоже не сработал: {e}")
-            
+
+        if time.monotonic() >= deadline:
+            return None
+
         # Последний шанс - пробуем без ограничений
         try:
             print("Пробуем YouTube без ограничений...")
-            ydl_opts = {
-                "outtmpl": outtmpl,
-                "format": "best",
-                "noplaylist": True,
-                "quiet": True,
-                "no_warnings": True,
-                "socket_timeout": 15,
-                "retries": 1,
-                "fragment_retries": 1,
-            }
-            
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
-                if info:
-                    path = ydl.prepare_filename(info)
-                    base, _ = os.path.splitext(path)
-                    mp4_path = base + ".mp4"
-                    
-                    if os.path.exists(mp4_path):
-                        print(f"YouTube без ограничений: {mp4_path}")
-                        return mp4_path
-                    elif os.path.exists(path):
-                        print(f"YouTube без ограничений: {path}")
-                        return path
+            with ydl_pool.lease("youtube") as ctx:
+                # Заведомо несжимаемое не качаем
+                ctx.prepare(outtmpl, "best", max_filesize=int(UPLOAD_LIMIT_BYTES * COMPRESS_MAX_FACTOR))
+                ctx.hooks = [_report_progress]
+                info = ctx.ydl.extract_info(url, download=True)
+                path = ctx.ydl.prepare_filename(info) if info else None
+            if path:
+                base, _ = os.path.splitext(path)
+                mp4_path = base + ".mp4"
+
+                if os.path.exists(mp4_path):
+                    path = mp4_path
+                if os.path.exists(path):
+                    if os.path.getsize(path) > UPLOAD_LIMIT_BYTES:
+                        path = compress_to_size(path, UPLOAD_LIMIT_BYTES, info.get("duration"))
+                    print(f"YouTube без ограничений: {path}")
+                    return path
+        except VideoTooLarge:
+            raise
         except Exception as e:
             print(f"Последний шанс тоже не сработал: {e}")
 
         return None
 
     @staticmethod
-    def download_tiktok(url: str):
-        """Скачивает TikTok видео через yt-dlp с несколькими попытками."""
+    def download_tiktok(url: str, stream: bool = False):
+        """Скачивает TikTok видео через yt-dlp: один probe, затем только выбранный формат.
+
+        stream=True: если выбранный формат пригоден для потоковой отправки,
+        вместо загрузки возвращается план (dict, см. _stream_plan).
+        """
 
         os.makedirs("downloads", exist_ok=True)
-        
-        # На macOS/Python 3.13 иногда не подтягиваются корневые сертификаты.
-        os.environ.setdefault("SSL_CERT_FILE", certifi.where())
-        os.environ.setdefault("REQUESTS_CA_BUNDLE", certifi.where())
-        
-        # Пробуем несколько форматов от простого к сложному
-        formats = [
+
+        # Суффикс задачи: одно и то же видео (например, по двум неразвёрнутым
+        # коротким ссылкам) могут качать две задачи сразу, пути не должны совпасть
+        outtmpl = os.path.join("downloads", f"tiktok_%(id)s.{uuid.uuid4().hex[:8]}.%(ext)s")
+
+        try:
+            info = VideoDownloader.probe(url)
+        except Exception as e:
+            print(f"TikTok: не удалось получить информацию - {e}")
+            return None
+        if not info:
+            print("TikTok: не удалось получить информацию")
+            return None
+
+        # "auto" — формат, выбранный по метаданным, остальные — запасные варианты
+        # (без повторного extract_info — только скачивание). Порядок — по статистике.
+        strategies = [
+            "auto",
             "best",                        # лучший доступный (самый надежный)
+            "best[height<=720]",           # любой до 720p
             "worst",                       # худший (если лучший не работает)
-            "best[height<=720]",          # любой до 720p
-            "best[ext=mp4]",               # любой MP4
         ]
-        
-        for fmt in formats:
-            try:
-                print(f"Пробуем формат {fmt} для {url}")
-                
-                outtmpl = os.path.join("downloads", "tiktok_%(id)s.%(ext)s")
-                ffmpeg_path = imageio_ffmpeg.get_ffmpeg_exe()
-                
-                ydl_opts = {
-                    "outtmpl": outtmpl,
-                    "format": fmt,
-                    "noplaylist": True,
-                    "quiet": True,
-                    "no_warnings": True,
-                    "socket_timeout": 30,
-                    "retries": 2,
-                    "fragment_retries": 2,
-                    "ffmpeg_location": ffmpeg_path,
-                    # Убираем postprocessors для надежности
-                }
-                
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    info = ydl.extract_info(url, download=True)
-                    if not info:
-                        print(f"Формат {fmt}: не удалось получить информацию")
-                        continue
-                    
-                    # Ищем скачанный файл
-                    path = ydl.prepare_filename(info)
-                    base, _ = os.path.splitext(path)
-                    mp4_path = base + ".mp4"
-                    
-                    if os.path.exists(mp4_path):
-                        print(f"Успешно загружено через yt-dlp ({fmt}): {mp4_path}")
-                        return mp4_path
-                    elif os.path.exists(path):
+        tried: set[str] = set()
+        # Сразу: для заведомо слишком большого видео здесь VideoTooLarge без скачивания
+        auto_formats = VideoDownloader.format_candidates(info)
+        if stream:
+            plan = VideoDownloader._stream_plan(info, auto_formats[0])
+            if plan:
+                return plan
+
+        # Запасной путь для YouTube тоже идёт сюда: статистика — по платформе ссылки,
+        # иначе неудачи YouTube портили бы порядок и паузы стратегий TikTok
+        platform = platform_of(url)
+        for strategy in strategy_stats.order(platform, strategies):
+            fmts = auto_formats if strategy == "auto" else [strategy]
+            started = time.monotonic()
+            path = None
+            attempted = False
+            cause = "no_file"
+            for fmt in fmts:
+                if fmt in tried:
+                    continue
+                tried.add(fmt)
+                attempted = True
+                try:
+                    print(f"Пробуем формат {fmt} для {url}")
+                    path = VideoDownloader.download_format(info, fmt, outtmpl)
+                    if path:
                         print(f"Успешно загружено через yt-dlp ({fmt}): {path}")
-                        return path
-                    else:
-                        print(f"Формат {fmt}: файл не найден после загрузки")
-                        continue
-                        
-            except Exception as e:
-                print(f"Формат {fmt}: ошибка - {e}")
-                continue
-                
+                        break
+                    print(f"Формат {fmt}: файл не найден после загрузки")
+                except VideoTooLarge:
+                    raise
+                except Exception as e:
+                    cause = _failure_cause(e)
+                    print(f"Формат {fmt}: ошибка - {e}")
+            # Стратегия, все форматы которой уже пробовали другие, не оценивается
+            if attempted:
+                strategy_stats.record(platform, strategy, path is not None, time.monotonic() - started)
+                if path is None:
+                    failures_total.inc(platform=platform, cause=cause, strategy=strategy)
+            if path:
+                return path
+
         print("Все форматы TikTok не сработали")
         return None
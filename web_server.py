@@ -0,0 +1,104 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable
+
+logger = logging.getLogger(__name__)
+
+# (статус, content-type, тело)
+Response = tuple[int, str, bytes]
+Handler = Callable[[bytes, dict[str, str]], Awaitable[Response]]
+
+_REASONS = {
+    200: "OK",
+    400: "Bad Request",
+    403: "Forbidden",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+}
+
+
+class WebServer:
+    """Минимальный HTTP/1.1 сервер на asyncio: health-check, вебхук Telegram и т.п. на одном порту.
+
+    Работает в цикле событий бота, без отдельного потока. Соединения
+    keep-alive (Telegram держит их открытыми между апдейтами).
+    """
+
+    def __init__(self, host: str, port: int, max_body: int = 1024 * 1024, idle_timeout: float = 75):
+        self.host = host
+        self.port = port
+        self.max_body = max_body
+        self.idle_timeout = idle_timeout
+        self._routes: dict[tuple[str, str], Handler] = {}
+        self._server: asyncio.AbstractServer | None = None
+
+    def route(self, method: str, path: str, handler: Handler) -> None:
+        self._routes[(method.upper(), path)] = handler
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(self._serve, self.host, self.port)
+        logger.info("HTTP-сервер слушает %s:%d", self.host, self.port)
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while await self._handle_one(reader, writer):
+                pass
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def _handle_one(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> bool:
+        """Обрабатывает один запрос; False — соединение пора закрыть."""
+        request_line = await asyncio.wait_for(reader.readline(), self.idle_timeout)
+        if not request_line:
+            return False
+        method, target, version = request_line.decode("latin-1").split(" ", 2)
+        headers: dict[str, str] = {}
+        while True:
+            line = await asyncio.wait_for(reader.readline(), self.idle_timeout)
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        keep_alive = version.strip() == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+        length = int(headers.get("content-length", "0") or 0)
+        if length > self.max_body:
+            await self._respond(writer, (413, "text/plain", b"too large"), keep_alive=False)
+            return False
+        body = await reader.readexactly(length) if length else b""
+
+        path = target.split("?", 1)[0]
+        handler = self._routes.get((method.upper(), path))
+        if handler is None:
+            known_path = any(p == path for _, p in self._routes)
+            response: Response = (405, "text/plain", b"method not allowed") if known_path else (404, "text/plain", b"not found")
+        else:
+            try:
+                response = await handler(body, headers)
+            except Exception:
+                logger.exception("Ошибка обработчика %s %s", method, path)
+                response = (500, "text/plain", b"error")
+        await self._respond(writer, response, keep_alive)
+        return keep_alive
+
+    @staticmethod
+    async def _respond(writer: asyncio.StreamWriter, response: Response, keep_alive: bool) -> None:
+        status, content_type, body = response
+        head = (
+            f"HTTP/1.1 {status} {_REASONS.get(status, 'OK')}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin-1") + body)
+        await writer.drain()